@@ -0,0 +1,204 @@
+import contextlib
+import io
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from sqlalchemy import create_engine, text
+
+from api import schemas
+from api.services import benchmarking, vector_index
+from api.services.rag_service import (
+    LLMFactory,
+    OpenAISQLGenerator,
+    SchemaSummaryPromptStrategy,
+    SQLSchemaRetriever,
+    SQLTableRetriever,
+    generate_postgres_schemas,
+)
+from core import settings
+
+
+# Cada tamanho usa sua própria tabela vetorial, então um tenant fictício basta
+BENCH_DATABASE_ID = 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how SQLSchemaRetriever/SQLTableRetriever scale with the number of registered tables: "
+        "registration throughput, vector table size, retrieval latency and recall@k over synthetic "
+        "catalogs registered with the stub LLM and embedder."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+        parser.add_argument("--retriever", choices=["schema", "table"], default="schema",
+                            help="schema = minimal mode (SQLSchemaRetriever); table = complete mode "
+                                 "(SQLTableRetriever, creates real empty tables in a scratch database).")
+        parser.add_argument("--columns", type=int, default=8, help="Columns per synthetic table.")
+        parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per size.")
+        parser.add_argument("--top-k", type=int, default=3, help="k used for recall@k (retrievers keep an adaptive top-k, at most RETRIEVAL_MAX_K).")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--bench-db", default="luigui_bench_retrieval",
+                            help="Prefix of the scratch vector tables (and complete-mode databases), one per size.")
+        parser.add_argument("--reuse", action="store_true",
+                            help="Skip registration when the vector table already holds the catalog.")
+        parser.add_argument("--output", help="Write the JSON report to this path.")
+        parser.add_argument("--baseline", help="Previous JSON report to compare against.")
+
+    def handle(self, *args, **options):
+        results = []
+        with benchmarking.stub_llm_backend():
+            for size in options["sizes"]:
+                result = self._run_size(size, options)
+                results.append(result)
+                latency = result["retrieval_latency_ms"]
+                self.stdout.write(
+                    f"{options['retriever']:<6} tables={size:<7} "
+                    f"register={result['registration_tables_per_s'] or 0:.1f} tables/s "
+                    f"index={result['index_size_bytes'] / 1024 / 1024:.1f}MiB "
+                    f"p50={latency['p50']:.1f}ms p95={latency['p95']:.1f}ms p99={latency['p99']:.1f}ms "
+                    f"recall@{options['top_k']}={result['recall_at_k']:.3f} "
+                    f"k={result['mean_retrieved']:.2f}"
+                )
+
+        report = {
+            "meta": benchmarking.report_metadata(
+                benchmark="retrieval",
+                llm_backend="stub",
+                retriever=options["retriever"],
+                vector_index=vector_index.index_type(),
+                vector_index_options=vector_index.index_options(vector_index.index_type()),
+                columns=options["columns"],
+                queries=options["queries"],
+                top_k=options["top_k"],
+                seed=options["seed"],
+            ),
+            "results": results,
+        }
+        if options["output"]:
+            benchmarking.write_report(options["output"], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"Compared with {baseline.get('meta', {}).get('commit', '?')}:")
+            for line in benchmarking.compare_reports(
+                baseline, report, ("retriever", "tables"),
+                ("retrieval_latency_ms.p50", "retrieval_latency_ms.p95", "recall_at_k", "registration_tables_per_s"),
+            ):
+                self.stdout.write(f"  {line}")
+
+    def _run_size(self, size, options):
+        name = f"{options['bench_db']}_{size}"
+        rows, questions = benchmarking.generate_synthetic_catalog(size, options["columns"], options["seed"])
+        sql_generator = OpenAISQLGenerator(
+            llm=LLMFactory.create_llm("gpt-4o"),
+            prompt_strategy=SchemaSummaryPromptStrategy("postgresql"),
+        )
+
+        with benchmarking.vector_table(name) as vector_table:
+            return self._measure(name, size, rows, questions, sql_generator, vector_table, options)
+
+    def _measure(self, name, size, rows, questions, sql_generator, vector_table, options):
+        tables = list(questions)
+        if options["retriever"] == "schema":
+            retriever = SQLSchemaRetriever(name, sql_generator, BENCH_DATABASE_ID)
+            table_of = lambda node: node.metadata.get("table_name")
+        else:
+            cnt_str = self._connection(name)
+            self._create_database(cnt_str)
+            self._create_tables(cnt_str, rows)
+            retriever = SQLTableRetriever(cnt_str, sql_generator, tables=[], have_obj_index=False,
+                                          database_id=BENCH_DATABASE_ID)
+            table_of = lambda table_schema: table_schema.table_name
+
+        registration_s = None
+        if not (options["reuse"] and self._vector_rows(vector_table) == size):
+            retriever.clear_schemas()
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                if options["retriever"] == "schema":
+                    for value in generate_postgres_schemas(rows):
+                        retriever.add_table_schema(value["table_name"], value["schema"])
+                else:
+                    for table in tables:
+                        retriever.add_table_schema(table)
+                registration_s = time.perf_counter() - started
+        if options["retriever"] == "table":
+            retriever.tables = tables
+
+        sample = random.Random(options["seed"]).sample(tables, min(options["queries"], len(tables)))
+        latencies, hits, retrieved_counts = [], 0, []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for table in sample:
+                started = time.perf_counter()
+                retrieved = retriever.retrieve(questions[table])
+                latencies.append((time.perf_counter() - started) * 1000)
+                retrieved_counts.append(len(retrieved))
+                if table in [table_of(item) for item in retrieved[:options["top_k"]]]:
+                    hits += 1
+
+        return {
+            "retriever": options["retriever"],
+            "tables": size,
+            "registration_s": round(registration_s, 3) if registration_s is not None else None,
+            "registration_tables_per_s": round(size / registration_s, 3) if registration_s else None,
+            "index_size_bytes": self._vector_table_size(vector_table),
+            "retrieval_latency_ms": benchmarking.summarize_latencies(latencies),
+            "recall_at_k": round(hits / len(sample), 4) if sample else 0.0,
+            "mean_retrieved": round(sum(retrieved_counts) / len(retrieved_counts), 3) if retrieved_counts else 0.0,
+        }
+
+    @staticmethod
+    def _connection(database):
+        return schemas.DatabaseConnection(
+            host=settings.env("DB_HOST"),
+            port=int(settings.env("DB_PORT")),
+            username=settings.env("DB_USER"),
+            password=settings.env("DB_PASSWORD"),
+            name=database,
+        )
+
+    def _engine(self, database):
+        cnt_str = self._connection(database)
+        return create_engine(
+            f"postgresql://{cnt_str.username}:{cnt_str.password}@{cnt_str.host}:{cnt_str.port}/{cnt_str.name}"
+        )
+
+    def _create_database(self, cnt_str):
+        admin = self._engine(settings.env("DB_NAME"))
+        with admin.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            exists = conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": cnt_str.name}).first()
+            if not exists:
+                conn.execute(text(f'CREATE DATABASE "{cnt_str.name}"'))
+        admin.dispose()
+
+    def _create_tables(self, cnt_str, rows):
+        # O SQLDatabase do retriever reflete o schema "public", então as tabelas sintéticas ficam lá
+        columns = {}
+        for row in rows:
+            columns.setdefault(row["table_name"], []).append(f'"{row["column_name"]}" {row["column_type"]}')
+        engine = self._engine(cnt_str.name)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            for table_name, table_columns in columns.items():
+                conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({", ".join(table_columns)})'))
+        engine.dispose()
+
+    def _vector_rows(self, vector_table):
+        return self._scalar(f'SELECT count(*) FROM "{vector_table}"')
+
+    def _vector_table_size(self, vector_table):
+        return self._scalar(f"SELECT pg_total_relation_size('\"{vector_table}\"')")
+
+    def _scalar(self, query):
+        engine = self._engine(settings.env("DB_NAME"))
+        try:
+            with engine.connect() as conn:
+                return conn.execute(text(query)).scalar() or 0
+        except Exception:
+            return 0
+        finally:
+            engine.dispose()
@@ -0,0 +1,288 @@
+import asyncio
+import contextlib
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from sqlalchemy import create_engine, text
+
+from api import schemas
+from api.services import benchmarking, llm_hedging, llm_metrics
+from api.services.rag_service import (
+    LLMFactory,
+    OpenAISQLGenerator,
+    SchemaSummaryPromptStrategy,
+    SQLSchemaRetriever,
+    SQLTableRetriever,
+    generate_postgres_schemas,
+    starts_simple_workflow,
+    starts_workflow,
+)
+from core import settings
+
+
+FIXTURE_TABLES = {
+    "bench_customers": (
+        "CREATE TABLE IF NOT EXISTS bench_customers (id integer PRIMARY KEY, name varchar(100), "
+        "city varchar(100), created_at timestamp)",
+        "INSERT INTO bench_customers SELECT g, 'customer ' || g, 'city ' || (g % 50), "
+        "now() - (g || ' days')::interval FROM generate_series(1, :rows) g ON CONFLICT DO NOTHING",
+    ),
+    "bench_products": (
+        "CREATE TABLE IF NOT EXISTS bench_products (id integer PRIMARY KEY, name varchar(100), "
+        "category varchar(50), price numeric(10, 2))",
+        "INSERT INTO bench_products SELECT g, 'product ' || g, 'category ' || (g % 20), (g % 500) + 0.99 "
+        "FROM generate_series(1, :rows) g ON CONFLICT DO NOTHING",
+    ),
+    "bench_orders": (
+        "CREATE TABLE IF NOT EXISTS bench_orders (id integer PRIMARY KEY, customer_id integer "
+        "REFERENCES bench_customers(id), status varchar(20), total numeric(12, 2), ordered_at timestamp)",
+        "INSERT INTO bench_orders SELECT g, (g % :rows) + 1, (ARRAY['new','paid','shipped'])[(g % 3) + 1], "
+        "(g % 1000) + 0.5, now() - ((g % 365) || ' days')::interval FROM generate_series(1, :rows) g "
+        "ON CONFLICT DO NOTHING",
+    ),
+    "bench_order_items": (
+        "CREATE TABLE IF NOT EXISTS bench_order_items (order_id integer REFERENCES bench_orders(id), "
+        "product_id integer REFERENCES bench_products(id), quantity integer)",
+        "INSERT INTO bench_order_items SELECT (g % :rows) + 1, (g % :rows) + 1, (g % 5) + 1 "
+        "FROM generate_series(1, :rows) g WHERE NOT EXISTS (SELECT 1 FROM bench_order_items)",
+    ),
+}
+
+# Tenants fictícios na tabela vetorial de benchmark, um por modo
+COMPLETE_DATABASE_ID = 1
+MINIMAL_DATABASE_ID = 2
+
+QUESTIONS = [
+    "How many customers do we have in each city?",
+    "What is the total revenue of paid orders in the last month?",
+    "Which products are in the most expensive category?",
+    "List the ten customers with the highest order totals.",
+    "How many items were sold per product category?",
+    "What is the average order value by status?",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs starts_workflow (complete mode) and starts_simple_workflow (minimal mode) against a local "
+        "Postgres with pgvector using the deterministic stub LLM/embedder, and reports latency percentiles, "
+        "throughput per concurrency level and per-step timings as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workflows", nargs="+", choices=["complete", "minimal"], default=["complete", "minimal"])
+        parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+        parser.add_argument("--iterations", type=int, default=50, help="Requests per concurrency level.")
+        parser.add_argument("--warmup", type=int, default=3, help="Untimed requests before each level.")
+        parser.add_argument("--prompt-type", default="text_to_sql",
+                            choices=["text_to_sql", "optimize_sql", "explain_sql", "fix_sql"])
+        parser.add_argument("--bench-db", default="luigui_bench",
+                            help="Scratch database created on the local server for the fixture tables; "
+                                 "also names the scratch vector table.")
+        parser.add_argument("--rows", type=int, default=1000, help="Rows per fixture table.")
+        parser.add_argument("--output", help="Write the JSON report to this path.")
+        parser.add_argument("--baseline", help="Previous JSON report to compare against.")
+        parser.add_argument("--llm-latency-ms", type=float, default=0, help="Latency injected in every stub LLM call.")
+        parser.add_argument("--llm-jitter-ms", type=float, default=0, help="Uniform jitter added to the injected latency.")
+        parser.add_argument("--llm-error-rate", type=float, default=0, help="Fraction of stub LLM calls that fail.")
+        parser.add_argument("--result-cache-ttl", type=int, default=None,
+                            help="TTL of the SQL result cache in complete mode (0 disables; default RESULT_CACHE_TTL).")
+        parser.add_argument("--verbose", action="store_true", help="Do not silence the workflow prints.")
+
+    def handle(self, *args, **options):
+        cnt_str = schemas.DatabaseConnection(
+            host=settings.env("DB_HOST"),
+            port=int(settings.env("DB_PORT")),
+            username=settings.env("DB_USER"),
+            password=settings.env("DB_PASSWORD"),
+            name=options["bench_db"],
+        )
+        self._create_bench_database(cnt_str)
+        self._create_fixture_tables(cnt_str, options["rows"])
+
+        with benchmarking.vector_table(options["bench_db"]):
+            self._run(cnt_str, options)
+
+    def _run(self, cnt_str, options):
+        # O registro roda sem falhas injetadas; elas valem só para as requisições medidas
+        with benchmarking.stub_llm_backend(), self._quiet(options["verbose"]):
+            self._register(cnt_str, options["workflows"])
+
+        results = []
+        stub = benchmarking.stub_llm_backend(
+            latency_ms=options["llm_latency_ms"],
+            jitter_ms=options["llm_jitter_ms"],
+            error_rate=options["llm_error_rate"],
+        )
+        llm_metrics.shared_usage().reset()
+        llm_hedging.shared_tracker().reset()
+        with stub, benchmarking.step_timings() as timings:
+            for workflow in options["workflows"]:
+                for concurrency in options["concurrency"]:
+                    result = self._run_level(cnt_str, workflow, concurrency, options, timings)
+                    results.append(result)
+                    latency = result["latency_ms"]
+                    self.stdout.write(
+                        f"{workflow:<9} c={concurrency:<3} p50={latency['p50']:.1f}ms p95={latency['p95']:.1f}ms "
+                        f"p99={latency['p99']:.1f}ms throughput={result['throughput_rps']:.2f} req/s "
+                        f"errors={result['errors']}"
+                    )
+                    for step_name, step in result["steps"].items():
+                        self.stdout.write(f"    {step_name:<45} p50={step['p50']:.1f}ms p95={step['p95']:.1f}ms")
+        for task, usage in llm_metrics.shared_usage().summary().items():
+            self.stdout.write(
+                f"{task:<45} calls={usage['calls']} prompt_tokens={usage['prompt_tokens']} "
+                f"cached={usage['cached_tokens']} ({usage['cache_hit_ratio']:.0%}) fallbacks={usage['fallbacks']}"
+            )
+        for task, counts in llm_hedging.shared_tracker().summary().items():
+            self.stdout.write(
+                f"{task:<45} hedged={counts['hedges']}/{counts['calls']} won={counts['hedges_won']} "
+                f"over_budget={counts['over_budget']}"
+            )
+
+        report = {
+            "meta": benchmarking.report_metadata(
+                benchmark="workflows",
+                llm_backend="stub",
+                llm_latency_ms=options["llm_latency_ms"],
+                llm_jitter_ms=options["llm_jitter_ms"],
+                llm_error_rate=options["llm_error_rate"],
+                prompt_type=options["prompt_type"],
+                iterations=options["iterations"],
+                rows=options["rows"],
+                result_cache_ttl=options["result_cache_ttl"],
+                llm_hedge_enabled=settings.LLM_HEDGE_ENABLED,
+            ),
+            "results": results,
+            "llm_usage": llm_metrics.shared_usage().summary(),
+            "llm_hedging": llm_hedging.shared_tracker().summary(),
+        }
+        if options["output"]:
+            benchmarking.write_report(options["output"], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"Compared with {baseline.get('meta', {}).get('commit', '?')}:")
+            for line in benchmarking.compare_reports(
+                baseline, report, ("workflow", "concurrency"),
+                ("latency_ms.p50", "latency_ms.p95", "latency_ms.p99", "throughput_rps"),
+            ):
+                self.stdout.write(f"  {line}")
+
+    def _run_level(self, cnt_str, workflow, concurrency, options, timings):
+        def run_one(i):
+            question = QUESTIONS[i % len(QUESTIONS)]
+            started = time.perf_counter()
+            try:
+                if workflow == "complete":
+                    asyncio.run(starts_workflow(
+                        cnt_str=cnt_str,
+                        tables=list(FIXTURE_TABLES),
+                        user_question=question,
+                        have_obj_index=True,
+                        prompt_type=options["prompt_type"],
+                        database_id=COMPLETE_DATABASE_ID,
+                        result_cache_ttl=options["result_cache_ttl"],
+                    ))
+                else:
+                    asyncio.run(starts_simple_workflow(
+                        user_question=question,
+                        db_name=cnt_str.name,
+                        prompt_type=options["prompt_type"],
+                        database_id=MINIMAL_DATABASE_ID,
+                    ))
+            except Exception as e:
+                return None, repr(e)
+            return (time.perf_counter() - started) * 1000, None
+
+        with self._quiet(options["verbose"]), ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run_one, range(options["warmup"])))
+            timings.reset()
+            started = time.perf_counter()
+            outcomes = list(pool.map(run_one, range(options["iterations"])))
+            wall = time.perf_counter() - started
+
+        latencies = [ms for ms, error in outcomes if error is None]
+        errors = [error for ms, error in outcomes if error is not None]
+        if errors and not latencies:
+            raise CommandError(f"All {workflow} requests failed, first error: {errors[0]}")
+        return {
+            "workflow": workflow,
+            "concurrency": concurrency,
+            "requests": len(outcomes),
+            "errors": len(errors),
+            "wall_s": round(wall, 3),
+            "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+            "latency_ms": benchmarking.summarize_latencies(latencies),
+            "steps": timings.summary(),
+        }
+
+    def _register(self, cnt_str, workflows):
+        """(Re)creates the vector indexes of both modes with the stub summaries and embeddings."""
+        sql_generator = OpenAISQLGenerator(
+            llm=LLMFactory.create_llm("gpt-4o"),
+            prompt_strategy=SchemaSummaryPromptStrategy("postgresql"),
+        )
+        tables = list(FIXTURE_TABLES)
+        if "complete" in workflows:
+            SQLTableRetriever(cnt_str, sql_generator, tables=[], have_obj_index=False,
+                              database_id=COMPLETE_DATABASE_ID).clear_schemas()
+            for i, table in enumerate(tables):
+                retriever = SQLTableRetriever(
+                    cnt_str=cnt_str,
+                    sql_generator=sql_generator,
+                    tables=tables[:i],
+                    have_obj_index=i > 0,
+                    database_id=COMPLETE_DATABASE_ID,
+                )
+                retriever.add_table_schema(table)
+        if "minimal" in workflows:
+            retriever = SQLSchemaRetriever(cnt_str.name, sql_generator, MINIMAL_DATABASE_ID)
+            retriever.clear_schemas()
+            for value in generate_postgres_schemas(self._catalog_rows(cnt_str)):
+                retriever.add_table_schema(value["table_name"], value["schema"])
+
+    def _catalog_rows(self, cnt_str):
+        engine = self._engine(cnt_str)
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT table_schema, table_name, column_name, data_type FROM information_schema.columns "
+                "WHERE table_name = ANY(:tables) ORDER BY table_name, ordinal_position"
+            ), {"tables": list(FIXTURE_TABLES)}).all()
+        engine.dispose()
+        return [
+            {"schema_name": r[0], "table_name": r[1], "column_name": r[2], "column_type": r[3]}
+            for r in rows
+        ]
+
+    def _create_bench_database(self, cnt_str):
+        admin = self._engine(cnt_str.model_copy(update={"name": settings.env("DB_NAME")}))
+        with admin.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            exists = conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": cnt_str.name}).first()
+            if not exists:
+                conn.execute(text(f'CREATE DATABASE "{cnt_str.name}"'))
+        admin.dispose()
+
+    def _create_fixture_tables(self, cnt_str, rows):
+        engine = self._engine(cnt_str)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            for ddl, insert in FIXTURE_TABLES.values():
+                conn.execute(text(ddl))
+                conn.execute(text(insert), {"rows": rows})
+        engine.dispose()
+
+    @staticmethod
+    def _engine(cnt_str):
+        return create_engine(
+            f"postgresql://{cnt_str.username}:{cnt_str.password}@{cnt_str.host}:{cnt_str.port}/{cnt_str.name}"
+        )
+
+    @staticmethod
+    def _quiet(verbose):
+        # Os workflows imprimem bastante no stdout; isso distorce as medições
+        return contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Database
+from api.services import schema_drift
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the registered tables of complete databases with their live catalog and re-summarizes and "
+        "re-embeds only the ones whose columns changed. Meant to run from cron, e.g. "
+        "`0 * * * * python manage.py detect_schema_drift --credentials /run/secrets/luigui_dbs.json`. "
+        "Database passwords are stored hashed, so each database needs its plain password in the "
+        "credentials file ({\"<database id>\": \"<password>\"}); minimal databases have no live catalog "
+        "and are refreshed by POSTing their schemas to databases/<id>/tables/drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--credentials", required=True, help="JSON file mapping Database.id to its password.")
+        parser.add_argument("--database", action="append", type=int, dest="databases",
+                            help="Database.id to check. Defaults to every database in the credentials file.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the drift.")
+        parser.add_argument("--reindex-unknown", action="store_true",
+                            help="Also re-index tables registered before signatures were tracked.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["credentials"]) as f:
+                credentials = {int(key): value for key, value in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read credentials: {e}")
+
+        ids = options["databases"] or sorted(credentials)
+        for db_obj in Database.objects.filter(id__in=ids, type="complete").order_by("id"):
+            password = credentials.get(db_obj.id)
+            if password is None or not db_obj.check_password(password):
+                self.stdout.write(self.style.WARNING(f"{db_obj.id} {db_obj.name}: missing or invalid password, skipped"))
+                continue
+            try:
+                retriever = schema_drift.retriever_for(db_obj, password)
+                report = schema_drift.refresh(
+                    db_obj,
+                    retriever,
+                    schema_drift.live_catalog(db_obj, retriever),
+                    reindex_unknown=options["reindex_unknown"],
+                    dry_run=options["dry_run"],
+                )
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"{db_obj.id} {db_obj.name}: {e}"))
+                continue
+            self.stdout.write(
+                f"{db_obj.id} {db_obj.name}: {len(report['changed'])} changed, {len(report['unknown'])} unknown, "
+                f"{len(report['missing'])} missing, {len(report['unchanged'])} unchanged; "
+                f"reindexed {', '.join(report['reindexed']) or 'nothing'}"
+            )
+            if report["missing"]:
+                self.stdout.write(f"    missing from the catalog: {', '.join(report['missing'])}")
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.services import import_budget
+from core import settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures, with `python -X importtime` in a fresh interpreter, what importing core.wsgi/core.asgi "
+        "and loading the URL conf costs, and lists the heaviest imports and any RAG stack package "
+        "imported before the first request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entrypoint", default="core.wsgi", choices=["core.wsgi", "core.asgi"])
+        parser.add_argument("--top", type=int, default=20, help="Number of modules to list.")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        rows = import_budget.measure(options["entrypoint"])
+        report = {
+            "entrypoint": options["entrypoint"],
+            "total_ms": round(import_budget.total_ms(rows), 1),
+            "budget_ms": settings.STARTUP_IMPORT_BUDGET_MS,
+            "rag_stack_imports": import_budget.rag_stack_imports(rows),
+            "heaviest": import_budget.heaviest(rows, options["top"]),
+        }
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        style = self.style.SUCCESS if report["total_ms"] <= report["budget_ms"] else self.style.ERROR
+        self.stdout.write(style(f"{report['entrypoint']}: {report['total_ms']:.1f}ms of {report['budget_ms']}ms budget"))
+        if report["rag_stack_imports"]:
+            self.stdout.write(self.style.WARNING(f"RAG stack imported at startup: {', '.join(report['rag_stack_imports'])}"))
+        for row in report["heaviest"]:
+            self.stdout.write(f"{row['cumulative_ms']:>9.1f}ms {row['self_ms']:>8.1f}ms  {'  ' * row['depth']}{row['module']}")
@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from sqlalchemy import text
+
+from api.models import Database
+from api.services import vector_index
+
+
+# Nós do modo complete guardam o nome da tabela em "name"; os do minimal, em "table_name"
+TABLE_NAME_SQL = "COALESCE(metadata_->>'table_name', metadata_->>'name')"
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the schema nodes of the legacy per-database vector tables (data_<database name>) into the "
+        "consolidated vector table, tagged with the Database.id. Only nodes of tables registered for that "
+        "database are copied, so databases that shared a name do not see each other's tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", action="append", type=int, dest="databases",
+                            help="Database.id to migrate. Defaults to all.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be copied.")
+        parser.add_argument("--force", action="store_true",
+                            help="Replace the nodes a database already has in the consolidated table.")
+        parser.add_argument("--drop-old", action="store_true",
+                            help="Drop each legacy table once every database using it was migrated.")
+
+    def handle(self, *args, **options):
+        engine, _ = vector_index.store_engines()
+        target = vector_index.store_table()
+        # Cria a tabela consolidada (particionada, se configurado) e os seus índices
+        vector_index.store().add([])
+        legacy_tables = set(vector_index.list_vector_tables(engine)) - {target}
+
+        databases = Database.objects.order_by("id").prefetch_related("table_set")
+        if options["databases"]:
+            databases = databases.filter(id__in=options["databases"])
+            missing = set(options["databases"]) - {db.id for db in databases}
+            if missing:
+                raise CommandError(f"Databases not found: {', '.join(map(str, sorted(missing)))}")
+
+        by_legacy_table = defaultdict(list)
+        for db in databases:
+            by_legacy_table[vector_index.vector_table_name(db.name)].append(db)
+
+        for legacy, owners in sorted(by_legacy_table.items()):
+            if legacy not in legacy_tables:
+                for db in owners:
+                    if db.type == "complete":
+                        self.stdout.write(self.style.WARNING(
+                            f"{db.id} {db.name}: no {legacy} here, its vectors live in the customer database; "
+                            f"POST databases/{db.id}/tables/drift with reindex_unknown=true to index them"
+                        ))
+                    else:
+                        self.stdout.write(f"{db.id} {db.name}: no legacy table, nothing to migrate")
+                continue
+            if len(owners) > 1:
+                self.stdout.write(self.style.WARNING(
+                    f"{legacy} is shared by databases {', '.join(str(db.id) for db in owners)}; "
+                    f"tables registered under the same name in more than one of them are copied to each"
+                ))
+            for db in owners:
+                self._migrate(engine, target, legacy, db, options)
+            if options["drop_old"] and not options["dry_run"]:
+                with engine.begin() as conn:
+                    conn.execute(text(f'DROP TABLE IF EXISTS "{legacy}"'))
+                self.stdout.write(f"{legacy}: dropped")
+
+    def _migrate(self, engine, target, legacy, db, options):
+        tables = [table.name for table in db.table_set.all()]
+        tenant = f"(metadata_->>'{vector_index.TENANT_KEY}')::float = :database_id"
+        with engine.begin() as conn:
+            pending = conn.execute(
+                text(f'SELECT count(*) FROM "{legacy}" WHERE {TABLE_NAME_SQL} = ANY(:tables)'),
+                {"tables": tables},
+            ).scalar()
+            existing = conn.execute(
+                text(f'SELECT count(*) FROM "{target}" WHERE {tenant}'), {"database_id": db.id}
+            ).scalar()
+            if existing and not options["force"]:
+                self.stdout.write(f"{db.id} {db.name}: already has {existing} nodes, skipped (use --force)")
+                return
+            if options["dry_run"]:
+                self.stdout.write(f"{db.id} {db.name}: would copy {pending} nodes from {legacy}")
+                return
+            if existing:
+                conn.execute(text(f'DELETE FROM "{target}" WHERE {tenant}'), {"database_id": db.id})
+            copied = conn.execute(text(
+                f'INSERT INTO "{target}" (text, metadata_, node_id, embedding) '
+                f"SELECT text, metadata_::jsonb || jsonb_build_object("
+                f"'{vector_index.TENANT_KEY}', CAST(:database_id AS integer), 'table_name', {TABLE_NAME_SQL}), "
+                f"node_id, embedding FROM \"{legacy}\" WHERE {TABLE_NAME_SQL} = ANY(:tables)"
+            ), {"database_id": db.id, "tables": tables}).rowcount
+        self.stdout.write(f"{db.id} {db.name}: copied {copied} of {len(tables)} registered tables from {legacy}")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.services import prewarm
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the worker prewarm phases (imports, LLM client, pgvector pool, retrievers of the most "
+        "active databases) in this process and prints the time of each one. Gunicorn workers run "
+        "the same phases from the post_fork hook in gunicorn-cfg.py."
+    )
+
+    def handle(self, *args, **options):
+        prewarm.run(log=self.stdout.write)
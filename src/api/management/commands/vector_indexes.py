@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from sqlalchemy import create_engine
+
+from api.services import vector_index
+from core import settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds, rebuilds, drops or inspects the ANN (HNSW/IVFFlat) indexes of the pgvector tables. "
+        "Index changes run CONCURRENTLY, so retrieval and registration keep working meanwhile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["build", "rebuild", "drop", "inspect"])
+        parser.add_argument("--table", action="append", dest="tables",
+                            help="Vector table (e.g. data_sales) or its logical name (sales). Defaults to all.")
+        parser.add_argument("--maintenance-work-mem", help="maintenance_work_mem for the build, e.g. 1GB.")
+        parser.add_argument("--json", action="store_true", help="Print `inspect` as JSON.")
+        parser.add_argument("--host", default=settings.env("DB_HOST"))
+        parser.add_argument("--port", default=settings.env("DB_PORT"))
+        parser.add_argument("--user", default=settings.env("DB_USER"))
+        parser.add_argument("--password", default=settings.env("DB_PASSWORD"))
+        parser.add_argument("--dbname", default=settings.env("DB_NAME"))
+
+    def handle(self, *args, **options):
+        engine = create_engine(
+            f"postgresql://{options['user']}:{options['password']}@{options['host']}:{options['port']}/{options['dbname']}"
+        )
+        try:
+            existing = vector_index.list_vector_tables(engine)
+            tables = existing
+            if options["tables"]:
+                tables = [t if t.startswith("data_") else vector_index.vector_table_name(t) for t in options["tables"]]
+                missing = sorted(set(tables) - set(existing))
+                if missing:
+                    raise CommandError(f"Vector tables not found: {', '.join(missing)}")
+
+            if options["action"] == "inspect":
+                self._inspect(engine, tables, options["json"])
+                return
+
+            action = {
+                "build": lambda table: vector_index.build_index(engine, table, options["maintenance_work_mem"]),
+                "rebuild": lambda table: vector_index.rebuild_index(engine, table, options["maintenance_work_mem"]),
+                "drop": lambda table: vector_index.drop_index(engine, table),
+            }[options["action"]]
+            for table in tables:
+                self.stdout.write(f"{table}: {action(table)}")
+        finally:
+            engine.dispose()
+
+    def _inspect(self, engine, tables, as_json):
+        rows = vector_index.inspect_indexes(engine, tables)
+        if as_json:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        self.stdout.write(f"configured: {vector_index.index_type()} {vector_index.index_options(vector_index.index_type())}")
+        for row in rows:
+            index = "no ANN index (sequential scan)"
+            if row["index"]:
+                index = (
+                    f"{row['method']} {','.join(row['options'])} {row['index_bytes'] / 1024 / 1024:.1f}MiB"
+                    f"{'' if row['valid'] else ' INVALID'}"
+                )
+            self.stdout.write(
+                f"{row['table']:<40} ~{row['rows']} rows {row['table_bytes'] / 1024 / 1024:.1f}MiB  {index}"
+            )
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_questionanswer_prompt_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="table",
+            name="signature",
+            field=models.CharField(
+                blank=True, max_length=64, null=True, verbose_name="Indexed Schema Signature"
+            ),
+        ),
+        migrations.AddField(
+            model_name="table",
+            name="signature_checked_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Last Schema Drift Check"
+            ),
+        ),
+    ]
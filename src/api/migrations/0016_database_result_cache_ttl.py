@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_table_signature"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="database",
+            name="result_cache_ttl",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Result Cache TTL (s)"
+            ),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_database_result_cache_ttl"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="questionanswer",
+            name="result",
+            field=models.JSONField(blank=True, null=True, verbose_name="SQL Result"),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_questionanswer_result'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='questionanswer',
+            index=models.Index(fields=['database', 'id'], name='api_question_database_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='table',
+            index=models.Index(fields=['database', 'id'], name='api_table_database_id_idx'),
+        ),
+    ]
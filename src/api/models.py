@@ -18,6 +18,8 @@ class Database(models.Model):
     port = models.PositiveIntegerField(verbose_name='Database Port', blank=True, null=True)
     host = models.CharField(max_length=255, verbose_name='Database Host', blank=True, null=True)
     have_obj_index = models.BooleanField(default=False, verbose_name='Have Object Index')
+    # Segundos que o resultado de uma query fica em cache; vazio usa RESULT_CACHE_TTL, 0 desliga
+    result_cache_ttl = models.PositiveIntegerField(verbose_name='Result Cache TTL (s)', blank=True, null=True)
 
     def __str__(self):
         return str(self.id)
@@ -50,6 +52,12 @@ class Database(models.Model):
 class Table(models.Model):
     database = models.ForeignKey(Database, on_delete=models.CASCADE)
     name = models.CharField(max_length=255, verbose_name='Table Name')
+    signature = models.CharField(max_length=64, verbose_name='Indexed Schema Signature', blank=True, null=True)
+    signature_checked_at = models.DateTimeField(verbose_name='Last Schema Drift Check', blank=True, null=True)
+
+    class Meta:
+        # Paginação por keyset dentro de um database
+        indexes = [models.Index(fields=["database", "id"], name="api_table_database_id_idx")]
 
     def __str__(self):
         return self.name
@@ -61,3 +69,9 @@ class QuestionAnswer(models.Model):
     answer = models.TextField( verbose_name='RAG Answer', null=True, blank=True)
     query = models.TextField( verbose_name='SQL Query', null=True, blank=True)
     prompt_type = models.CharField( max_length=255, verbose_name='SQL Prompt Type')
+    # Colunas/linhas devolvidas no modo data_only; usadas na síntese sob demanda
+    result = models.JSONField( verbose_name='SQL Result', null=True, blank=True)
+
+    class Meta:
+        # Paginação por keyset dentro de um database
+        indexes = [models.Index(fields=["database", "id"], name="api_question_database_id_idx")]
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+from core import settings
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key: each page is `WHERE id > <cursor> ORDER BY id
+    LIMIT n`, served by the (database_id, id) indexes, with no COUNT and no OFFSET scan.
+    """
+    ordering = "id"
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
@@ -9,7 +9,7 @@ class IsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # Bloqueia TODOS os métodos (GET, PUT, DELETE) se o usuário não for dono
         print("obj:", obj)
-        return obj.user == request.user  # Campo correto é 'user', não 'owner'
+        return obj.user_id == request.user.id  # Campo correto é 'user', não 'owner'
 
 class IsOwnerTable(permissions.BasePermission):
     """
@@ -18,4 +18,5 @@ class IsOwnerTable(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # Verifica se o usuário autenticado é o dono do database relacionado à tabela
-        return obj.database.user == request.user
\ No newline at end of file
+        # Compara ids para não buscar o usuário de cada objeto
+        return obj.database.user_id == request.user.id
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, List, Optional
 from llama_index.core.workflow import Event
 
 
@@ -10,15 +10,19 @@ class TableInfo(BaseModel):
 
 
 class TableRetrieveEvent(Event):
-    """Result of running table retrieval."""
+    """Result of running table retrieval, plus the state of this run (the workflow is shared)."""
     table_context_str: str
     query: str
+    sql_run_query: Any = None
+    data_only: bool = False
+    deadline: Any = None
 
 
 class SchemaRetrieveEvent(Event):
     """Result of running schema retrieval."""
     table_schema: str
     query: str
+    deadline: Any = None
 
 
 class TextToSQLEvent(Event):
@@ -27,11 +31,48 @@ class TextToSQLEvent(Event):
     natural_language_query: str
 
 
+class GeneratedSQLEvent(TextToSQLEvent):
+    """Generated SQL plus the state of this run; TextToSQLEvent stays the LLM output schema."""
+    sql_run_query: Any = None
+    data_only: bool = False
+    table_context_str: str = ""
+    repair_attempts: int = 0
+    deadline: Any = None
+
+
+class SQLRepairEvent(Event):
+    """Generated SQL the local validation rejected, with the errors to fix."""
+    sql_query: str
+    natural_language_query: str
+    errors: List[str]
+    sql_run_query: Any = None
+    data_only: bool = False
+    table_context_str: str = ""
+    repair_attempts: int = 0
+    deadline: Any = None
+
+
 class SynthesisResult(Event):
     sql_query: str
     natural_language_response: str
 
 
+class QueryRows(BaseModel):
+    """Tabular result of an executed query, with JSON-native values."""
+    columns: List[str]
+    rows: List[List[Any]]
+    truncated: bool = False
+
+
+class WorkflowResult(SynthesisResult):
+    """Synthesis result plus what happened to the generated SQL before and during execution."""
+    executed: bool = True
+    guard_reason: Optional[str] = None
+    data: Optional[QueryRows] = None
+    # O prazo da requisição acabou: resultado parcial (sem síntese, ou sem SQL)
+    timed_out: bool = False
+
+
 class OptimizeResult(Event):
     """Result of running optimization."""
     optimized_query: str
@@ -62,6 +103,39 @@ class DatabaseConnection(BaseModel):
         from_attributes = True
 
 
+class QueryGuardDecision(BaseModel):
+    """Outcome of the pre-execution cost guard."""
+    sql_query: str
+    rejected: bool = False
+    reason: Optional[str] = None
+
+
 class SchemaSummary(BaseModel):
     """Schema Summary"""
     schema_summary: str
+
+
+class CatalogColumn(BaseModel):
+    """Column read from the customer database catalog."""
+    name: str
+    type: str
+    nullable: bool = True
+    comment: Optional[str] = None
+
+
+class CatalogForeignKey(BaseModel):
+    """Foreign key read from the customer database catalog."""
+    columns: List[str] = Field(default_factory=list)
+    referred_schema: str
+    referred_table: str
+    referred_columns: List[str] = Field(default_factory=list)
+
+
+class CatalogTable(BaseModel):
+    """Table read from the customer database catalog."""
+    schema_name: str
+    table_name: str
+    comment: Optional[str] = None
+    columns: List[CatalogColumn] = Field(default_factory=list)
+    primary_key: List[str] = Field(default_factory=list)
+    foreign_keys: List[CatalogForeignKey] = Field(default_factory=list)
@@ -30,7 +30,8 @@ class DatabaseSerializer(serializers.ModelSerializer):
             "username",
             "password",
             "port",
-            "host"
+            "host",
+            "result_cache_ttl",
         ]
 
     def validate(self, data):
@@ -77,9 +78,10 @@ class TableSerializer(serializers.ModelSerializer):
 class QuestionAnswerSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuestionAnswer
-        fields = ["database", "question", "answer", "query", "prompt_type"]
+        fields = ["id", "database", "question", "answer", "query", "prompt_type", "result"]
         # Campos opcionais a depender do tipo de Database e prompt_type
         extra_kwargs = {
             "answer": {"read_only": True},
             "query": {"read_only": True},
+            "result": {"read_only": True},
         }
\ No newline at end of file
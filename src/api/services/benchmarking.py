@@ -0,0 +1,241 @@
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.span import SimpleSpan
+from llama_index.core.instrumentation.span_handlers import BaseSpanHandler
+
+from api.services import llm_stub, rag_service, vector_index
+from core import settings
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile with linear interpolation between closest ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize_latencies(values_ms: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max of a list of latencies (ms)."""
+    if not values_ms:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    return {
+        "count": len(values_ms),
+        "p50": round(percentile(values_ms, 50), 3),
+        "p95": round(percentile(values_ms, 95), 3),
+        "p99": round(percentile(values_ms, 99), 3),
+        "mean": round(sum(values_ms) / len(values_ms), 3),
+        "max": round(max(values_ms), 3),
+    }
+
+
+class StepTimingSpanHandler(BaseSpanHandler[SimpleSpan]):
+    """
+    Collects wall-clock durations of workflow steps from the LlamaIndex
+    instrumentation spans (span ids look like "TextToSQLWorkflow.generate_sql-<uuid>").
+    """
+
+    _starts: Dict[str, float] = PrivateAttr(default_factory=dict)
+    _durations: Dict[str, List[float]] = PrivateAttr(default_factory=dict)
+    _timing_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StepTimingSpanHandler"
+
+    def new_span(self, id_: str, bound_args: Any, instance: Optional[Any] = None,
+                 parent_span_id: Optional[str] = None, tags: Optional[Dict[str, Any]] = None,
+                 **kwargs: Any) -> Optional[SimpleSpan]:
+        with self._timing_lock:
+            self._starts[id_] = time.perf_counter()
+        return SimpleSpan(id_=id_, parent_id=parent_span_id, tags=tags or {})
+
+    def prepare_to_exit_span(self, id_: str, bound_args: Any, instance: Optional[Any] = None,
+                             result: Optional[Any] = None, **kwargs: Any) -> Optional[SimpleSpan]:
+        self._record(id_)
+        return None
+
+    def prepare_to_drop_span(self, id_: str, bound_args: Any, instance: Optional[Any] = None,
+                             err: Optional[BaseException] = None, **kwargs: Any) -> Optional[SimpleSpan]:
+        self._record(id_)
+        return None
+
+    def _record(self, id_: str) -> None:
+        name = id_.rsplit("-", 5)[0]
+        with self._timing_lock:
+            start = self._starts.pop(id_, None)
+            if start is None or not name.endswith(self.step_suffixes()):
+                return
+            self._durations.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+
+    @staticmethod
+    def step_suffixes() -> tuple:
+        return (".retrieve_tables", ".generate_sql", ".generate_response")
+
+    def reset(self) -> None:
+        with self._timing_lock:
+            self._starts.clear()
+            self._durations.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._timing_lock:
+            return {name: summarize_latencies(values) for name, values in sorted(self._durations.items())}
+
+
+@contextmanager
+def step_timings():
+    """Registers a StepTimingSpanHandler on the root dispatcher for the duration of the block."""
+    dispatcher = get_dispatcher()
+    handler = StepTimingSpanHandler()
+    dispatcher.add_span_handler(handler)
+    try:
+        yield handler
+    finally:
+        dispatcher.span_handlers.remove(handler)
+
+
+@contextmanager
+def stub_llm_backend(latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, seed: int = 0):
+    """Selects the deterministic stub backend (with optional injected faults) for the duration of the block."""
+    overrides = {
+        "LLM_BACKEND": "stub",
+        "LLM_STUB_LATENCY_MS": latency_ms,
+        "LLM_STUB_LATENCY_JITTER_MS": jitter_ms,
+        "LLM_STUB_ERROR_RATE": error_rate,
+        "LLM_STUB_SEED": seed,
+    }
+    original = {name: getattr(settings, name) for name in overrides}
+    original_embed_model = Settings._embed_model
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    llm_stub.reset_shared_faults()
+    rag_service.LLMFactory.configure_embed_model()
+    try:
+        yield
+    finally:
+        for name, value in original.items():
+            setattr(settings, name, value)
+        llm_stub.reset_shared_faults()
+        Settings._embed_model = original_embed_model
+
+
+@contextmanager
+def vector_table(name: str):
+    """Points the consolidated vector store at a scratch table for the duration of the block."""
+    original = settings.VECTOR_TABLE_NAME
+    settings.VECTOR_TABLE_NAME = name
+    try:
+        yield vector_index.vector_table_name(name)
+    finally:
+        settings.VECTOR_TABLE_NAME = original
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report_metadata(**extra) -> Dict[str, Any]:
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        **extra,
+    }
+
+
+def write_report(path: str, report: Dict[str, Any]) -> None:
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any], key_fields: tuple, metrics: tuple) -> List[str]:
+    """Lines with the relative change of each metric for results present in both reports."""
+    def key(result):
+        return tuple(result[field] for field in key_fields)
+
+    previous = {key(result): result for result in baseline.get("results", [])}
+    lines = []
+    for result in current.get("results", []):
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        parts = []
+        for metric in metrics:
+            new_value, old_value = _lookup(result, metric), _lookup(old, metric)
+            if old_value:
+                parts.append(f"{metric} {old_value:.2f} -> {new_value:.2f} ({(new_value - old_value) / old_value:+.1%})")
+        lines.append(f"{' / '.join(str(k) for k in key(result))}: " + ", ".join(parts))
+    return lines
+
+
+def _lookup(result: Dict[str, Any], dotted: str) -> float:
+    value: Any = result
+    for part in dotted.split("."):
+        value = value.get(part, 0) if isinstance(value, dict) else 0
+    return float(value or 0)
+
+
+CATALOG_DOMAINS = [
+    "account", "invoice", "payment", "customer", "supplier", "product", "warehouse", "shipment",
+    "employee", "payroll", "campaign", "lead", "ticket", "contract", "asset", "budget",
+    "course", "student", "enrollment", "patient", "claim", "policy", "vehicle", "route",
+]
+CATALOG_ENTITIES = [
+    "ledger", "history", "snapshot", "detail", "summary", "event", "audit", "metric",
+    "balance", "schedule", "request", "status", "rating", "forecast", "document", "note",
+]
+CATALOG_ATTRIBUTES = [
+    ("amount", "numeric"), ("quantity", "integer"), ("created_at", "timestamp without time zone"),
+    ("updated_at", "timestamp without time zone"), ("status", "character varying"),
+    ("description", "text"), ("code", "character varying"), ("region", "character varying"),
+    ("score", "double precision"), ("is_active", "boolean"), ("owner", "character varying"),
+    ("priority", "smallint"), ("currency", "character varying"), ("due_date", "date"),
+]
+
+
+def generate_synthetic_catalog(n_tables: int, columns_per_table: int = 8, seed: int = 0):
+    """
+    Synthetic catalog in the JSON shape accepted by `generate_postgres_schemas`
+    (schema_name/table_name/column_name/column_type rows), plus one natural-language
+    question per table that names it, for recall@k ground truth.
+    """
+    rng = random.Random(seed)
+    rows = []
+    questions = {}
+    for i in range(n_tables):
+        domain = CATALOG_DOMAINS[i % len(CATALOG_DOMAINS)]
+        entity = CATALOG_ENTITIES[(i // len(CATALOG_DOMAINS)) % len(CATALOG_ENTITIES)]
+        table_name = f"{domain}_{entity}_{i}"
+        schema_name = f"schema_{i % 10}"
+        rows.append({"schema_name": schema_name, "table_name": table_name, "column_name": "id", "column_type": "bigint"})
+        attributes = rng.sample(CATALOG_ATTRIBUTES, min(columns_per_table - 1, len(CATALOG_ATTRIBUTES)))
+        for column_name, column_type in attributes:
+            rows.append({
+                "schema_name": schema_name,
+                "table_name": table_name,
+                "column_name": f"{domain}_{column_name}",
+                "column_type": column_type,
+            })
+        metric = attributes[0][0].replace("_", " ")
+        questions[table_name] = f"What is the {domain} {metric} in the {entity} {i} table?"
+    return rows, questions
@@ -0,0 +1,214 @@
+import hashlib
+import json
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from api import schemas
+
+
+# Uma leitura do pg_catalog para o database inteiro, em vez de um inspector por tabela
+COLUMNS_SQL = """
+SELECT n.nspname, c.relname, a.attname, format_type(a.atttypid, a.atttypmod), NOT a.attnotnull,
+       col_description(c.oid, a.attnum), obj_description(c.oid, 'pg_class')
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f') AND NOT c.relispartition
+  AND n.nspname = ANY(:schemas)
+  AND (cardinality(CAST(:include AS text[])) = 0 OR c.relname LIKE ANY(CAST(:include AS text[])))
+  AND NOT c.relname LIKE ANY(CAST(:exclude AS text[]))
+ORDER BY n.nspname, c.relname, a.attnum
+"""
+
+CONSTRAINTS_SQL = """
+SELECT n.nspname, c.relname, k.contype, k.conname, k.ord,
+       a.attname, rn.nspname, rc.relname, ra.attname
+FROM (
+    SELECT con.*, u.attnum, u.refnum, u.ord
+    FROM pg_constraint con,
+         unnest(con.conkey, COALESCE(con.confkey, con.conkey)) WITH ORDINALITY AS u(attnum, refnum, ord)
+    WHERE con.contype IN ('p', 'f')
+) k
+JOIN pg_class c ON c.oid = k.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = k.conrelid AND a.attnum = k.attnum
+LEFT JOIN pg_class rc ON rc.oid = k.confrelid
+LEFT JOIN pg_namespace rn ON rn.oid = rc.relnamespace
+LEFT JOIN pg_attribute ra ON ra.attrelid = k.confrelid AND ra.attnum = k.refnum
+WHERE n.nspname = ANY(:schemas)
+ORDER BY n.nspname, c.relname, k.conname, k.ord
+"""
+
+
+def introspect(
+    engine,
+    schemas_filter: Optional[List[str]] = None,
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+) -> Dict[str, schemas.CatalogTable]:
+    """
+    Reads columns, primary and foreign keys of every table of the given schemas in two
+    catalog queries. `include`/`exclude` are table names or LIKE patterns ("sales_%").
+    Tables of the public schema are keyed by their bare name, others by "schema.table".
+    """
+    params = {
+        "schemas": schemas_filter or ["public"],
+        "include": include or [],
+        "exclude": exclude or [],
+    }
+    tables: Dict[str, schemas.CatalogTable] = {}
+    with engine.connect() as conn:
+        for schema_name, table_name, column, column_type, nullable, comment, table_comment in conn.execute(
+            text(COLUMNS_SQL), params
+        ):
+            table = tables.get(qualified_name(schema_name, table_name))
+            if table is None:
+                table = schemas.CatalogTable(schema_name=schema_name, table_name=table_name, comment=table_comment)
+                tables[qualified_name(schema_name, table_name)] = table
+            table.columns.append(
+                schemas.CatalogColumn(name=column, type=column_type, nullable=nullable, comment=comment)
+            )
+
+        foreign_keys: Dict[tuple, schemas.CatalogForeignKey] = {}
+        for schema_name, table_name, kind, name, _, column, ref_schema, ref_table, ref_column in conn.execute(
+            text(CONSTRAINTS_SQL), {"schemas": params["schemas"]}
+        ):
+            table = tables.get(qualified_name(schema_name, table_name))
+            if table is None:
+                continue
+            if kind == "p":
+                table.primary_key.append(column)
+                continue
+            key = (schema_name, table_name, name)
+            if key not in foreign_keys:
+                foreign_keys[key] = schemas.CatalogForeignKey(
+                    referred_schema=ref_schema, referred_table=ref_table
+                )
+                table.foreign_keys.append(foreign_keys[key])
+            foreign_keys[key].columns.append(column)
+            foreign_keys[key].referred_columns.append(ref_column)
+    return tables
+
+
+def qualified_name(schema_name: str, table_name: str) -> str:
+    return table_name if schema_name == "public" else f"{schema_name}.{table_name}"
+
+
+def split_name(name: str) -> Tuple[str, str]:
+    """(schema, table) of a name in the qualified_name format: bare names are in public."""
+    schema_name, _, table_name = name.rpartition(".")
+    return schema_name or "public", table_name
+
+
+def table_info(table: schemas.CatalogTable) -> str:
+    """Same text SQLDatabase.get_single_table_info produces, built from the catalog already read."""
+    columns = ", ".join(
+        f"{column.name} ({column.type}): '{column.comment}'" if column.comment else f"{column.name} ({column.type})"
+        for column in table.columns
+    )
+    info = f"Table '{table.table_name}' has columns: {columns}, "
+    if table.comment:
+        info += f"with comment: ({table.comment}) "
+    if table.foreign_keys:
+        info += " and foreign keys: " + ", ".join(
+            f"{fk.columns} -> {fk.referred_table}.{fk.referred_columns}" for fk in table.foreign_keys
+        )
+    return info + "."
+
+
+def from_reflected(table) -> schemas.CatalogTable:
+    """CatalogTable of a SQLAlchemy Table already reflected (SQLDatabase.metadata_obj), without a round trip."""
+    catalog_table = schemas.CatalogTable(
+        schema_name=table.schema or "public",
+        table_name=table.name,
+        comment=table.comment,
+        columns=[
+            schemas.CatalogColumn(name=column.name, type=str(column.type), nullable=column.nullable, comment=column.comment)
+            for column in table.columns
+        ],
+        primary_key=[column.name for column in table.primary_key.columns],
+    )
+    for constraint in table.foreign_key_constraints:
+        referred = constraint.referred_table
+        catalog_table.foreign_keys.append(schemas.CatalogForeignKey(
+            columns=list(constraint.column_keys),
+            referred_schema=referred.schema or "public",
+            referred_table=referred.name,
+            referred_columns=[element.column.name for element in constraint.elements],
+        ))
+    return catalog_table
+
+
+def pruned(table: schemas.CatalogTable, keep: List[str]) -> schemas.CatalogTable:
+    """
+    The table with only the `keep` columns plus its primary and foreign key columns,
+    in table order, for wide tables whose full description would flood the prompt.
+    """
+    keys = set(table.primary_key) | {column for fk in table.foreign_keys for column in fk.columns}
+    wanted = set(keep) | keys
+    return table.model_copy(update={"columns": [column for column in table.columns if column.name in wanted]})
+
+
+def signature(table: schemas.CatalogTable) -> str:
+    """
+    Hash of everything that ends up in the table's node and prompts (columns, types,
+    nullability, comments and keys); any change means the indexed schema is stale.
+    """
+    payload = table.model_dump(exclude={"schema_name"})
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def schema_rows(table: schemas.CatalogTable) -> List[dict]:
+    """Table in the JSON shape accepted by `generate_postgres_schemas` (minimal mode), keys included."""
+    references = {
+        column: f"{fk.referred_schema}.{fk.referred_table}.{referred}"
+        for fk in table.foreign_keys
+        for column, referred in zip(fk.columns, fk.referred_columns)
+    }
+    rows = []
+    for column in table.columns:
+        row = {"schema_name": table.schema_name, "table_name": table.table_name,
+               "column_name": column.name, "column_type": column.type}
+        if column.name in table.primary_key:
+            row["primary_key"] = True
+        if column.name in references:
+            row["references"] = references[column.name]
+        rows.append(row)
+    return rows
+
+
+def parse_reference(reference: str) -> Tuple[str, str, str]:
+    """(schema, table, column) of a declared key, "table.column" or "schema.table.column"."""
+    parts = reference.split(".")
+    if len(parts) == 2:
+        return ("public", *parts)
+    if len(parts) == 3:
+        return tuple(parts)
+    raise ValueError(f"Invalid reference: {reference}")
+
+
+def from_schema_rows(rows: List[dict]) -> Dict[str, schemas.CatalogTable]:
+    """
+    Tables from the minimal-mode JSON (schema_name/table_name/column_name/column_type rows, plus
+    the optional declared keys "primary_key": true and "references": "[schema.]table.column").
+    """
+    tables: Dict[str, schemas.CatalogTable] = {}
+    for row in rows:
+        # Mesma chave do introspect: tabelas de mesmo nome em schemas diferentes não se misturam
+        table = tables.setdefault(
+            qualified_name(row["schema_name"], row["table_name"]),
+            schemas.CatalogTable(schema_name=row["schema_name"], table_name=row["table_name"]),
+        )
+        table.columns.append(schemas.CatalogColumn(name=row["column_name"], type=row["column_type"]))
+        if row.get("primary_key"):
+            table.primary_key.append(row["column_name"])
+        if row.get("references"):
+            ref_schema, ref_table, ref_column = parse_reference(row["references"])
+            table.foreign_keys.append(schemas.CatalogForeignKey(
+                columns=[row["column_name"]],
+                referred_schema=ref_schema,
+                referred_table=ref_table,
+                referred_columns=[ref_column],
+            ))
+    return tables
@@ -0,0 +1,79 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from core import settings
+
+
+def _key(token: str) -> str:
+    # Só o hash do token fica no processo; o token em si vai apenas para o cliente
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class LeaseStore:
+    """
+    Short-lived leases exchanging a database password, checked once against its Argon2 hash,
+    for an opaque token. Leases live only in this process's memory (never persisted), are
+    bound to the database and user that created them, and can be revoked at any time. With
+    more than one worker, a lease is only known to the worker that issued it.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._leases: "OrderedDict[str, Tuple[int, Optional[int], str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue(self, database_id: int, user_id: Optional[int], password: str, ttl: float) -> str:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._purge()
+            self._leases[_key(token)] = (database_id, user_id, password, time.monotonic() + ttl)
+            while len(self._leases) > self.max_entries:
+                self._leases.popitem(last=False)
+        return token
+
+    def resolve(self, token: str, database_id: int, user_id: Optional[int]) -> Optional[str]:
+        """Password of a live lease issued for this database and user, or None."""
+        with self._lock:
+            lease = self._leases.get(_key(token))
+            if lease is None:
+                return None
+            if lease[3] < time.monotonic():
+                del self._leases[_key(token)]
+                return None
+            if lease[0] != database_id or lease[1] != user_id:
+                return None
+            return lease[2]
+
+    def revoke(self, token: str) -> bool:
+        with self._lock:
+            return self._leases.pop(_key(token), None) is not None
+
+    def revoke_database(self, database_id: int) -> int:
+        """Revokes every lease of a database (password changed or database deleted)."""
+        with self._lock:
+            keys = [key for key, lease in self._leases.items() if lease[0] == database_id]
+            for key in keys:
+                del self._leases[key]
+            return len(keys)
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, lease in self._leases.items() if lease[3] < now]:
+            del self._leases[key]
+
+
+_shared: Optional[LeaseStore] = None
+_shared_lock = threading.Lock()
+
+
+def shared_leases() -> LeaseStore:
+    """Process-wide lease store sized by CREDENTIAL_LEASE_MAX_ENTRIES."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LeaseStore(settings.CREDENTIAL_LEASE_MAX_ENTRIES)
+        return _shared
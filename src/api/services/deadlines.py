@@ -0,0 +1,86 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Optional, TypeVar
+
+from core import settings
+
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before (or while) running a step."""
+
+
+class Deadline:
+    """
+    Time budget of one request, read by every workflow step: LLM calls, retrieval and SQL
+    execution take their timeouts from what is left instead of fixed values.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, share: float = 1.0) -> float:
+        """`share` of the time left, for the next call; raises DeadlineExceeded when none is left."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"deadline of {self.seconds:g}s exceeded")
+        return remaining * share
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least `seconds` are left, e.g. before an optional LLM call."""
+        return self.remaining() >= seconds
+
+
+def for_request(requested: Optional[float] = None) -> Deadline:
+    """
+    Deadline of a request: the client's value in seconds (clamped to REQUEST_DEADLINE_MAX),
+    else REQUEST_DEADLINE_DEFAULT. Raises ValueError for a value that is not a positive number.
+    """
+    if requested is None or requested == "":
+        return Deadline(settings.REQUEST_DEADLINE_DEFAULT)
+    try:
+        seconds = float(requested)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid deadline: {requested}")
+    if not seconds > 0:
+        raise ValueError(f"Invalid deadline: {requested}")
+    return Deadline(min(seconds, settings.REQUEST_DEADLINE_MAX))
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _shared_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.REQUEST_DEADLINE_MAX_WORKERS, thread_name_prefix="deadline")
+        return _pool
+
+
+def run_within(deadline: Optional[Deadline], share: float, call: Callable[[], T]) -> T:
+    """
+    Runs `call` with `share` of the time left, for calls that take no timeout themselves (vector
+    retrieval). Raises DeadlineExceeded when it does not return in time; the call cannot be
+    interrupted and finishes in the background, its result discarded.
+    """
+    if deadline is None:
+        return call()
+    timeout = deadline.timeout(share)
+    future = _shared_pool().submit(call)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise DeadlineExceeded(f"step did not finish in {timeout:.1f}s") from None
@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+from core import settings
+
+
+# Importar o entrypoint e montar o URLconf é o que um worker paga antes da primeira requisição
+STARTUP_CODE = (
+    "import {entrypoint}\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+)
+
+# Pacotes da pilha RAG, que só devem ser importados na primeira requisição que os usa
+RAG_STACK_PACKAGES = ("llama_index", "openai", "sqlalchemy", "asyncpg", "psycopg2", "pgvector", "dotenv")
+
+
+def measure(entrypoint: str = "core.wsgi") -> List[Dict]:
+    """
+    Runs `python -X importtime` on a fresh interpreter that imports `entrypoint` and loads
+    the URL conf. Returns one row per imported module, in import order.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_CODE.format(entrypoint=entrypoint)],
+        cwd=settings.CORE_DIR,
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse(completed.stderr)
+
+
+def parse(output: str) -> List[Dict]:
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return rows
+
+
+def total_ms(rows: List[Dict]) -> float:
+    return sum(row["self_ms"] for row in rows)
+
+
+def heaviest(rows: List[Dict], top: int = 20) -> List[Dict]:
+    """Modules with the largest cumulative import time (themselves plus what they pulled in)."""
+    return sorted(rows, key=lambda row: row["cumulative_ms"], reverse=True)[:top]
+
+
+def rag_stack_imports(rows: List[Dict]) -> List[str]:
+    """Top-level RAG stack packages imported at startup (should be empty)."""
+    return sorted({
+        row["module"].split(".")[0] for row in rows if row["module"].split(".")[0] in RAG_STACK_PACKAGES
+    })
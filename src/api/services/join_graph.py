@@ -0,0 +1,86 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from api import schemas
+
+# (schema, tabela): nomes iguais em schemas diferentes são tabelas diferentes
+TableKey = Tuple[str, str]
+
+
+class JoinGraph:
+    """
+    Undirected foreign-key graph of a database's registered tables, keyed by (schema, table):
+    two tables are neighbours when one references the other. Used to add the bridge tables a
+    join needs but that vector retrieval missed.
+    """
+
+    def __init__(self, edges: Dict[TableKey, Set[TableKey]]):
+        self.edges = edges
+
+    @classmethod
+    def from_tables(cls, tables: Iterable[schemas.CatalogTable], registered: Optional[Iterable[TableKey]] = None) -> "JoinGraph":
+        """Graph of the foreign keys of `tables`, keeping only edges between `registered` tables (all if None)."""
+        tables = list(tables)
+        keep = set(registered) if registered is not None else {(table.schema_name, table.table_name) for table in tables}
+        references = {
+            (table.schema_name, table.table_name): [(fk.referred_schema, fk.referred_table) for fk in table.foreign_keys]
+            for table in tables
+        }
+        return cls.from_references(references, keep)
+
+    @classmethod
+    def from_references(
+            cls, references: Dict[TableKey, List[TableKey]], registered: Optional[Iterable[TableKey]] = None
+    ) -> "JoinGraph":
+        """Graph of {table: [referred tables]}, keeping only edges between `registered` tables (all if None)."""
+        keep = set(registered) if registered is not None else None
+        edges: Dict[TableKey, Set[TableKey]] = {}
+        for table, referred_tables in references.items():
+            for referred in referred_tables:
+                if referred == table or (keep is not None and not {table, referred} <= keep):
+                    continue
+                edges.setdefault(table, set()).add(referred)
+                edges.setdefault(referred, set()).add(table)
+        return cls(edges)
+
+    def shortest_path(self, source: TableKey, target: TableKey, max_hops: int) -> Optional[List[TableKey]]:
+        """Tables of a shortest path from `source` to `target` (both included), or None beyond `max_hops` edges."""
+        if source == target:
+            return [source]
+        previous = {source: None}
+        queue = deque([(source, 0)])
+        while queue:
+            table, hops = queue.popleft()
+            if hops == max_hops:
+                continue
+            # Ordem fixa entre vizinhos para o mesmo caminho (e o mesmo prompt) a cada pergunta
+            for neighbour in sorted(self.edges.get(table, ())):
+                if neighbour in previous:
+                    continue
+                previous[neighbour] = table
+                if neighbour == target:
+                    path = [target]
+                    while previous[path[-1]] is not None:
+                        path.append(previous[path[-1]])
+                    return path[::-1]
+                queue.append((neighbour, hops + 1))
+        return None
+
+    def bridges(self, tables: List[TableKey], max_tables: int, max_hops: int) -> List[TableKey]:
+        """
+        Tables missing from `tables` on the shortest join paths between them. Paths needing
+        fewer new tables come first, and a path is only added whole while the total stays
+        within `max_tables`.
+        """
+        candidates = []
+        for position, source in enumerate(tables):
+            for target in tables[position + 1:]:
+                path = self.shortest_path(source, target, max_hops)
+                if path:
+                    candidates.append([table for table in path[1:-1] if table not in tables])
+        added: List[TableKey] = []
+        for missing in sorted(candidates, key=len):
+            missing = [table for table in missing if table not in added]
+            if missing and len(tables) + len(added) + len(missing) <= max_tables:
+                added += missing
+        return added
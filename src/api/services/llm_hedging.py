@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from core import settings
+
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """
+    Recent latencies of the successful LLM calls per (task, model), plus the counters of the
+    hedging budget: hedges are only issued while they stay under LLM_HEDGE_MAX_FRACTION of
+    the calls. Safe to share between threads.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self._latencies: Dict[Tuple[str, str], deque] = {}
+        self._counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def record(self, task: str, model: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault((task, model), deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, task: str, model: str) -> Optional[float]:
+        """LLM_HEDGE_PERCENTILE of the recent latencies, or None while there are too few samples."""
+        with self._lock:
+            samples = sorted(self._latencies.get((task, model), ()))
+        if len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        rank = min(int(len(samples) * settings.LLM_HEDGE_PERCENTILE / 100), len(samples) - 1)
+        return samples[rank]
+
+    def started(self, task: str, model: str) -> None:
+        with self._lock:
+            self._calls += 1
+            self._count(task, model, "calls")
+
+    def try_hedge(self, task: str, model: str) -> bool:
+        """Reserves one hedge if the budget allows it."""
+        with self._lock:
+            if self._hedges + 1 > settings.LLM_HEDGE_MAX_FRACTION * self._calls:
+                self._count(task, model, "over_budget")
+                return False
+            self._hedges += 1
+            self._count(task, model, "hedges")
+            return True
+
+    def hedge_won(self, task: str, model: str) -> None:
+        with self._lock:
+            self._count(task, model, "hedges_won")
+
+    def _count(self, task: str, model: str, name: str) -> None:
+        counts = self._counts.setdefault((task, model), {"calls": 0, "hedges": 0, "hedges_won": 0, "over_budget": 0})
+        counts[name] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._latencies.clear()
+            self._counts.clear()
+            self._calls = 0
+            self._hedges = 0
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """Counters keyed by "task/model"."""
+        with self._lock:
+            return {f"{task}/{model}": dict(counts) for (task, model), counts in sorted(self._counts.items())}
+
+
+_shared: Optional[LatencyTracker] = None
+_pool: Optional[ThreadPoolExecutor] = None
+_shared_lock = threading.Lock()
+
+
+def shared_tracker() -> LatencyTracker:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LatencyTracker(settings.LLM_HEDGE_WINDOW)
+        return _shared
+
+
+def _shared_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _shared_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.LLM_HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+        return _pool
+
+
+def call(task: str, model: str, request: Callable[[], T]) -> T:
+    """
+    Runs `request` (one LLM call, parsed and validated) and, when LLM_HEDGE_ENABLED and it has
+    not returned after the model's recent LLM_HEDGE_PERCENTILE latency, issues a duplicate.
+    The first call to return without raising wins; if both fail, the primary's error is raised.
+    The loser cannot be interrupted mid-request: it is cancelled if it has not started yet,
+    otherwise its result is discarded.
+    """
+    tracker = shared_tracker()
+
+    def timed() -> T:
+        started = time.monotonic()
+        result = request()
+        tracker.record(task, model, time.monotonic() - started)
+        return result
+
+    if not settings.LLM_HEDGE_ENABLED:
+        return timed()
+
+    tracker.started(task, model)
+    delay = tracker.hedge_delay(task, model)
+    pool = _shared_pool()
+    primary = pool.submit(timed)
+    if delay is None or wait([primary], timeout=delay).done or not tracker.try_hedge(task, model):
+        return primary.result()
+
+    hedge = pool.submit(timed)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                if future is hedge:
+                    tracker.hedge_won(task, model)
+                return future.result()
+    return primary.result()
@@ -0,0 +1,68 @@
+import threading
+from typing import Any, Dict, Optional
+
+
+def cached_tokens(usage: Any) -> int:
+    """Prompt tokens served from the provider's prefix cache (0 when not reported)."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+class LLMUsage:
+    """
+    Token usage of the LLM calls per (task, model): calls, prompt, cached and completion
+    tokens, plus the fallbacks to the next routed model after an API error. Safe to share
+    between threads.
+    """
+
+    def __init__(self):
+        self._totals: Dict[tuple, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, task: str, model: str, usage: Any) -> None:
+        if usage is None:
+            return
+        with self._lock:
+            totals = self._entry(task, model)
+            totals["calls"] += 1
+            totals["prompt_tokens"] += usage.prompt_tokens or 0
+            totals["cached_tokens"] += cached_tokens(usage)
+            totals["completion_tokens"] += usage.completion_tokens or 0
+
+    def record_fallback(self, task: str, model: str) -> None:
+        """Counts a call to `model` that failed and moved on to the next model of the route."""
+        with self._lock:
+            self._entry(task, model)["fallbacks"] += 1
+
+    def _entry(self, task: str, model: str) -> Dict[str, int]:
+        return self._totals.setdefault(
+            (task, model),
+            {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "fallbacks": 0},
+        )
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Totals keyed by "task/model", with the share of prompt tokens that hit the cache."""
+        with self._lock:
+            return {
+                f"{task}/{model}": {
+                    **totals,
+                    "cache_hit_ratio": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0,
+                }
+                for (task, model), totals in sorted(self._totals.items())
+            }
+
+
+_shared: Optional[LLMUsage] = None
+_shared_lock = threading.Lock()
+
+
+def shared_usage() -> LLMUsage:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LLMUsage()
+        return _shared
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import List, Optional
+
+import httpx
+from openai import InternalServerError
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_message import FunctionCall
+from openai.types.completion_usage import CompletionUsage
+from openai.types.create_embedding_response import Usage
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+
+from api import schemas
+
+
+EMBED_DIM = 1536
+
+# Campos que devem conter SQL executável nas respostas simuladas
+SQL_FIELDS = {"sql_query", "optimized_query", "fixed_sql_query"}
+
+# Formatos de contexto produzidos pelos dois retrievers:
+#   complete -> "Table 'orders' has columns: ..."
+#   minimal  -> 'CREATE TABLE IF NOT EXISTS "public"."orders" ('
+TABLE_NAME_PATTERNS = [
+    re.compile(r"Table '([^']+)' has columns"),
+    re.compile(r'CREATE TABLE IF NOT EXISTS "[^"]+"\."([^"]+)"'),
+]
+
+RESULT_MODELS = {
+    "text_to_sql": schemas.TextToSQLEvent,
+    "synthesize_response": schemas.SynthesisResult,
+    "optimize_sql": schemas.OptimizeResult,
+    "explain_sql": schemas.ExplainSQLResult,
+    "fix_sql": schemas.FixSQLResult,
+    "repair_sql": schemas.FixSQLResult,
+}
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _count_tokens(text: str) -> int:
+    # Aproximação grosseira (~4 caracteres por token), suficiente para o usage simulado
+    return max(1, len(text) // 4)
+
+
+def hash_embedding(text: str, dim: int = EMBED_DIM) -> List[float]:
+    """Deterministic bag-of-words embedding (feature hashing, L2-normalised)."""
+    vector = [0.0] * dim
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+        vector[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return [v / norm for v in vector]
+
+
+def stub_sql_for_prompt(prompt: str) -> str:
+    """Builds a cheap, valid SELECT against the first table found in the prompt."""
+    for pattern in TABLE_NAME_PATTERNS:
+        match = pattern.search(prompt)
+        if match:
+            return f'SELECT * FROM "{match.group(1)}" LIMIT 10'
+    return "SELECT 1"
+
+
+def stub_arguments(function_name: str, prompt: str) -> dict:
+    """Deterministic, schema-valid arguments for a function-calling response."""
+    model = RESULT_MODELS[function_name]
+    digest = _digest(prompt)
+    arguments = {}
+    for field in model.model_fields:
+        if field in SQL_FIELDS:
+            arguments[field] = stub_sql_for_prompt(prompt)
+        else:
+            arguments[field] = f"stub {field} {digest}"
+    return arguments
+
+
+class FaultInjector:
+    """
+    Injects latency (fixed + uniform jitter) and server errors into stub calls.
+    The random sequence is seeded, so a given configuration always fails the same calls.
+    """
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def before_call(self, endpoint: str) -> None:
+        with self._lock:
+            delay_ms = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+            fail = self._random.random() < self.error_rate
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        if fail:
+            request = httpx.Request("POST", f"http://llm-stub.local/v1/{endpoint}")
+            raise InternalServerError(
+                "Injected error from the stub LLM backend",
+                response=httpx.Response(500, request=request),
+                body=None,
+            )
+
+
+NO_FAULTS = FaultInjector()
+
+
+def _prompt_text(messages: List[dict]) -> str:
+    return "\n".join(str(message.get("content", "")) for message in messages)
+
+
+class _StubCompletions:
+    def __init__(self, client: "StubOpenAI"):
+        self._client = client
+
+    def create(self, model: str, messages: List[dict], functions=None, function_call=None, **kwargs) -> ChatCompletion:
+        self._client.faults.before_call("chat/completions")
+        prompt = _prompt_text(messages)
+        if function_call:
+            name = function_call["name"]
+            message = ChatCompletionMessage(
+                role="assistant",
+                content=None,
+                function_call=FunctionCall(name=name, arguments=json.dumps(stub_arguments(name, prompt))),
+            )
+        else:
+            message = ChatCompletionMessage(role="assistant", content=f"stub answer {_digest(prompt)}")
+        return self._client._completion(model, prompt, message)
+
+
+class _StubParseCompletions:
+    def __init__(self, client: "StubOpenAI"):
+        self._client = client
+
+    def parse(self, model: str, messages: List[dict], response_format, **kwargs) -> ChatCompletion:
+        self._client.faults.before_call("chat/completions")
+        prompt = _prompt_text(messages)
+        arguments = {field: f"stub {field} {_digest(prompt)}" for field in response_format.model_fields}
+        message = ChatCompletionMessage(role="assistant", content=json.dumps(arguments))
+        return self._client._completion(model, prompt, message)
+
+
+class _StubChat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class _StubBeta:
+    def __init__(self, client: "StubOpenAI"):
+        self.chat = _StubChat(_StubParseCompletions(client))
+
+
+class _StubEmbeddings:
+    def __init__(self, client: "StubOpenAI"):
+        self._client = client
+
+    def create(self, input, model: str = "text-embedding-ada-002", **kwargs) -> CreateEmbeddingResponse:
+        self._client.faults.before_call("embeddings")
+        texts = [input] if isinstance(input, str) else list(input)
+        tokens = sum(_count_tokens(text) for text in texts)
+        return CreateEmbeddingResponse(
+            object="list",
+            model=model,
+            data=[
+                Embedding(object="embedding", index=i, embedding=hash_embedding(text))
+                for i, text in enumerate(texts)
+            ],
+            usage=Usage(prompt_tokens=tokens, total_tokens=tokens),
+        )
+
+
+class StubOpenAI:
+    """
+    Drop-in replacement for the subset of the OpenAI client used by the service:
+    chat.completions.create (function calling), beta.chat.completions.parse and
+    embeddings.create. Every answer is derived from the prompt, so runs are reproducible.
+    """
+
+    def __init__(self, faults: Optional[FaultInjector] = None):
+        self.faults = faults or NO_FAULTS
+        self.chat = _StubChat(_StubCompletions(self))
+        self.beta = _StubBeta(self)
+        self.embeddings = _StubEmbeddings(self)
+
+    def _completion(self, model: str, prompt: str, message: ChatCompletionMessage) -> ChatCompletion:
+        prompt_tokens = _count_tokens(prompt)
+        completion_tokens = _count_tokens(message.content or message.function_call.arguments)
+        return ChatCompletion(
+            id=f"chatcmpl-stub-{_digest(prompt)}",
+            object="chat.completion",
+            created=int(time.time()),
+            model=model,
+            choices=[Choice(index=0, finish_reason="stop", message=message)],
+            usage=CompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
+
+
+class StubEmbedding(BaseEmbedding):
+    """LlamaIndex embed model backed by `hash_embedding`."""
+
+    dim: int = Field(default=EMBED_DIM)
+    faults: FaultInjector = Field(default=NO_FAULTS, exclude=True)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        self.faults.before_call("embeddings")
+        return hash_embedding(query, self.dim)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self.faults.before_call("embeddings")
+        return hash_embedding(text, self.dim)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # Um único "request" por lote, como na API real
+        self.faults.before_call("embeddings")
+        return [hash_embedding(text, self.dim) for text in texts]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+
+_shared_faults: Optional[FaultInjector] = None
+
+
+def shared_faults() -> FaultInjector:
+    """Process-wide injector configured from settings, shared by the client and the embed model."""
+    global _shared_faults
+    if _shared_faults is None:
+        _shared_faults = faults_from_settings()
+    return _shared_faults
+
+
+def reset_shared_faults() -> None:
+    global _shared_faults
+    _shared_faults = None
+
+
+def faults_from_settings() -> FaultInjector:
+    from core import settings
+
+    return FaultInjector(
+        latency_ms=settings.LLM_STUB_LATENCY_MS,
+        jitter_ms=settings.LLM_STUB_LATENCY_JITTER_MS,
+        error_rate=settings.LLM_STUB_ERROR_RATE,
+        seed=settings.LLM_STUB_SEED,
+    )
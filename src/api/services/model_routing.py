@@ -0,0 +1,76 @@
+import json
+import logging
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from openai import APIError
+
+from api.services import llm_metrics
+from core import settings
+
+logger = logging.getLogger(__name__)
+
+# Tarefas do OpenAISQLGenerator (function_name das estratégias) mais o resumo de schema
+TASKS = ("text_to_sql", "synthesize_response", "optimize_sql", "explain_sql", "fix_sql", "repair_sql", "schema_summary")
+
+# Modelos usados até aqui; LLM_MODEL_ROUTES troca qualquer um deles
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "text_to_sql": ["gpt-4-turbo-2024-04-09"],
+    "synthesize_response": ["gpt-4-turbo-2024-04-09"],
+    "optimize_sql": ["gpt-4-turbo-2024-04-09"],
+    "explain_sql": ["gpt-4-turbo-2024-04-09"],
+    "fix_sql": ["gpt-4-turbo-2024-04-09"],
+    "repair_sql": ["gpt-4-turbo-2024-04-09"],
+    "schema_summary": ["gpt-4o-2024-08-06"],
+}
+
+T = TypeVar("T")
+
+
+def _routes(routes: dict, where: str) -> Dict[str, List[str]]:
+    parsed = {}
+    for task, models in routes.items():
+        if task not in TASKS:
+            raise ValueError(f"Unknown task in {where}: {task}")
+        models = [models] if isinstance(models, str) else list(models)
+        if not models:
+            raise ValueError(f"No model for {task} in {where}")
+        parsed[task] = models
+    return parsed
+
+
+@lru_cache(maxsize=8)
+def _parse(routes: str, overrides: str) -> tuple:
+    # Lido uma vez por valor das settings
+    default = {**DEFAULT_ROUTES, **_routes(json.loads(routes or "{}"), "LLM_MODEL_ROUTES")}
+    per_database = {
+        int(database_id): _routes(database_routes, f"LLM_MODEL_OVERRIDES[{database_id}]")
+        for database_id, database_routes in json.loads(overrides or "{}").items()
+    }
+    return default, per_database
+
+
+def models_for(task: str, database_id: Optional[int] = None) -> List[str]:
+    """
+    Models for a task, first choice then fallbacks: the database's entry in LLM_MODEL_OVERRIDES,
+    else LLM_MODEL_ROUTES, else DEFAULT_ROUTES. A route is a model name or a list of them.
+    """
+    if task not in TASKS:
+        raise ValueError(f"Unknown task: {task}")
+    default, per_database = _parse(settings.LLM_MODEL_ROUTES, settings.LLM_MODEL_OVERRIDES)
+    return per_database.get(database_id, {}).get(task) or default[task]
+
+
+def call_with_fallback(task: str, models: List[str], call: Callable[[str], T]) -> T:
+    """
+    Calls `call(model)` with each model in turn until one does not raise an API error. Each
+    fallback is logged and counted in llm_metrics under (task, failed model).
+    """
+    for position, model in enumerate(models):
+        try:
+            return call(model)
+        except APIError as e:
+            if position == len(models) - 1:
+                raise
+            llm_metrics.shared_usage().record_fallback(task, model)
+            logger.warning("%s: model %s failed (%r); falling back to %s", task, model, e, models[position + 1])
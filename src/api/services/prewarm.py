@@ -0,0 +1,120 @@
+import json
+import time
+from typing import Callable, Dict, Optional
+
+from django.db.models import Max
+from django.forms.models import model_to_dict
+
+from api.models import Database
+from core import settings
+
+
+def run(log: Callable[[str], None] = print, notify: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    """
+    Warms a worker before it takes traffic: imports the RAG stack, creates the LLM client,
+    opens the pgvector pool and loads the retrievers and table contexts of the
+    PREWARM_DATABASES most recently asked databases. A failing phase is logged and skipped.
+    Returns the milliseconds spent per phase. `notify` (gunicorn's worker.notify) is called
+    between phases so a long prewarm does not trip the worker timeout.
+    """
+    timings: Dict[str, float] = {}
+    context: dict = {}
+    for name, phase in PHASES:
+        started = time.perf_counter()
+        try:
+            detail = phase(context)
+        except Exception as e:
+            detail = f"failed: {e!r}"
+        timings[name] = (time.perf_counter() - started) * 1000
+        log(f"prewarm {name}: {timings[name]:.0f}ms{f' ({detail})' if detail else ''}")
+        if notify is not None:
+            notify()
+    log(f"prewarm total: {sum(timings.values()):.0f}ms")
+    return timings
+
+
+def _imports(context: dict) -> str:
+    from api.services import rag_service
+
+    context["rag_service"] = rag_service
+    return ""
+
+
+def _llm_client(context: dict) -> str:
+    rag_service = context["rag_service"]
+    context["llm"] = rag_service.LLMFactory.create_llm("gpt-4o")
+    return settings.LLM_BACKEND
+
+
+def _vector_store(context: dict) -> str:
+    from sqlalchemy import text
+    from api.services import vector_index
+
+    sync_engine, _ = vector_index.store_engines()
+    with sync_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    context["store"] = vector_index.store()
+    return settings.VECTOR_TABLE_NAME
+
+
+def _active_databases(context: dict) -> str:
+    # Último id de pergunta como aproximação de atividade recente
+    context["databases"] = list(
+        Database.objects.annotate(last_question=Max("questionanswer__id"))
+        .filter(last_question__isnull=False)
+        .order_by("-last_question")[:settings.PREWARM_DATABASES]
+    )
+    return ", ".join(str(db.id) for db in context["databases"]) or "none"
+
+
+def _retrievers(context: dict) -> str:
+    """
+    Builds the shared workflows (rag_service.cached_workflow) of the prompt types asked of
+    each active database, the same instances its requests will use, and loads their join
+    graphs: the table contexts (pgvector nodes) or the reflected target tables.
+    """
+    from api import schemas
+
+    rag_service = context["rag_service"]
+    passwords = _credentials()
+    warmed = []
+    for db_obj in context["databases"]:
+        prompt_types = sorted(set(db_obj.questionanswer_set.values_list("prompt_type", flat=True)))
+        if db_obj.type == "minimal":
+            for prompt_type in prompt_types:
+                workflow = rag_service.simple_workflow(db_obj.name, prompt_type, db_obj.id)
+                workflow.schema_retriever.join_graph()
+        elif db_obj.id in passwords and db_obj.check_password(passwords[db_obj.id]):
+            # Abre o pool e reflete as tabelas registradas do database do cliente
+            database_dict = model_to_dict(db_obj)
+            database_dict["password"] = passwords[db_obj.id]
+            connection = schemas.DatabaseConnection(**database_dict)
+            tables = [table.name for table in db_obj.table_set.all()]
+            for prompt_type in prompt_types:
+                workflow = rag_service.text_to_sql_workflow(
+                    connection, tables, db_obj.have_obj_index, prompt_type, db_obj.id
+                )
+                workflow.obj_retriever.join_graph()
+            for table in tables:
+                workflow.sql_database.get_single_table_info(table)
+        else:
+            continue
+        warmed.append(f"{db_obj.id}:{','.join(prompt_types)}")
+    return ", ".join(warmed) or "none"
+
+
+def _credentials() -> Dict[int, str]:
+    """Plain passwords of complete databases (PREWARM_CREDENTIALS, same format as detect_schema_drift)."""
+    if not settings.PREWARM_CREDENTIALS:
+        return {}
+    with open(settings.PREWARM_CREDENTIALS) as f:
+        return {int(key): value for key, value in json.load(f).items()}
+
+
+PHASES = (
+    ("imports", _imports),
+    ("llm_client", _llm_client),
+    ("vector_store", _vector_store),
+    ("active_databases", _active_databases),
+    ("retrievers", _retrievers),
+)
@@ -0,0 +1,78 @@
+from sqlalchemy import text
+
+from api import schemas
+from api.services import sql_tables
+from core import settings
+
+
+GUARD_MODES = ("limit", "reject", "off")
+
+
+def guard_mode() -> str:
+    if settings.SQL_GUARD_MODE not in GUARD_MODES:
+        raise ValueError(f"Unknown SQL_GUARD_MODE: {settings.SQL_GUARD_MODE}")
+    return settings.SQL_GUARD_MODE
+
+
+def strip_statement(sql: str) -> str:
+    return sql.strip().rstrip(";").strip()
+
+
+def explain(conn, sql: str) -> dict:
+    """Planner estimate (EXPLAIN without ANALYZE, so nothing runs) of the top plan node."""
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    return plan[0]["Plan"]
+
+
+def over_budget(plan: dict) -> str:
+    """Why a plan exceeds SQL_GUARD_MAX_COST/SQL_GUARD_MAX_ROWS, or "" when it does not."""
+    if plan["Total Cost"] > settings.SQL_GUARD_MAX_COST:
+        return f"estimated cost {plan['Total Cost']:.0f} exceeds {settings.SQL_GUARD_MAX_COST:.0f}"
+    if plan["Plan Rows"] > settings.SQL_GUARD_MAX_ROWS:
+        return f"estimated {plan['Plan Rows']:.0f} rows exceed {settings.SQL_GUARD_MAX_ROWS}"
+    return ""
+
+
+def check(engine, sql: str) -> schemas.QueryGuardDecision:
+    """
+    EXPLAINs the generated statement, inside a read-only transaction, and decides whether
+    it can run. Anything but a single SELECT is rejected before reaching the database. In
+    "limit" mode a SELECT over budget is wrapped in a LIMIT and planned again before giving up.
+    """
+    mode = guard_mode()
+    if mode == "off":
+        return schemas.QueryGuardDecision(sql_query=sql)
+    if not sql_tables.is_single_select(sql):
+        return schemas.QueryGuardDecision(sql_query=sql, rejected=True, reason="only a single SELECT statement can run")
+
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            conn.execute(text("SET TRANSACTION READ ONLY"))
+            return _decide(conn, mode, sql)
+        finally:
+            # EXPLAIN não escreve nada: a transação só é desfeita
+            transaction.rollback()
+
+
+def _decide(conn, mode: str, sql: str) -> schemas.QueryGuardDecision:
+    statement = strip_statement(sql)
+    try:
+        reason = over_budget(explain(conn, statement))
+    except Exception as e:
+        return schemas.QueryGuardDecision(sql_query=sql, rejected=True, reason=f"query could not be planned: {e}")
+    if not reason:
+        return schemas.QueryGuardDecision(sql_query=sql)
+
+    if mode == "limit":
+        limited = f"SELECT * FROM ({statement}) AS guarded LIMIT {settings.SQL_GUARD_LIMIT_ROWS}"
+        try:
+            limited_reason = over_budget(explain(conn, limited))
+        except Exception:
+            limited_reason = reason
+        if not limited_reason:
+            return schemas.QueryGuardDecision(
+                sql_query=limited,
+                reason=f"{reason}; limited to {settings.SQL_GUARD_LIMIT_ROWS} rows",
+            )
+    return schemas.QueryGuardDecision(sql_query=sql, rejected=True, reason=reason)
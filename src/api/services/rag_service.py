@@ -4,10 +4,10 @@ from llama_index.core.workflow import (
     StopEvent,
     step,
     Context,
+    WorkflowTimeoutError,
 )
 
 from llama_index.core import SQLDatabase
-from llama_index.vector_stores.postgres import PGVectorStore
 from llama_index.core import SimpleDirectoryReader, StorageContext
 from llama_index.core.objects import (
     SQLTableNodeMapping,
@@ -22,7 +22,7 @@ from llama_index.core.indices.struct_store.sql_query import (
 )
 
 from llama_index.core.retrievers import SQLRetriever
-from typing import List
+from typing import Dict, List, Optional
 from llama_index.core.prompts.default_prompts import DEFAULT_TEXT_TO_SQL_PROMPT
 from llama_index.core import PromptTemplate
 from llama_index.core.llms import ChatResponse
@@ -31,18 +31,33 @@ from llama_index.core.prompts import ChatPromptTemplate
 from llama_index.core.bridge.pydantic import BaseModel, Field
 # from llama_index.llms.openai import OpenAI
 from llama_index.core.llms import ChatMessage
-from llama_index.core.schema import TextNode  # Versões mais novas (modularizadas)
+from llama_index.core.schema import NodeWithScore, TextNode  # Versões mais novas (modularizadas)
+from llama_index.core import Settings as LlamaSettings
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
 
 from abc import ABC, abstractmethod
-from typing import Protocol, Any
+from typing import Protocol, Any, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from api import schemas
 from api.models import Database
+from api.services import (
+    catalog, deadlines, join_graph, llm_hedging, llm_metrics, llm_stub, model_routing, query_guard, result_cache,
+    retrieval_cutoff, sql_tables, sql_validation, vector_index,
+)
 
+import asyncio
+from collections import OrderedDict
+import datetime
+import decimal
+import logging
 import os
-from openai import OpenAI
+import threading
+import time
+import uuid
+from openai import APITimeoutError, OpenAI
 from core import settings
 
 from dotenv import load_dotenv
@@ -53,6 +68,8 @@ load_dotenv()
 
 OpenAI.api_key = os.getenv("OPENAI_API_KEY")
 
+logger = logging.getLogger(__name__)
+
 
 class IPromptStrategy(Protocol):
     @abstractmethod
@@ -70,12 +87,66 @@ class IPromptStrategy(Protocol):
 
 
 
+# Layout pensado para o cache de prefixo do provedor: instruções, dialeto e schema
+# (estáveis por database) primeiro, a pergunta por último. Os templates são montados uma vez.
+TEXT_TO_SQL_PROMPT = PromptTemplate(DEFAULT_TEXT_TO_SQL_PROMPT.template)
+
+SCHEMA_SUMMARY_PROMPT = PromptTemplate(
+    "Give me a short, concise summary/caption of the table in the following table schema. \n"
+    "Schema Information:\n{context}\n"
+    "Answer: \n"
+)
+
+OPTIMIZE_SQL_PROMPT = PromptTemplate(
+    "Optimize the following SQL query for better performance. Return the optimized sql query and an explanation. \n"
+    "Database: {database}\n"
+    "Schema Information:\n{context}\n"
+    "Query: {query}\n"
+    "Answer: \n"
+)
+
+EXPLAIN_SQL_PROMPT = PromptTemplate(
+    "Explain this SQL query in detail; do not return the provided query, but only an explanation of what it does. \n"
+    "Database: {database}\n"
+    "Schema Information:\n{context}\n"
+    "Query: {query}\n"
+    "Explanation: \n"
+)
+
+FIX_SQL_PROMPT = PromptTemplate(
+    "Fix the SQL syntax errors in the following query. Answer only with a single formatted SQL code block, no additional text. \n"
+    "Database: {database}\n"
+    "Schema Information:\n{context}\n"
+    "Query: {query}\n"
+    "Answer: \n"
+)
+
+REPAIR_SQL_PROMPT = PromptTemplate(
+    "The following SQL query does not match the database schema. Fix the errors using only the tables "
+    "and columns in the schema, keeping what the query is meant to answer. \n"
+    "Database: {database}\n"
+    "Schema Information:\n{context}\n"
+    "Question: {question}\n"
+    "Query: {query}\n"
+    "Errors:\n{errors}\n"
+    "Answer: \n"
+)
+
+RESPONSE_SYNTHESIS_PROMPT = PromptTemplate(
+    "Given an input question, synthesize a response from the query results.\n"
+    "SQL: {sql_query}\n"
+    "SQL Response: {context_str}\n"
+    "Query: {query_str}\n"
+    "Response: "
+)
+
+
 class TextToSQLPromptStrategy(IPromptStrategy):
     def __init__(self, engine):
-        self.base_prompt = DEFAULT_TEXT_TO_SQL_PROMPT.partial_format(dialect=engine)
+        self.base_prompt = TEXT_TO_SQL_PROMPT.partial_format(dialect=engine)
 
     def create_prompt(self, kwargs: Any) -> str:
-        return self.base_prompt.format_messages(query_str=kwargs["query"], schema=kwargs["context"])
+        return self.base_prompt.format(schema=kwargs["context"], query_str=kwargs["query"])
 
     def function_name(self) -> str:
         return "text_to_sql"
@@ -88,38 +159,17 @@ class SchemaSummaryPromptStrategy(IPromptStrategy):
         self.database = database
 
     def create_prompt(self, kwargs: Any) -> str:
-        schema_summary_prompt = (
-            "Give me a short, concise summary/caption of the table in the following table schema. \n"
-            "Schema Information:\n{context}\n"
-            "Answer: \n"
-        )
-        return PromptTemplate(
-            schema_summary_prompt,
-        ).format_messages(
-            context=kwargs["context"],
-        )
+        return SCHEMA_SUMMARY_PROMPT.format(context=kwargs["context"])
     
 
 class OptimizesSQLQueryPromptStrategy(IPromptStrategy):
     def __init__(self, database):
 
         self.database=database
+        self.base_prompt = OPTIMIZE_SQL_PROMPT.partial_format(database=database)
     
     def create_prompt(self, kwargs: Any) -> str:
-        optimize_sql_query_prompt = (
-            "Optimize the following SQL query for better performance. Return the optimized sql query and an explanation. \n"
-            "Schema Information:\n{context}\n"
-            "Database: {database}\n" 
-            "Query: {query}\n"
-            "Answer: \n"
-        )
-        return PromptTemplate(
-            optimize_sql_query_prompt,
-        ).format_messages(
-            query=kwargs["query"],
-            context=kwargs["context"],
-            database=self.database,
-        )
+        return self.base_prompt.format(context=kwargs["context"], query=kwargs["query"])
     
     def function_name(self) -> str:
         return "optimize_sql"
@@ -132,22 +182,10 @@ class ExplainSQLQueryPromptStrategy(IPromptStrategy):
     def __init__(self, database):
 
         self.database=database
+        self.base_prompt = EXPLAIN_SQL_PROMPT.partial_format(database=database)
     
     def create_prompt(self, kwargs: Any) -> str:
-        explain_sql_query_prompt = (
-            "Explain this SQL query in detail; do not return the provided query, but only an explanation of what it does. \n"
-            "Schema Information:\n{context}\n"
-            "Database: {database}\n" 
-            "Query: {query}\n"
-            "Explanation: \n"
-        )
-        return PromptTemplate(
-            explain_sql_query_prompt,
-        ).format_messages(
-            query=kwargs["query"],
-            context=kwargs["context"],
-            database=self.database,
-        )
+        return self.base_prompt.format(context=kwargs["context"], query=kwargs["query"])
     
     def function_name(self) -> str:
         return "explain_sql"
@@ -160,22 +198,10 @@ class FixSQLQueryPromptStrategy(IPromptStrategy):
     def __init__(self, database):
 
         self.database=database
+        self.base_prompt = FIX_SQL_PROMPT.partial_format(database=database)
     
     def create_prompt(self, kwargs: Any) -> str:
-        optimize_sql_query_prompt = (
-            "Fix the SQL syntax errors in the following query. Answer only with a single formatted SQL code block, no additional text. The Query: \n"
-            "Schema Information:\n{context}\n"
-            "Database: {database}\n" 
-            "Query: {query}\n"
-            "Answer: \n"
-        )
-        return PromptTemplate(
-            optimize_sql_query_prompt,
-        ).format_messages(
-            query=kwargs["query"],
-            context=kwargs["context"],
-            database=self.database,
-        )
+        return self.base_prompt.format(context=kwargs["context"], query=kwargs["query"])
     
     def function_name(self) -> str:
         return "fix_sql"
@@ -183,22 +209,32 @@ class FixSQLQueryPromptStrategy(IPromptStrategy):
     def function_schema(self) -> dict:
         return schemas.FixSQLResult.model_json_schema()
 
+
+class RepairSQLPromptStrategy(IPromptStrategy):
+    """Fixes generated SQL with the errors found by the local validation (sql_validation)."""
+
+    def __init__(self, database):
+        self.database = database
+        self.base_prompt = REPAIR_SQL_PROMPT.partial_format(database=database)
+
+    def create_prompt(self, kwargs: Any) -> str:
+        return self.base_prompt.format(
+            context=kwargs["context"], question=kwargs["question"], query=kwargs["query"], errors=kwargs["errors"]
+        )
+
+    def function_name(self) -> str:
+        return "repair_sql"
+
+    def function_schema(self) -> dict:
+        return schemas.FixSQLResult.model_json_schema()
+
     
 class ResponseSynthesisPromptStrategy(IPromptStrategy):
     def create_prompt(self, kwargs: Any) -> str:
-        response_synthesis_prompt_str = (
-            "Given an input question, synthesize a response from the query results.\n"
-            "Query: {query_str}\n"
-            "SQL: {sql_query}\n"
-            "SQL Response: {context_str}\n"
-            "Response: "
-        )
-        return PromptTemplate(
-            response_synthesis_prompt_str,
-        ).format_messages(
-            query_str=kwargs["query_str"], 
+        return RESPONSE_SYNTHESIS_PROMPT.format(
             sql_query=kwargs["sql_query"],
-            context_str=kwargs["context_str"]
+            context_str=kwargs["context_str"],
+            query_str=kwargs["query_str"],
         )
     
     def function_name(self) -> str:
@@ -228,122 +264,310 @@ class PromptStrategyFactory:
     @staticmethod
     def create_fixsql_strategy(database) -> IPromptStrategy:
         return FixSQLQueryPromptStrategy(database)
+
+    @staticmethod
+    def create_repairsql_strategy(database) -> IPromptStrategy:
+        return RepairSQLPromptStrategy(database)
+
+    @staticmethod
+    def create_for_prompt_type(prompt_type: str, database: str = "postgresql") -> IPromptStrategy:
+        if prompt_type == "text_to_sql":
+            return PromptStrategyFactory.create_text2sql_strategy(database)
+        if prompt_type == "optimize_sql":
+            return PromptStrategyFactory.create_optimizesql_strategy(database)
+        if prompt_type == "explain_sql":
+            return PromptStrategyFactory.create_explainsql_strategy(database)
+        if prompt_type == "fix_sql":
+            return PromptStrategyFactory.create_fixsql_strategy(database)
+        raise ValueError(f"Unknown prompt_type: {prompt_type}")
+
     @staticmethod
     def create_schema_summary_strategy(database) -> IPromptStrategy:
         return SchemaSummaryPromptStrategy(database)
 
 
 class OpenAISQLGenerator:
-    def __init__(self, llm, prompt_strategy: IPromptStrategy):
+    """
+    Calls the LLM with a prompt strategy. The strategy can be given per call, so a single
+    generator is shared by concurrent workflows; the one passed here is only the default.
+    The model of each task comes from model_routing (with the database's overrides).
+    """
+
+    def __init__(self, llm, prompt_strategy: IPromptStrategy = None, database_id: int = None):
         self.llm = llm
         self.prompt_strategy = prompt_strategy
+        self.database_id = database_id
 
-    def change_prompt_strategy(self, new_strategy: IPromptStrategy):
-        self.prompt_strategy = new_strategy
-
-    def generate(self, kwargs) -> BaseModel:
-        # 1. Cria o prompt de sistema/usuário
+    def generate(self, kwargs, prompt_strategy: IPromptStrategy = None, deadline: deadlines.Deadline = None) -> BaseModel:
+        """
+        With a `deadline`, each request (fallbacks and hedges included) times out with the time
+        left, and DeadlineExceeded is raised once it is over.
+        """
+        prompt_strategy = prompt_strategy or self.prompt_strategy
+        # 1. Cria o prompt de sistema/usuário (renderizado uma única vez)
+        prompt = str(prompt_strategy.create_prompt(kwargs))
         user_message = {
             "role": "user",
-            "content": str(self.prompt_strategy.create_prompt(kwargs))
+            "content": prompt
         }
-        print("\n\n\nPROMPT: \n", str(self.prompt_strategy.create_prompt(kwargs)))
+        logger.debug("Prompt for %s:\n%s", prompt_strategy.function_name(), prompt)
         # 2. Função “simulada” para structured output
         func_def = {
-            "name": self.prompt_strategy.function_name(),
-            "description": f"Structured output for {self.prompt_strategy.function_name()}",
-            "parameters": self.prompt_strategy.function_schema()
+            "name": prompt_strategy.function_name(),
+            "description": f"Structured output for {prompt_strategy.function_name()}",
+            "parameters": prompt_strategy.function_schema()
         }
 
-        # 3. Chama a ChatCompletion com function-calling
-        response = self.llm.chat.completions.create(
-            model="gpt-4-turbo-2024-04-09",
-            messages=[user_message],
-            functions=[func_def],
-            function_call={"name": self.prompt_strategy.function_name()},
-        )
-
-        # 4. Extrai o JSON retornado e valida com Pydantic
-        func_call = response.choices[0].message.function_call
-        result_json = func_call.arguments
+        task = prompt_strategy.function_name()
         result_model = {
             "text_to_sql": schemas.TextToSQLEvent,
             "synthesize_response": schemas.SynthesisResult,
             "optimize_sql": schemas.OptimizeResult,
             "explain_sql": schemas.ExplainSQLResult,
             "fix_sql": schemas.FixSQLResult,
-        }[self.prompt_strategy.function_name()]
-        print("\n\n\nResultModel: ", result_model.model_validate_json(result_json))
-        return result_model.model_validate_json(result_json)
+            "repair_sql": schemas.FixSQLResult,
+        }[task]
+
+        def complete(model: str) -> BaseModel:
+            # 3. Chama a ChatCompletion com function-calling
+            response = self.llm.chat.completions.create(
+                model=model,
+                messages=[user_message],
+                functions=[func_def],
+                function_call={"name": task},
+                **({} if deadline is None else {"timeout": deadline.timeout()}),
+            )
+            llm_metrics.shared_usage().record(task, response.model, response.usage)
+            # 4. Extrai o JSON retornado e valida com Pydantic (resposta inválida não vence o hedge)
+            func_call = response.choices[0].message.function_call
+            return result_model.model_validate_json(func_call.arguments)
+
+        # Modelo da tarefa (com fallbacks), com hedge nas chamadas lentas
+        try:
+            result = model_routing.call_with_fallback(
+                task,
+                model_routing.models_for(task, self.database_id),
+                lambda model: llm_hedging.call(task, model, lambda: complete(model)),
+            )
+        except APITimeoutError as e:
+            if deadline is not None and deadline.expired():
+                raise deadlines.DeadlineExceeded(f"{task} did not finish before the deadline") from e
+            raise
+        logger.debug("Result of %s: %r", task, result)
+        return result
     
-    def generate_schema_summary(self, kwargs) -> BaseModel:
+    def generate_schema_summary(self, kwargs, prompt_strategy: IPromptStrategy = None) -> BaseModel:
 
         user_message = {
             "role": "user",
-            "content": str(self.prompt_strategy.create_prompt(kwargs))
+            "content": str((prompt_strategy or self.prompt_strategy).create_prompt(kwargs))
         }
 
-        response = self.llm.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[user_message],
-        response_format=schemas.SchemaSummary,
+        def complete(model: str) -> BaseModel:
+            response = self.llm.beta.chat.completions.parse(
+                model=model,
+                messages=[user_message],
+                response_format=schemas.SchemaSummary,
+            )
+            llm_metrics.shared_usage().record("schema_summary", response.model, response.usage)
+            logger.debug("Schema summary from %s: %r", model, response.choices[0].message)
+            return schemas.SchemaSummary.model_validate_json(response.choices[0].message.content)
+
+        return model_routing.call_with_fallback(
+            "schema_summary",
+            model_routing.models_for("schema_summary", self.database_id),
+            lambda model: llm_hedging.call("schema_summary", model, lambda: complete(model)),
         )
 
-        print("================================\n")
-        print(response.choices[0].message)
-        print("Tipo: ", type(response.choices[0].message))
-        print("================================\n")
-        
-        return schemas.SchemaSummary.model_validate_json(response.choices[0].message.content)
-
 
 class LLMFactory:
+    _openai_client = None
+    _openai_lock = threading.Lock()
+
     @staticmethod
     def create_llm(model: str):
-        client = OpenAI()
-        return client
+        """OpenAI client of the LLM_BACKEND. The model is picked per task by model_routing."""
+        if settings.LLM_BACKEND == "stub":
+            return llm_stub.StubOpenAI(faults=llm_stub.shared_faults())
+        if settings.LLM_BACKEND != "openai":
+            raise ValueError(f"Unknown LLM_BACKEND: {settings.LLM_BACKEND}")
+        # Um cliente por processo: reaproveita o pool HTTP (e o aquecido no prewarm).
+        # Sem retries do cliente: cada chamada já recebe o prazo inteiro que resta, e as
+        # falhas seguem para o fallback de modelo (model_routing) e o hedge
+        with LLMFactory._openai_lock:
+            if LLMFactory._openai_client is None:
+                LLMFactory._openai_client = OpenAI(max_retries=0)
+            return LLMFactory._openai_client
+
+    @staticmethod
+    def configure_embed_model():
+        """Points the LlamaIndex embed model at the selected backend."""
+        if settings.LLM_BACKEND == "stub":
+            LlamaSettings.embed_model = llm_stub.StubEmbedding(faults=llm_stub.shared_faults())
+
+
+LLMFactory.configure_embed_model()
+
+
+def index_schemas_in_batches(sql_generator: OpenAISQLGenerator, index: VectorStoreIndex, contexts: dict, to_node) -> Iterator[List[str]]:
+    """
+    Summarizes many table schemas ({table name: schema text}) concurrently; finished tables
+    become nodes (`to_node(name, schema, summary)`) that are embedded and inserted in batches
+    while the remaining summaries run. Yields the table names of each inserted batch.
+    """
+    summarize = lambda context: sql_generator.generate_schema_summary({"context": context}).schema_summary
+    batch = []
+    with ThreadPoolExecutor(max_workers=settings.CATALOG_SUMMARY_CONCURRENCY) as pool:
+        futures = {pool.submit(summarize, context): name for name, context in contexts.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            batch.append((name, to_node(name, contexts[name], future.result())))
+            if len(batch) >= settings.CATALOG_INSERT_BATCH:
+                index.insert_nodes([node for _, node in batch])
+                yield [name for name, _ in batch]
+                batch = []
+    if batch:
+        index.insert_nodes([node for _, node in batch])
+        yield [name for name, _ in batch]
+
+
+_target_databases: "OrderedDict[str, SQLDatabase]" = OrderedDict()
+_target_databases_lock = threading.Lock()
+
+
+def _target_url(cnt_str: schemas.DatabaseConnection) -> str:
+    return f"postgresql://{cnt_str.username}:{cnt_str.password}@{cnt_str.host}:{cnt_str.port}/{cnt_str.name}"
+
+
+def target_database(cnt_str: schemas.DatabaseConnection) -> SQLDatabase:
+    """
+    SQLDatabase (connection pool plus reflected tables) of a complete-mode database, shared by
+    the requests of this process instead of being created and reflected on every request.
+    Keeps the TARGET_DATABASE_CACHE_SIZE most recently used ones.
+    """
+    url = _target_url(cnt_str)
+    with _target_databases_lock:
+        sql_database = _target_databases.get(url)
+        if sql_database is not None:
+            _target_databases.move_to_end(url)
+            return sql_database
+
+    # A reflexão acontece fora do lock para não travar os outros databases
+    # Sessões só de leitura: mesmo um SQL que escape das checagens não escreve no banco do cliente
+    sql_database = SQLDatabase(create_engine(
+        url, pool_pre_ping=True, connect_args={"options": "-c default_transaction_read_only=on"}
+    ))
+    with _target_databases_lock:
+        sql_database = _target_databases.setdefault(url, sql_database)
+        _target_databases.move_to_end(url)
+        while len(_target_databases) > settings.TARGET_DATABASE_CACHE_SIZE:
+            _, evicted = _target_databases.popitem(last=False)
+            evicted.engine.dispose()
+    return sql_database
+
+
+def forget_target_database(cnt_str: schemas.DatabaseConnection) -> None:
+    """Drops the cached SQLDatabase (e.g. after a schema change) so the next use reflects it again."""
+    with _target_databases_lock:
+        sql_database = _target_databases.pop(_target_url(cnt_str), None)
+    if sql_database is not None:
+        sql_database.engine.dispose()
+
+
+class PromptTableSchema(SQLTableSchema):
+    """SQLTableSchema plus the description the table puts in the prompt, when retrieval already built it."""
+    table_info: Optional[str] = None
+
+
+def table_infos(sql_database: SQLDatabase, obj_retriever, table_names: List[str], query: str = None) -> Dict[str, str]:
+    """
+    Description of each table as it goes into the prompt. Tables with at least
+    COLUMN_NODES_MIN_COLUMNS columns keep only the columns relevant to `query` plus their keys.
+    """
+    infos = {}
+    reflected = sql_database.metadata_obj.tables
+    wide = [
+        name for name in table_names
+        if name in reflected and len(reflected[name].columns) >= settings.COLUMN_NODES_MIN_COLUMNS
+    ]
+    if settings.COLUMN_NODES_MIN_COLUMNS and query and wide:
+        for name, columns in obj_retriever.relevant_columns(query, wide).items():
+            table = catalog.from_reflected(reflected[name])
+            kept = catalog.pruned(table, columns)
+            infos[name] = catalog.table_info(kept) + f" ({len(table.columns) - len(kept.columns)} other columns omitted)"
+    for name in table_names:
+        if name not in infos:
+            infos[name] = sql_database.get_single_table_info(name)
+    return infos
+
+
+def table_context(table_info: str, context_str: Optional[str]) -> str:
+    """Table description plus its summary, the block each table adds to the text-to-SQL prompt."""
+    return table_info + (" The table description is: " + context_str if context_str else "")
 
 
 class SQLTableRetriever():
-    def __init__(self, cnt_str: schemas.DatabaseConnection, sql_generator: OpenAISQLGenerator, tables: List[str], have_obj_index: bool):
+    def __init__(self, cnt_str: schemas.DatabaseConnection, sql_generator: OpenAISQLGenerator, tables: List[str], have_obj_index: bool, database_id: int):
         self.cnt_str = cnt_str
         self.sql_generator = sql_generator
         self.tables = tables
         self.have_obj_index = have_obj_index
+        self.database_id = database_id
         self.obj_index = None
+        self._join_graph = None
         
-        engine = create_engine(f"postgresql://{self.cnt_str.username}:{self.cnt_str.password}@{self.cnt_str.host}:{self.cnt_str.port}/{self.cnt_str.name}")
-        self.sql_database = SQLDatabase(engine)
+        self.sql_database = target_database(self.cnt_str)
     
-        
-        self.pgvector_store = PGVectorStore.from_params(
-            database=cnt_str.name,
-            host=cnt_str.host,
-            port=cnt_str.port,
-            user=cnt_str.username,
-            password=cnt_str.password,
-            table_name=""+cnt_str.name
-        )
+        # Os nós de todos os databases ficam na tabela consolidada, separados pelo database_id
+        self.pgvector_store = vector_index.store()
         self.storage_context = StorageContext.from_defaults(vector_store=self.pgvector_store)
 
-    def adding_existing_index(self, new_table_name):
-        """ADICIONANDO NOVA TABELA AO PGVECTOR NUM INDEX JÁ EXISTENTE"""
-        table_schema = self.sql_database.get_table_columns(new_table_name)
-        print("\n\n\ntable_schema: ", table_schema)
-        kwargs = {
-            "context": table_schema
-        }
-        
-        schema_summary_result = self.sql_generator.generate_schema_summary(kwargs)
-        try:
-            table_node_mapping = SQLTableNodeMapping(self.sql_database)
-            index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
-            new_table_schema = SQLTableSchema(table_name=new_table_name, context_str=schema_summary_result.schema_summary)
-            new_node = table_node_mapping.to_node(new_table_schema)
-            index.insert_nodes([new_node])
-        except Exception as e:
-            print(f"Erro ao carregar índice do PGVector: {e}")
-            self.obj_index = None  # Evita erro caso não haja índice salvo
+    def _to_node(self, table_schema: SQLTableSchema, table_info: str = None) -> TextNode:
+        if table_info is None:
+            node = SQLTableNodeMapping(self.sql_database).to_node(table_schema)
+        else:
+            # Mesmo nó do SQLTableNodeMapping, com o schema vindo do catálogo já lido. Id novo a
+            # cada indexação: a reindexação (schema_drift) insere antes de remover os antigos por id
+            name, context = table_schema.table_name, table_schema.context_str
+            node = TextNode(
+                id_=str(uuid.uuid4()),
+                text=f"Schema of table {name}:\n{table_info}\nContext of table {name}:\n{context}",
+                metadata={"name": name, "context": context},
+                excluded_embed_metadata_keys=["name", "context"],
+                excluded_llm_metadata_keys=["name", "context"],
+            )
+        node.id_ = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{self.database_id}:{node.id_}"))
+        node.metadata[vector_index.TENANT_KEY] = self.database_id
+        node.metadata["table_name"] = table_schema.table_name
+        node.excluded_embed_metadata_keys += [vector_index.TENANT_KEY, "table_name"]
+        node.excluded_llm_metadata_keys += [vector_index.TENANT_KEY, "table_name"]
+        return node
+
+    def _column_nodes(self, table_name: str, columns: List[schemas.CatalogColumn]) -> List[TextNode]:
+        """
+        One node per column (name, type and comment) of a table with at least
+        COLUMN_NODES_MIN_COLUMNS columns; none for narrower tables or when the setting is 0.
+        """
+        if not settings.COLUMN_NODES_MIN_COLUMNS or len(columns) < settings.COLUMN_NODES_MIN_COLUMNS:
+            return []
+        nodes = []
+        for column in columns:
+            text = f"Column {column.name} ({column.type}) of table {table_name}"
+            if column.comment:
+                text += f": {column.comment}"
+            keys = [vector_index.TENANT_KEY, "table_name", "column_name", vector_index.NODE_TYPE_KEY]
+            nodes.append(TextNode(
+                text=text,
+                metadata={
+                    vector_index.TENANT_KEY: self.database_id,
+                    "table_name": table_name,
+                    "column_name": column.name,
+                    vector_index.NODE_TYPE_KEY: vector_index.COLUMN_NODE,
+                },
+                excluded_embed_metadata_keys=keys,
+                excluded_llm_metadata_keys=keys,
+            ))
+        return nodes
 
     def load_existing_index(self):
         """Carrega o índice existente do PGVector, se houver"""
@@ -370,108 +594,131 @@ class SQLTableRetriever():
         
         schema_summary_result = self.sql_generator.generate_schema_summary(kwargs)
         print("\n\n\nschema_summary_result: ", schema_summary_result)
-        if not self.have_obj_index:
-            table_node_mapping = SQLTableNodeMapping(self.sql_database)
-            tables_info = [schemas.TableInfo(table_name=new_table_name, table_context=schema_summary_result.schema_summary)]
-            # tables_info = [schemas.TableInfo(table_name=table) for table in self.tables]
-            # print("\n\ntables_info schema: ", tables_info)    
-            table_schema_objs = [
-                SQLTableSchema(table_name=t.table_name, context_str=t.table_context)
-                for t in tables_info
-            ]
-            # print("\n\ntable_schema_objs: ", table_schema_objs)
-            self.obj_index = ObjectIndex.from_objects(
-                objects=table_schema_objs,
-                object_mapping=table_node_mapping,
-                index_cls=VectorStoreIndex,
-                storage_context=self.storage_context
-            )
-        if self.have_obj_index:    
-            self.obj_index = self.adding_existing_index(new_table_name)
+        new_table_schema = SQLTableSchema(table_name=new_table_name, context_str=schema_summary_result.schema_summary)
+        index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
+        columns = [
+            schemas.CatalogColumn(name=column["name"], type=str(column["type"]), comment=column.get("comment"))
+            for column in table_schema
+        ]
+        index.insert_nodes([self._to_node(new_table_schema)] + self._column_nodes(new_table_name, columns))
+        self.obj_index = self.load_existing_index()
+
+    def add_table_schemas(self, catalog_tables: List[schemas.CatalogTable]) -> Iterator[List[str]]:
+        """
+        Registers many tables from an introspected catalog in one pass.
+        Yields the names of each inserted batch.
+        """
+        index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
+        by_name = {table.table_name: table for table in catalog_tables}
+        contexts = {name: catalog.table_info(table) for name, table in by_name.items()}
+        to_node = lambda name, info, summary: self._to_node(SQLTableSchema(table_name=name, context_str=summary), info)
+        for names in index_schemas_in_batches(self.sql_generator, index, contexts, to_node):
+            # Os nós de coluna entram com o lote: uma tabela devolvida já está indexada por inteiro
+            column_nodes = [node for name in names for node in self._column_nodes(name, by_name[name].columns)]
+            if column_nodes:
+                index.insert_nodes(column_nodes)
+            self.tables = self.tables + names
+            yield names
+
+    def node_ids(self, table_names: List[str]) -> Dict[str, List[str]]:
+        """Ids of the nodes (table and column nodes) indexed for each of `table_names`."""
+        if not table_names:
+            return {}
+        ids: Dict[str, List[str]] = {}
+        for node in self.pgvector_store.get_nodes(filters=vector_index.tenant_filters(self.database_id, table_name=table_names)):
+            ids.setdefault(node.metadata["table_name"], []).append(node.node_id)
+        return ids
+
+    def delete_nodes(self, node_ids: List[str]) -> None:
+        if node_ids:
+            self.pgvector_store.delete_nodes(node_ids=node_ids)
 
     def delete_table_schema(self, table_to_delete):
-        # Clear no data_vector
-        self.pgvector_store.clear()    
-        for table in self.tables:
-            print("table names in self.tables: ", table)
-            if table != table_to_delete:
-                print("if atendido!")
-                
-    
-        # Criando uma lista com as tabelas com nomes diferentes da que a gente está deletando
-        self.tables = [table for table in self.tables if table != table_to_delete]
-        
-        # Recrie o índice com as tabelas restantes
-        table_node_mapping = SQLTableNodeMapping(self.sql_database)
-        tables_info = [schemas.TableInfo(table_name=table) for table in self.tables]
-        table_schema_objs = [
-            SQLTableSchema(table_name=t.table_name)
-            for t in tables_info
-        ]
-        print("\n")
-        
-        for t in tables_info:
-            print("Nome da tabela:", t)
-
-        print("\n")
-        print("self.storage_context:", self.storage_context)
-        print("\n") 
-        print("table_schema_objs:", table_schema_objs)
-        print("\n") 
-        
-        
-        self.obj_index = ObjectIndex.from_objects(
-            objects=table_schema_objs,
-            object_mapping=table_node_mapping,
-            index_cls=VectorStoreIndex,
-            storage_context=self.storage_context
+        # Remove só os nós dessa tabela neste database; os demais continuam indexados
+        self.pgvector_store.delete_nodes(
+            filters=vector_index.tenant_filters(self.database_id, table_name=table_to_delete)
         )
-        
+        self.tables = [table for table in self.tables if table != table_to_delete]
         print(f"Tabela '{table_to_delete}' removida e index atualizado.")
+
+    def clear_schemas(self):
+        """Removes every node of this database from the vector table."""
+        self.pgvector_store.delete_nodes(filters=vector_index.tenant_filters(self.database_id))
         
+    def lookup(self, table_names: List[str]) -> List[SQLTableSchema]:
+        """Registered tables among `table_names`, with their summaries read by metadata (no embedding)."""
+        names = [name for name in table_names if name in self.tables]
+        if not names:
+            return []
+        nodes = self.pgvector_store.get_nodes(
+            filters=vector_index.table_filters(self.database_id, table_name=names)
+        )
+        contexts = {node.metadata["table_name"]: node.metadata.get("context") for node in nodes}
+        return [SQLTableSchema(table_name=name, context_str=contexts.get(name)) for name in names]
+
     def retrieve(self, query: str) -> List[SQLTableSchema]:    
-        self.obj_index = self.load_existing_index()
-        return self.obj_index.as_retriever(similarity_top_k=3, timeout=15).retrieve(query)
+        # Índice local: o retriever é compartilhado por workflows concorrentes.
+        # Os nós com score passam pelo top-k adaptativo antes de virarem SQLTableSchema
+        index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
+        candidates = index.as_retriever(
+            similarity_top_k=settings.RETRIEVAL_MAX_K,
+            filters=vector_index.table_filters(self.database_id),
+            vector_store_kwargs=vector_index.query_kwargs(),
+        ).retrieve(query)
+        # O orçamento de tokens conta a descrição que vai ao prompt (já podada nas tabelas largas)
+        infos = table_infos(self.sql_database, self, [candidate.node.metadata["table_name"] for candidate in candidates], query)
+        found = [
+            PromptTableSchema(
+                table_name=candidate.node.metadata["table_name"],
+                context_str=candidate.node.metadata.get("context"),
+                table_info=infos[candidate.node.metadata["table_name"]],
+            )
+            for candidate in retrieval_cutoff.cut(
+                candidates,
+                lambda candidate: table_context(infos[candidate.node.metadata["table_name"]], candidate.node.metadata.get("context")),
+            )
+        ]
+        bridges = self.join_graph().bridges(
+            [catalog.split_name(obj.table_name) for obj in found], settings.JOIN_PATH_MAX_TABLES, settings.JOIN_PATH_MAX_HOPS
+        )
+        return found + self.lookup([catalog.qualified_name(*key) for key in bridges]) if bridges else found
+
+    def join_graph(self) -> join_graph.JoinGraph:
+        """Foreign keys between the registered tables, from the metadata reflected once for the target database."""
+        if self._join_graph is None:
+            tables = [catalog.from_reflected(table) for table in self.sql_database.metadata_obj.tables.values()]
+            self._join_graph = join_graph.JoinGraph.from_tables(tables, [catalog.split_name(name) for name in self.tables])
+        return self._join_graph
+
+    def relevant_columns(self, query: str, table_names: List[str]) -> Dict[str, List[str]]:
+        """
+        Columns of `table_names` closest to the query, from their column nodes: up to
+        COLUMN_RETRIEVAL_TOP_K per table. Tables indexed without column nodes are absent.
+        """
+        index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
+        nodes = index.as_retriever(
+            similarity_top_k=settings.COLUMN_RETRIEVAL_TOP_K * len(table_names),
+            filters=vector_index.tenant_filters(
+                self.database_id, table_name=table_names, **{vector_index.NODE_TYPE_KEY: vector_index.COLUMN_NODE}
+            ),
+            vector_store_kwargs=vector_index.query_kwargs(),
+        ).retrieve(query)
+        relevant: Dict[str, List[str]] = {}
+        for node in nodes:
+            relevant.setdefault(node.metadata["table_name"], []).append(node.metadata["column_name"])
+        return relevant
 
     
 class SQLSchemaRetriever():
-    def __init__(self, db_name: str, sql_generator: OpenAISQLGenerator):
+    def __init__(self, db_name: str, sql_generator: OpenAISQLGenerator, database_id: int):
         self.db_name = db_name
         self.sql_generator = sql_generator
-        # Nesse caso, com execção do nome do database, o resto dos campos não é obrigatório
-        self.pgvector_store = PGVectorStore.from_params(
-            database=settings.env('DB_NAME'),
-            host=settings.env('DB_HOST'),
-            port=settings.env('DB_PORT'),
-            user=settings.env('DB_USER'),
-            password=settings.env('DB_PASSWORD'),
-            table_name=self.db_name,
-        )
+        self.database_id = database_id
+        self._join_graph = None
+        # Os schemas de todos os databases ficam na tabela consolidada, separados pelo database_id
+        self.pgvector_store = vector_index.store()
         self.storage_context = StorageContext.from_defaults(vector_store=self.pgvector_store)
 
-    def adding_existing_index(self, new_table_name):
-        """ADICIONANDO NOVA TABELA AO PGVECTOR NUM INDEX JÁ EXISTENTE"""
-        try:
-            tables_info = [schemas.TableInfo(table_name=table) for table in self.tables]
-            # print("\n\ntables_info schema load: ", tables_info)    
-            table_schema_objs = [
-                SQLTableSchema(table_name=t.table_name)
-                for t in tables_info
-            ]
-            table_node_mapping = SQLTableNodeMapping(self.sql_database)
-            index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
-
-            obj_test = ObjectIndex.from_objects_and_index(objects=table_schema_objs, object_mapping=table_node_mapping, index=index)
-            
-            new_table_schema = SQLTableSchema(table_name=new_table_name)
-            
-            new_node = table_node_mapping.to_node(new_table_schema)
-        
-            index.insert_nodes([new_node])
-        except Exception as e:
-            print(f"Erro ao carregar índice do PGVector: {e}")
-            self.obj_index = None  # Evita erro caso não haja índice salvo
-
     def load_existing_index(self):
         """Carrega o índice existente do PGVector, se houver"""
         try:
@@ -480,7 +727,7 @@ class SQLSchemaRetriever():
             print(f"Erro ao carregar índice do PGVector: {e}")
             self.pgvector_store = None  # Evita erro caso não haja índice salvo
 
-    def add_table_schema(self, table_name, table_schema):
+    def add_table_schema(self, table_name, table_schema, references: List[str] = None, schema_name: str = "public"):
         # Criar um nó de texto com o schema fornecido
         # Levar o table_schema pro LLM produzir um summary
 
@@ -489,16 +736,7 @@ class SQLSchemaRetriever():
         }
         
         schema_summary_result = self.sql_generator.generate_schema_summary(kwargs)
-    
-        node = TextNode(
-            text=table_schema,
-            metadata={
-                "table_name": table_name,
-                "type": "schema_definition",
-                "schema_summary": schema_summary_result.schema_summary
-            },
-            schema_summary=schema_summary_result.schema_summary
-        )
+        node = self._to_node(table_name, table_schema, schema_summary_result.schema_summary, references, schema_name)
         
         # Criar ou carregar o índice existente
         index = VectorStoreIndex.from_vector_store(
@@ -507,50 +745,281 @@ class SQLSchemaRetriever():
         
         # Inserir o nó no índice
         index.insert_nodes([node])
+
+    def add_table_schemas(self, catalog_tables: List[schemas.CatalogTable]) -> Iterator[List[str]]:
+        """Registers many tables at once. Yields the names of each inserted batch."""
+        index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
+        values = [
+            value
+            for table in catalog_tables
+            for value in generate_postgres_schemas(catalog.schema_rows(table))
+        ]
+        # Chave no formato catalog.qualified_name, o mesmo dos registros Table
+        by_name = {catalog.qualified_name(value["schema_name"], value["table_name"]): value for value in values}
+        contexts = {name: value["schema"] for name, value in by_name.items()}
+
+        def to_node(name, table_schema, schema_summary) -> TextNode:
+            value = by_name[name]
+            return self._to_node(value["table_name"], table_schema, schema_summary, value["references"], value["schema_name"])
+
+        yield from index_schemas_in_batches(self.sql_generator, index, contexts, to_node)
+
+    def _to_node(self, table_name, table_schema, schema_summary, references: List[str] = None, schema_name: str = "public") -> TextNode:
+        # "references": tabelas (no formato catalog.qualified_name) apontadas pelas chaves
+        # estrangeiras declaradas, para o grafo de joins
+        return TextNode(
+            text=table_schema,
+            metadata={
+                "table_name": table_name,
+                "schema_name": schema_name,
+                "type": "schema_definition",
+                "schema_summary": schema_summary,
+                "references": references or [],
+                vector_index.TENANT_KEY: self.database_id,
+            },
+            excluded_embed_metadata_keys=[vector_index.TENANT_KEY, "references", "schema_name"],
+            excluded_llm_metadata_keys=[vector_index.TENANT_KEY, "references", "schema_name"],
+            schema_summary=schema_summary
+        )
                   
 
+    def node_ids(self, table_names: List[str]) -> Dict[str, List[str]]:
+        """Ids of the schema nodes of each of `table_names` (catalog.qualified_name format)."""
+        ids: Dict[str, List[str]] = {}
+        for node in self.lookup(table_names):
+            ids.setdefault(catalog.qualified_name(*self.node_key(node)), []).append(node.node_id)
+        return ids
+
+    def delete_nodes(self, node_ids: List[str]) -> None:
+        if node_ids:
+            self.pgvector_store.delete_nodes(node_ids=node_ids)
+
     def delete_table_schema(self, table_name):
         """
-        Remove os nós correspondentes ao schema da tabela com base no metadado "table_name".
+        Remove os nós do schema da tabela (nome no formato catalog.qualified_name), sem tocar
+        em tabelas de mesmo nome em outros schemas.
         """
         try:
-            index = VectorStoreIndex.from_vector_store(vector_store=self.pgvector_store)
-            
-            # Acessa o index_struct (atributo protegido) para obter o mapping de nós
-            index_struct = index._index_struct
-            
-            # Recupera os node_ids presentes no índice
-            node_ids = list(index_struct.nodes_dict.values())
-            
-            # Recupera os nós armazenados no docstore
-            nodes = index._docstore.get_nodes(node_ids)
-            
-            # Filtra os nós que possuem o metadado "table_name" correspondente
-            nodes_to_delete = [node.node_id for node in nodes if node.metadata.get("table_name") == table_name]
-            
-            if nodes_to_delete:
-                # Remove os nós do vector store usando o método delete_nodes do índice
-                index.delete_nodes(nodes_to_delete)
-                
-                # Opcionalmente, remova também do index_struct e docstore
-                for node_id in nodes_to_delete:
-                    index_struct.delete(node_id)
-                    index._docstore.delete_document(node_id, raise_error=False)
-        except Exception as e:
-            print(f"Erro ao deletar schema do PGVector: {e}")
-
+            self.delete_nodes(self.node_ids([table_name]).get(table_name, []))
+        except Exception:
+            logger.exception("Could not delete the schema nodes of %s", table_name)
 
+    def clear_schemas(self):
+        """Removes every node of this database from the vector table."""
+        self.pgvector_store.delete_nodes(filters=vector_index.tenant_filters(self.database_id))
         
+    @staticmethod
+    def node_key(node) -> join_graph.TableKey:
+        """(schema, table) of a schema node; nodes indexed before "schema_name" existed are in public."""
+        return node.metadata.get("schema_name") or "public", node.metadata["table_name"]
+
+    def lookup(self, table_names: List[str]) -> List[TextNode]:
+        """
+        Schema nodes of the registered tables among `table_names` (catalog.qualified_name format),
+        read by metadata (no embedding).
+        """
+        if not table_names:
+            return []
+        keys = [catalog.split_name(name) for name in table_names]
+        nodes = self.pgvector_store.get_nodes(
+            filters=vector_index.tenant_filters(self.database_id, table_name=[table for _, table in keys])
+        )
+        order = {key: position for position, key in enumerate(keys)}
+        return sorted(
+            [node for node in nodes if self.node_key(node) in order], key=lambda node: order[self.node_key(node)]
+        )
+
     def retrieve(self, query: str) -> List[SQLTableSchema]:    
-        self.pgvector_store = self.load_existing_index()
-        return self.pgvector_store.as_retriever(similarity_top_k=3, timeout=15).retrieve(query)
+        index = self.load_existing_index()
+        found = retrieval_cutoff.cut(index.as_retriever(
+            similarity_top_k=settings.RETRIEVAL_MAX_K,
+            filters=vector_index.tenant_filters(self.database_id),
+            vector_store_kwargs=vector_index.query_kwargs(),
+        ).retrieve(query))
+        bridges = self.join_graph().bridges(
+            [self.node_key(node) for node in found], settings.JOIN_PATH_MAX_TABLES, settings.JOIN_PATH_MAX_HOPS
+        )
+        return found + self.lookup([catalog.qualified_name(*key) for key in bridges]) if bridges else found
+
+    def join_graph(self) -> join_graph.JoinGraph:
+        """Foreign keys declared in the schema JSON, read once from the "references" of this database's nodes."""
+        if self._join_graph is None:
+            nodes = self.pgvector_store.get_nodes(filters=vector_index.tenant_filters(self.database_id))
+            self._join_graph = join_graph.JoinGraph.from_references(
+                {
+                    self.node_key(node): [catalog.split_name(name) for name in node.metadata.get("references") or []]
+                    for node in nodes
+                },
+                [self.node_key(node) for node in nodes],
+            )
+        return self._join_graph
+
+
+
+# Prompts que já recebem o SQL do usuário: as tabelas vêm do próprio SQL
+PARSED_PROMPT_TYPES = ("explain_sql", "fix_sql", "optimize_sql")
+
 
+def retrieve_schemas(retriever, prompt_type: str, query: str) -> list:
+    """
+    For prompts over user-supplied SQL, the registered tables the SQL references; vector
+    retrieval is the fallback when none of them is found (or for text_to_sql).
+    """
+    if prompt_type in PARSED_PROMPT_TYPES:
+        found = retriever.lookup(sql_tables.referenced_tables(query))
+        if found:
+            return found
+    return retriever.retrieve(query)
 
 
 # Class que executa as querys no banco
+def json_value(value):
+    """Keeps numbers, strings, booleans and None; dates become ISO strings and decimals floats."""
+    if value is None or isinstance(value, (bool, int, float, str, list, dict)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+class QueryCancelled(Exception):
+    """The generated query hit its statement_timeout or was cancelled on the target database."""
+
+
+class QueryRejected(Exception):
+    """The generated SQL is not a single read-only SELECT, so it is not sent to the target database."""
+
+
 class SQLRunQuery():
-    def __init__(self, sql_database):
-        self.sql_executor = SQLRetriever(sql_database)
+    def __init__(self, sql_database, database_id: int = None, cache_ttl: int = None):
+        self.sql_database = sql_database
+        self.database_id = database_id
+        self.cache_ttl = settings.RESULT_CACHE_TTL if cache_ttl is None else cache_ttl
+        # Prazo (time.monotonic) do workflow; define o statement_timeout das queries
+        self.deadline = None
+        self._backends = set()
+        self._backends_lock = threading.Lock()
+
+    def statement_timeout_ms(self) -> int:
+        """Time left until the workflow deadline, capped by SQL_STATEMENT_TIMEOUT."""
+        budget = settings.SQL_STATEMENT_TIMEOUT
+        if self.deadline is not None:
+            budget = min(budget, self.deadline - time.monotonic())
+        if budget <= 0:
+            raise QueryCancelled("no time left in the workflow budget to run the query")
+        return max(int(budget * 1000), 1)
+
+    def execute(self, sql_query: str) -> schemas.QueryRows:
+        """
+        Runs the query in a read-only transaction with a statement_timeout, keeping track of
+        the backend pid so `cancel` can stop it. Keeps at most SQL_RESULT_MAX_ROWS rows.
+        Anything but a single SELECT raises QueryRejected before touching the database.
+        """
+        if not sql_tables.is_single_select(sql_query):
+            raise QueryRejected("only a single SELECT statement can run")
+        max_rows = settings.SQL_RESULT_MAX_ROWS
+        with self.sql_database.engine.connect() as conn:
+            conn.execute(text("SET TRANSACTION READ ONLY"))
+            conn.execute(text(f"SET LOCAL statement_timeout = {self.statement_timeout_ms()}"))
+            pid = conn.execute(text("SELECT pg_backend_pid()")).scalar()
+            with self._backends_lock:
+                self._backends.add(pid)
+            try:
+                result = conn.execute(text(sql_query))
+                columns = list(result.keys())
+                rows = result.fetchmany(max_rows + 1)
+            except OperationalError as e:
+                if "canceling statement" in str(e):
+                    raise QueryCancelled(str(e.orig).strip()) from e
+                raise
+            finally:
+                # Sai do conjunto antes de a conexão voltar ao pool: um cancel em andamento
+                # segura o lock, então nunca atinge outra query que reutilize este backend
+                with self._backends_lock:
+                    self._backends.discard(pid)
+                conn.rollback()
+        return schemas.QueryRows(
+            columns=columns,
+            rows=[[json_value(value) for value in row] for row in rows[:max_rows]],
+            truncated=len(rows) > max_rows,
+        )
+
+    @staticmethod
+    def as_nodes(query_rows: schemas.QueryRows) -> List[NodeWithScore]:
+        """Rows in the shape SQLRetriever returns them, used as context for response synthesis."""
+        return [
+            NodeWithScore(node=TextNode(text="", metadata=dict(zip(query_rows.columns, row))))
+            for row in query_rows.rows
+        ]
+
+    def cancel(self) -> None:
+        """Cancels (pg_cancel_backend) the queries of this workflow still running on the target database."""
+        # O lock fica com o cancel até o fim: execute só devolve a conexão ao pool depois
+        with self._backends_lock:
+            if not self._backends:
+                return
+            with self.sql_database.engine.connect() as conn:
+                for pid in list(self._backends):
+                    conn.execute(text("SELECT pg_cancel_backend(:pid)"), {"pid": pid})
+
+    def check(self, sql_query: str) -> schemas.QueryGuardDecision:
+        """Runs the EXPLAIN cost guard, unless the result is already cached."""
+        if self.database_id is not None and self.cache_ttl > 0 and result_cache.is_cacheable(sql_query):
+            if result_cache.shared_cache().get(self.database_id, sql_query) is not None:
+                return schemas.QueryGuardDecision(sql_query=sql_query)
+        return query_guard.check(self.sql_database.engine, sql_query)
+
+    def run(self, sql_query: str) -> schemas.QueryRows:
+        """Executes the query; repeated read-only queries are answered from the result cache."""
+        use_cache = self.database_id is not None and self.cache_ttl > 0 and result_cache.is_cacheable(sql_query)
+        if use_cache:
+            cached = result_cache.shared_cache().get(self.database_id, sql_query)
+            if cached is not None:
+                return cached
+        query_response = self.execute(sql_query)
+        if use_cache:
+            result_cache.shared_cache().set(
+                self.database_id, sql_query, query_response, self.cache_ttl, len(query_response.model_dump_json())
+            )
+        return query_response
+
+
+def sql_prompt_result(prompt_type: str, chat_response) -> schemas.SynthesisResult:
+    """Answer of the prompts over user-supplied SQL (optimize, explain, fix)."""
+    match prompt_type:
+        case "optimize_sql":
+            return schemas.SynthesisResult(
+                natural_language_response=chat_response.optimization_explanation,
+                sql_query=chat_response.optimized_query
+            )
+        case "explain_sql":
+            return schemas.SynthesisResult(
+                natural_language_response=chat_response.sql_query_explanation,
+                sql_query=""
+            )
+        case "fix_sql":
+            return schemas.SynthesisResult(
+                natural_language_response=chat_response.fix_explanation,
+                sql_query=chat_response.fixed_sql_query
+            )
+        case _:
+            raise ValueError(f"Unknown prompt_type: {prompt_type}")
+
+
+def timed_out_result(while_doing: str) -> schemas.WorkflowResult:
+    """Result of a run whose deadline ran out before it had any SQL to return."""
+    return schemas.WorkflowResult(
+        sql_query="",
+        natural_language_response=f"The request ran out of time while {while_doing}.",
+        executed=False,
+        timed_out=True,
+    )
 
 
 class TextToSQLWorkflow(Workflow):
@@ -559,116 +1028,251 @@ class TextToSQLWorkflow(Workflow):
     def __init__(
         self,
         obj_retriever: SQLTableRetriever,
-        sql_run_query: SQLRunQuery,
         sql_generator: OpenAISQLGenerator,
         sql_database,
         prompt_type: str,
         *args,
         **kwargs,
     ) -> None:
-        """Init params."""
-        super().__init__(*args, **kwargs, timeout=30)
+        """
+        Init params. Nothing here changes between runs, so an instance is shared by concurrent
+        requests; the state of a run (sql_run_query, data_only, deadline) comes in the StartEvent.
+        """
+        # Sem timeout fixo: cada execução tem o seu prazo (deadline), lido pelos steps
+        kwargs.setdefault("timeout", None)
+        super().__init__(*args, **kwargs)
         self.obj_retriever = obj_retriever
-        self.sql_run_query = sql_run_query
         self.sql_generator = sql_generator
         self.sql_database = sql_database
         self.prompt_type = prompt_type
+        self.prompt_strategy = PromptStrategyFactory.create_for_prompt_type(prompt_type)
+        self.synthesis_strategy = PromptStrategyFactory.create_synthesis_strategy()
+        self.repair_strategy = PromptStrategyFactory.create_repairsql_strategy("postgresql")
     
     @step
     def retrieve_tables(
         self, ctx: Context, ev: StartEvent
-    ) -> schemas.TableRetrieveEvent:
+    ) -> schemas.TableRetrieveEvent | StopEvent:
         """Retrieve tables."""
         # print("--------- retrieve_tables step test")
-        table_schema_objs = self.obj_retriever.retrieve(ev.query)
-        table_context_str = self._get_table_context_str(table_schema_objs)
+        deadline = ev.get("deadline")
+        try:
+            # A recuperação usa só uma parte do prazo, para sobrar tempo para gerar o SQL
+            table_context_str = deadlines.run_within(
+                deadline,
+                settings.REQUEST_DEADLINE_RETRIEVAL_SHARE,
+                lambda: self._get_table_context_str(
+                    retrieve_schemas(self.obj_retriever, self.prompt_type, ev.query), ev.query
+                ),
+            )
+        except deadlines.DeadlineExceeded as e:
+            return StopEvent(result=timed_out_result(f"retrieving the tables: {e}"))
         print("\n\n\n\n\ntable_context_str: ", table_context_str)
         print(" ---------------- retrieve_tables return:", schemas.TableRetrieveEvent(
             table_context_str=table_context_str, query=ev.query))
 
+        sql_run_query = ev.get("sql_run_query") or SQLRunQuery(self.sql_database, self.obj_retriever.database_id)
+        if deadline is not None:
+            # O statement_timeout da query sai do mesmo prazo
+            sql_run_query.deadline = deadline.expires_at
         return schemas.TableRetrieveEvent(
-            table_context_str=table_context_str, query=ev.query
+            table_context_str=table_context_str,
+            query=ev.query,
+            sql_run_query=sql_run_query,
+            # Devolve SQL e linhas sem a chamada de síntese ao LLM
+            data_only=ev.get("data_only", False),
+            deadline=deadline,
         )
     
     @step
     def generate_sql(
         self, ctx: Context, ev: schemas.TableRetrieveEvent
-    ) -> schemas.TextToSQLEvent | StopEvent:
+    ) -> schemas.GeneratedSQLEvent | StopEvent:
         """Generate SQL statement."""
         kwargs = {
             "context": ev.table_context_str,
             "query": ev.query,
         }
-        match self.prompt_type:
-            case "text_to_sql":
-                response_event = self.sql_generator.generate(kwargs)
-                return response_event
-
-            case "optimize_sql":
-                chat_response = self.sql_generator.generate(kwargs)
-                response = schemas.SynthesisResult(
-                    natural_language_response=chat_response.optimization_explanation,
-                    sql_query=chat_response.optimized_query
-                )
-                return StopEvent(result=response)
-            
-            case "explain_sql":
-                chat_response = self.sql_generator.generate(kwargs)
-                response = schemas.SynthesisResult(
-                    natural_language_response=chat_response.sql_query_explanation,
-                    sql_query=""
-                )
-                return StopEvent(result=response)
-            
-            case "fix_sql":
-                chat_response = self.sql_generator.generate(kwargs)
-                response = schemas.SynthesisResult(
-                    natural_language_response=chat_response.fix_explanation,
-                    sql_query=chat_response.fixed_sql_query
-                )
-                return StopEvent(result=response)
-
-            case _:
-                raise ValueError(f"Unknown prompt_type: {self.prompt_type}")
+        if self.prompt_type == "text_to_sql":
+            try:
+                response_event = self.sql_generator.generate(kwargs, self.prompt_strategy, deadline=ev.deadline)
+            except deadlines.DeadlineExceeded as e:
+                return StopEvent(result=timed_out_result(f"generating the SQL: {e}"))
+            return schemas.GeneratedSQLEvent(
+                **response_event.model_dump(),
+                sql_run_query=ev.sql_run_query,
+                data_only=ev.data_only,
+                table_context_str=ev.table_context_str,
+                deadline=ev.deadline,
+            )
+        try:
+            return StopEvent(result=sql_prompt_result(
+                self.prompt_type, self.sql_generator.generate(kwargs, self.prompt_strategy, deadline=ev.deadline)
+            ))
+        except deadlines.DeadlineExceeded as e:
+            return StopEvent(result=timed_out_result(f"answering: {e}"))
 
     
     @step
-    def generate_response(self, ctx: Context, ev: schemas.TextToSQLEvent) -> StopEvent:
+    def repair_sql(self, ctx: Context, ev: schemas.SQLRepairEvent) -> schemas.GeneratedSQLEvent:
+        """Asks the LLM to fix the errors the local validation found in the generated SQL."""
+        try:
+            sql_query = self.sql_generator.generate({
+                "context": ev.table_context_str,
+                "question": ev.natural_language_query,
+                "query": ev.sql_query,
+                "errors": "\n".join(ev.errors),
+            }, self.repair_strategy, deadline=ev.deadline).fixed_sql_query
+            repair_attempts = ev.repair_attempts + 1
+        except deadlines.DeadlineExceeded:
+            # Sem tempo para reparar: segue com o SQL original, sem novas tentativas
+            sql_query, repair_attempts = ev.sql_query, settings.SQL_REPAIR_MAX_ATTEMPTS
+        return schemas.GeneratedSQLEvent(
+            sql_query=sql_query,
+            natural_language_query=ev.natural_language_query,
+            sql_run_query=ev.sql_run_query,
+            data_only=ev.data_only,
+            table_context_str=ev.table_context_str,
+            repair_attempts=repair_attempts,
+            deadline=ev.deadline,
+        )
+
+    @step
+    def generate_response(self, ctx: Context, ev: schemas.GeneratedSQLEvent) -> StopEvent | schemas.SQLRepairEvent:
         # print("--------- generate_response step test")
         """Run SQL retrieval and generate response."""
-        
+
+        # Valida tabelas e colunas no catálogo refletido em cache, sem ir ao banco do cliente
+        errors = sql_validation.validate(
+            ev.sql_query, sql_validation.catalog_columns(self.sql_database, self.obj_retriever.tables)
+        )
+        if errors and ev.repair_attempts < settings.SQL_REPAIR_MAX_ATTEMPTS and self._has_time_for_llm(ev.deadline):
+            return schemas.SQLRepairEvent(
+                sql_query=ev.sql_query,
+                natural_language_query=ev.natural_language_query,
+                errors=errors,
+                sql_run_query=ev.sql_run_query,
+                data_only=ev.data_only,
+                table_context_str=ev.table_context_str,
+                repair_attempts=ev.repair_attempts,
+                deadline=ev.deadline,
+            )
+        if errors:
+            # Sem reparo possível: devolve os erros em vez de mandar SQL inválido ao banco
+            logger.warning("SQL still invalid after %d repair(s), not executed: %s", ev.repair_attempts, errors)
+            reason = "invalid SQL: " + "; ".join(errors)
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=ev.sql_query,
+                natural_language_response=f"The query was not executed: {reason}.",
+                executed=False,
+                guard_reason=reason,
+                timed_out=ev.deadline is not None and ev.deadline.expired(),
+            ))
+
+        # Confere o plano (EXPLAIN) antes de executar a query no banco, dentro do prazo
+        try:
+            decision = deadlines.run_within(
+                ev.deadline, settings.REQUEST_DEADLINE_GUARD_SHARE, lambda: ev.sql_run_query.check(ev.sql_query)
+            )
+        except deadlines.DeadlineExceeded as e:
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=ev.sql_query,
+                natural_language_response=f"The query was not executed: the cost check ran out of time ({e}).",
+                executed=False,
+                guard_reason=f"cost check timed out: {e}",
+                timed_out=True,
+            ))
+        if decision.rejected:
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=ev.sql_query,
+                natural_language_response=f"The query was not executed: {decision.reason}.",
+                executed=False,
+                guard_reason=decision.reason,
+            ))
+
         #Executar a query no banco
-        query_response = self.sql_run_query.sql_executor.retrieve(ev.sql_query)
+        try:
+            query_rows = ev.sql_run_query.run(decision.sql_query)
+        except QueryRejected as e:
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=decision.sql_query,
+                natural_language_response=f"The query was not executed: {e}.",
+                executed=False,
+                guard_reason=str(e),
+            ))
+        except QueryCancelled as e:
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=decision.sql_query,
+                natural_language_response=f"The query was cancelled: {e}.",
+                executed=False,
+                guard_reason=str(e),
+                timed_out=ev.deadline is not None and ev.deadline.expired(),
+            ))
+        if not ev.data_only and not self._has_time_for_llm(ev.deadline):
+            # Resultado parcial: SQL e linhas, sem a síntese (pode ser pedida depois)
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=decision.sql_query,
+                natural_language_response="",
+                guard_reason=decision.reason,
+                data=query_rows,
+                timed_out=True,
+            ))
+        if ev.data_only:
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=decision.sql_query,
+                natural_language_response="",
+                guard_reason=decision.reason,
+                data=query_rows,
+            ))
+
+        query_response = SQLRunQuery.as_nodes(query_rows)
         print("\nretrieved_schemas: ",query_response)
-        self.sql_generator.change_prompt_strategy(PromptStrategyFactory.create_synthesis_strategy())
-        print("\nself.sql_generator: ",self.sql_generator)
         kwargs = {
             "query_str": ev.natural_language_query, 
             "sql_query": ev.sql_query,
             "context_str": query_response,
         }
-        response_event = self.sql_generator.generate(kwargs)
+        try:
+            response_event = self.sql_generator.generate(kwargs, self.synthesis_strategy, deadline=ev.deadline)
+        except deadlines.DeadlineExceeded:
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=decision.sql_query,
+                natural_language_response="",
+                guard_reason=decision.reason,
+                data=query_rows,
+                timed_out=True,
+            ))
         print("\n\nchat_response: ", response_event)
 
         # result = schemas.SynthesisResult(sql_query=ev.sql, natural_language_response=response_text)
+        if decision.reason:
+            # A query foi executada com LIMIT pelo guard
+            return StopEvent(result=schemas.WorkflowResult(
+                sql_query=decision.sql_query,
+                natural_language_response=response_event.natural_language_response,
+                guard_reason=decision.reason,
+                data=query_rows,
+            ))
         return StopEvent(result=response_event)
 
-    def _get_table_context_str(self, table_schema_objs: List[SQLTableSchema]) -> str:
-        """Get table context string."""
-        # print("--------- _get_table_context_str step test")
-        context_strs = []
-        for table_schema_obj in table_schema_objs:
-            table_info = self.sql_database.get_single_table_info(
-                table_schema_obj.table_name
-            )
-            print("\n\n\context_str: ", table_schema_obj.context_str)
-            if table_schema_obj.context_str:
-                table_opt_context = " The table description is: "
-                table_opt_context += table_schema_obj.context_str
-                table_info += table_opt_context
+    @staticmethod
+    def _has_time_for_llm(deadline: deadlines.Deadline) -> bool:
+        """Whether an optional LLM call (repair, synthesis) still fits before the deadline."""
+        return deadline is None or deadline.allows(settings.REQUEST_DEADLINE_MIN_LLM_CALL)
 
-            context_strs.append(table_info)
-            print(" ---------------- _get_table_context_str return:", "\n\n".join(context_strs))
+    def _get_table_context_str(self, table_schema_objs: List[SQLTableSchema], query: str = None) -> str:
+        """
+        Get table context string. Tables with at least COLUMN_NODES_MIN_COLUMNS columns are
+        described with only the columns relevant to `query` plus their keys.
+        """
+        # Descrições que a recuperação já montou (e contou no orçamento de tokens) são reaproveitadas
+        missing = [obj.table_name for obj in table_schema_objs if getattr(obj, "table_info", None) is None]
+        infos = table_infos(self.sql_database, self.obj_retriever, missing, query) if missing else {}
+        # Ordem fixa (por nome) para o bloco de schema formar o mesmo prefixo entre perguntas
+        context_strs = [
+            table_context(getattr(obj, "table_info", None) or infos[obj.table_name], obj.context_str)
+            for obj in sorted(table_schema_objs, key=lambda obj: obj.table_name)
+        ]
         return "\n\n".join(context_strs)
     
     
@@ -683,24 +1287,34 @@ class SimpleTextToSQLWorkflow(Workflow):
         *args,
         **kwargs,
     ) -> None:
-        """Init params."""
-        super().__init__(*args, **kwargs, timeout=300)
+        """Init params. Shared by concurrent requests, like TextToSQLWorkflow."""
+        kwargs.setdefault("timeout", None)
+        super().__init__(*args, **kwargs)
         self.schema_retriever = schema_retriever
         self.sql_generator = sql_generator
         self.prompt_type = prompt_type
+        self.prompt_strategy = PromptStrategyFactory.create_for_prompt_type(prompt_type)
     
     @step
     def retrieve_tables(
         self, ctx: Context, ev: StartEvent
-    ) -> schemas.SchemaRetrieveEvent:
+    ) -> schemas.SchemaRetrieveEvent | StopEvent:
         """Retrieve tables."""
     
-        retrieved_schemas = self.schema_retriever.retrieve(ev.query)
+        deadline = ev.get("deadline")
+        try:
+            retrieved_schemas = deadlines.run_within(
+                deadline,
+                settings.REQUEST_DEADLINE_RETRIEVAL_SHARE,
+                lambda: retrieve_schemas(self.schema_retriever, self.prompt_type, ev.query),
+            )
+        except deadlines.DeadlineExceeded as e:
+            return StopEvent(result=timed_out_result(f"retrieving the tables: {e}"))
         print("\n\nretrieved_schemas: ", retrieved_schemas)
         tables_schemas = self._get_table_context_str(retrieved_schemas)
         # Retornando o schema e a pergunta do usuário
         return schemas.SchemaRetrieveEvent(
-            table_schema=tables_schemas, query=ev.query
+            table_schema=tables_schemas, query=ev.query, deadline=deadline
         )
     
     @step
@@ -714,47 +1328,23 @@ class SimpleTextToSQLWorkflow(Workflow):
             "query": ev.query,
         }
 
-        match self.prompt_type:
-            case "text_to_sql":
-                chat_response = self.sql_generator.generate(kwargs)
-                response = schemas.SynthesisResult(
-                    natural_language_response="",
-                    sql_query=chat_response.sql_query
-                )
-                return StopEvent(result=response)
-
-            case "optimize_sql":
-                chat_response = self.sql_generator.generate(kwargs)
-                response = schemas.SynthesisResult(
-                    natural_language_response=chat_response.optimization_explanation,
-                    sql_query=chat_response.optimized_query
-                )
-                return StopEvent(result=response)
-            
-            case "explain_sql":
-                chat_response = self.sql_generator.generate(kwargs)
-                response = schemas.SynthesisResult(
-                    natural_language_response=chat_response.sql_query_explanation,
-                    sql_query=""
-                )
-                return StopEvent(result=response)
-            
-            case "fix_sql":
-                chat_response = self.sql_generator.generate(kwargs)
-                response = schemas.SynthesisResult(
-                    natural_language_response=chat_response.fix_explanation,
-                    sql_query=chat_response.fixed_sql_query
-                )
-                return StopEvent(result=response)
-
-            case _:
-                raise ValueError(f"Unknown prompt_type: {self.prompt_type}")
+        try:
+            chat_response = self.sql_generator.generate(kwargs, self.prompt_strategy, deadline=ev.deadline)
+        except deadlines.DeadlineExceeded as e:
+            return StopEvent(result=timed_out_result(f"generating the SQL: {e}"))
+        if self.prompt_type == "text_to_sql":
+            return StopEvent(result=schemas.SynthesisResult(
+                natural_language_response="",
+                sql_query=chat_response.sql_query
+            ))
+        return StopEvent(result=sql_prompt_result(self.prompt_type, chat_response))
     
 
     def _get_table_context_str(self, table_schema_objs: List[SQLTableSchema]) -> str:
         """Get table context string."""
         context_strs = ""
-        for table_schema_obj in table_schema_objs:
+        # Ordem fixa (por nome) para o bloco de schema formar o mesmo prefixo entre perguntas
+        for table_schema_obj in sorted(table_schema_objs, key=lambda obj: obj.metadata.get("table_name", "")):
             table_info = table_schema_obj.text
             if table_schema_obj.metadata:
                 table_opt_context = "\nThe table description is: "
@@ -765,108 +1355,185 @@ class SimpleTextToSQLWorkflow(Workflow):
         return context_strs
     
 
-async def starts_workflow(
-        cnt_str: schemas.DatabaseConnection, 
-        tables: List[str], 
-        user_question: str, 
+_workflows: "OrderedDict[tuple, tuple]" = OrderedDict()
+_workflows_lock = threading.Lock()
+
+
+def cached_workflow(key: tuple, signature: tuple, build) -> Workflow:
+    """
+    Workflow shared by the requests of a (database_id, prompt_type) key. `signature` holds what
+    the instance was built from (connection, registered tables); when it changes the workflow
+    is built again with `build()`. Keeps the WORKFLOW_CACHE_SIZE most recently used ones.
+    """
+    with _workflows_lock:
+        entry = _workflows.get(key)
+        if entry is not None and entry[0] == signature:
+            _workflows.move_to_end(key)
+            return entry[1]
+
+    # Construído fora do lock (o retriever reflete o database do cliente)
+    workflow = build()
+    with _workflows_lock:
+        _workflows[key] = (signature, workflow)
+        _workflows.move_to_end(key)
+        while len(_workflows) > settings.WORKFLOW_CACHE_SIZE:
+            _workflows.popitem(last=False)
+    return workflow
+
+
+async def run_until_deadline(handler, deadline: deadlines.Deadline):
+    """
+    Awaits a workflow run. The steps stop at the deadline themselves; this only guards against
+    one that overruns it (a request that cannot be interrupted), REQUEST_DEADLINE_GRACE later.
+    """
+    return await asyncio.wait_for(handler, timeout=max(deadline.remaining(), 0) + settings.REQUEST_DEADLINE_GRACE)
+
+
+def forget_workflows(database_id: int) -> None:
+    """Drops the cached workflows of a database, e.g. after its schema was reindexed."""
+    with _workflows_lock:
+        for key in [key for key in _workflows if key[0] == database_id]:
+            del _workflows[key]
+
+
+def text_to_sql_workflow(
+        cnt_str: schemas.DatabaseConnection,
+        tables: List[str],
         have_obj_index: bool,
-        prompt_type: str
-        ) -> schemas.SynthesisResult:
-    engine = create_engine(f"postgresql://{cnt_str.username}:{cnt_str.password}@{cnt_str.host}:{cnt_str.port}/{cnt_str.name}")
-    sql_database = SQLDatabase(engine)
+        prompt_type: str,
+        database_id: int,
+        ) -> TextToSQLWorkflow:
+    """Shared workflow of a complete-mode database (see cached_workflow), built on first use."""
+
+    def build() -> TextToSQLWorkflow:
+        sql_generator = OpenAISQLGenerator(
+            llm=LLMFactory.create_llm("gpt-4o"),
+            prompt_strategy=SchemaSummaryPromptStrategy("postgresql"),
+            database_id=database_id,
+        )
+        obj_retriever = SQLTableRetriever(
+            cnt_str=cnt_str,
+            sql_generator=sql_generator,
+            tables=list(tables),
+            have_obj_index=have_obj_index,
+            database_id=database_id,
+        )
+        return TextToSQLWorkflow(
+            obj_retriever=obj_retriever,
+            sql_generator=sql_generator,
+            sql_database=obj_retriever.sql_database,
+            prompt_type=prompt_type,
+        )
 
-    if prompt_type == "text_to_sql":
-        prompt_strategy=TextToSQLPromptStrategy("postgresql")
-    if prompt_type == "optimize_sql":
-        prompt_strategy=OptimizesSQLQueryPromptStrategy("postgresql")
-    if prompt_type == "explain_sql":
-        prompt_strategy=ExplainSQLQueryPromptStrategy("postgresql")
-    if prompt_type == "fix_sql":
-        prompt_strategy=FixSQLQueryPromptStrategy("postgresql")
+    return cached_workflow(
+        (database_id, prompt_type),
+        (settings.LLM_BACKEND, _target_url(cnt_str), tuple(tables)),
+        build,
+    )
 
-    llm = LLMFactory.create_llm("gpt-4o")
 
-    sql_generator = OpenAISQLGenerator(
-        llm=llm,
-        prompt_strategy=prompt_strategy
-    )
+def simple_workflow(db_name: str, prompt_type: str, database_id: int) -> SimpleTextToSQLWorkflow:
+    """Shared workflow of a minimal-mode database (see cached_workflow), built on first use."""
 
-    obj_retriever = SQLTableRetriever(
-        cnt_str=cnt_str,
-        sql_generator=sql_generator,
-        tables=tables,
-        have_obj_index=have_obj_index
-    )
+    def build() -> SimpleTextToSQLWorkflow:
+        sql_generator = OpenAISQLGenerator(
+            llm=LLMFactory.create_llm("gpt-4o"),
+            prompt_strategy=SchemaSummaryPromptStrategy("postgresql"),
+            database_id=database_id,
+        )
+        schema_retriever = SQLSchemaRetriever(
+            db_name=db_name,
+            sql_generator=sql_generator,
+            database_id=database_id,
+        )
+        return SimpleTextToSQLWorkflow(
+            schema_retriever=schema_retriever,
+            sql_generator=sql_generator,
+            prompt_type=prompt_type
+        )
 
-    sql_run_query = SQLRunQuery(
-        sql_database=sql_database
-    )
+    return cached_workflow((database_id, prompt_type), (settings.LLM_BACKEND, db_name), build)
 
-    txt_tosql_workflow = TextToSQLWorkflow(
-        obj_retriever=obj_retriever,
-        sql_run_query=sql_run_query,
-        sql_generator=sql_generator,
-        sql_database=sql_database,
-        prompt_type=prompt_type
-    )
+
+async def starts_workflow(
+        cnt_str: schemas.DatabaseConnection, 
+        tables: List[str], 
+        user_question: str, 
+        have_obj_index: bool,
+        prompt_type: str,
+        database_id: int,
+        result_cache_ttl: int = None,
+        data_only: bool = False,
+        deadline: deadlines.Deadline = None,
+        ) -> schemas.SynthesisResult:
+
+    txt_tosql_workflow = text_to_sql_workflow(cnt_str, tables, have_obj_index, prompt_type, database_id)
 
     print("txt_tosql_workflow", txt_tosql_workflow)
 
-    response = await txt_tosql_workflow.run(
-        query=user_question,
-        timeout=30
+    # Estado desta execução; o workflow é compartilhado
+    deadline = deadline or deadlines.for_request()
+    sql_run_query = SQLRunQuery(
+        sql_database=txt_tosql_workflow.sql_database,
+        database_id=database_id,
+        cache_ttl=result_cache_ttl,
     )
+    try:
+        response = await run_until_deadline(txt_tosql_workflow.run(
+            query=user_question,
+            sql_run_query=sql_run_query,
+            data_only=data_only,
+            deadline=deadline,
+        ), deadline)
+    except (WorkflowTimeoutError, asyncio.CancelledError, TimeoutError) as e:
+        # O step continua rodando em outra thread; cancela a query no banco do cliente
+        sql_run_query.cancel()
+        if isinstance(e, TimeoutError):
+            return timed_out_result("running the workflow")
+        raise
     return response
 
 async def starts_simple_workflow(
         user_question: str, 
         db_name: str, 
         prompt_type: str, 
+        database_id: int,
+        deadline: deadlines.Deadline = None,
         ) -> schemas.SynthesisResult:
 
-    if prompt_type == "text_to_sql":
-        prompt_strategy=TextToSQLPromptStrategy("postgresql")
-    if prompt_type == "optimize_sql":
-        prompt_strategy=OptimizesSQLQueryPromptStrategy("postgresql")
-    if prompt_type == "explain_sql":
-        prompt_strategy=ExplainSQLQueryPromptStrategy("postgresql")
-    if prompt_type == "fix_sql":
-        prompt_strategy=FixSQLQueryPromptStrategy("postgresql")
-
-    llm = LLMFactory.create_llm("gpt-4o")
-    sql_generator = OpenAISQLGenerator(
-        llm=llm,
-        prompt_strategy=prompt_strategy
-    )
-
-    schema_retriever = SQLSchemaRetriever(
-        db_name=db_name,
-        sql_generator=sql_generator
-    )
-
-    print("schema_retriever", schema_retriever)
-
-    txt_tosql_workflow = SimpleTextToSQLWorkflow(
-        schema_retriever=schema_retriever,
-        sql_generator=sql_generator,
-        prompt_type=prompt_type
-    )
+    txt_tosql_workflow = simple_workflow(db_name, prompt_type, database_id)
 
     print("txt_tosql_workflow", txt_tosql_workflow)
 
-    response = await txt_tosql_workflow.run(
-        query=user_question,
-        timeout=30
-        )
+    deadline = deadline or deadlines.for_request()
+    try:
+        response = await run_until_deadline(txt_tosql_workflow.run(query=user_question, deadline=deadline), deadline)
+    except TimeoutError:
+        return timed_out_result("running the workflow")
 
     print("\n\nResponse: ", response.sql_query)
     print("\n\n")
 
     return response
 
+def synthesize_answer(question: str, sql_query: str, query_rows: schemas.QueryRows, database_id: int = None) -> str:
+    """Response synthesis for results returned earlier in data-only mode."""
+    sql_generator = OpenAISQLGenerator(
+        llm=LLMFactory.create_llm("gpt-4o"),
+        prompt_strategy=PromptStrategyFactory.create_synthesis_strategy(),
+        database_id=database_id,
+    )
+    response_event = sql_generator.generate({
+        "query_str": question,
+        "sql_query": sql_query,
+        "context_str": SQLRunQuery.as_nodes(query_rows),
+    })
+    return response_event.natural_language_response
+
 def generate_postgres_schemas(json_data):
     # Agrupa as colunas por (schema, tabela)    
     tables = {}
+    references = {}
     for entry in json_data:
         schema = entry['schema_name']
         table = entry['table_name']
@@ -876,7 +1543,18 @@ def generate_postgres_schemas(json_data):
         key = (schema, table)
         if key not in tables:
             tables[key] = []
-        tables[key].append(f'    "{column}" {column_type}')
+            references[key] = []
+        definition = f'    "{column}" {column_type}'
+        # Chaves declaradas (opcionais): "primary_key": true e "references": "[schema.]tabela.coluna"
+        if entry.get('primary_key'):
+            definition += ' PRIMARY KEY'
+        if entry.get('references'):
+            ref_schema, ref_table, ref_column = catalog.parse_reference(entry['references'])
+            definition += f' REFERENCES "{ref_schema}"."{ref_table}" ("{ref_column}")'
+            referred = catalog.qualified_name(ref_schema, ref_table)
+            if referred not in references[key]:
+                references[key].append(referred)
+        tables[key].append(definition)
     
     # Gera os comandos SQL para cada tabela e os armazena numa lista
     schemas = []
@@ -885,6 +1563,8 @@ def generate_postgres_schemas(json_data):
         sql += f'CREATE TABLE IF NOT EXISTS "{schema}"."{table}" (\n'
         sql += ",\n".join(columns)
         sql += "\n);"
-        schemas.append({"schema": sql, "table_name": table})
+        schemas.append({
+            "schema": sql, "schema_name": schema, "table_name": table, "references": references[(schema, table)],
+        })
     
     return schemas
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import sqlparse
+from sqlparse.tokens import Keyword
+
+from api.services import sql_tables
+from core import settings
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Comments, letter case of keywords, whitespace and trailing semicolons do not change the
+    result. String literals and quoted identifiers are kept exactly as written.
+    """
+    parts = []
+    for statement in sqlparse.parse(sqlparse.format(sql, strip_comments=True)):
+        for token in statement.flatten():
+            if token.is_whitespace:
+                if parts and parts[-1] != " ":
+                    parts.append(" ")
+            elif token.ttype in Keyword:
+                parts.append(token.value.upper())
+            else:
+                parts.append(token.value)
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def is_cacheable(sql: str) -> bool:
+    """Only single read-only statements are cached."""
+    return sql_tables.is_single_select(sql)
+
+
+class ResultCache:
+    """
+    In-process LRU of executed SQL results keyed by (database id, normalized SQL), with a TTL per
+    entry and a cap on the size of each payload. Safe to share between threads.
+    """
+
+    def __init__(self, max_entries: int, max_payload_bytes: int):
+        self.max_entries = max_entries
+        self.max_payload_bytes = max_payload_bytes
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, database_id: int, sql: str) -> Optional[Any]:
+        key = (database_id, normalize_sql(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, database_id: int, sql: str, value: Any, ttl: float, payload_bytes: int) -> bool:
+        """Stores `value` unless it is larger than the payload cap; evicts the least recently used."""
+        if ttl <= 0 or payload_bytes > self.max_payload_bytes:
+            return False
+        key = (database_id, normalize_sql(sql))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, database_id: Optional[int] = None) -> None:
+        with self._lock:
+            if database_id is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == database_id]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_shared: Optional[ResultCache] = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache() -> ResultCache:
+    """Process-wide cache sized by RESULT_CACHE_MAX_ENTRIES/RESULT_CACHE_MAX_PAYLOAD_BYTES."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ResultCache(settings.RESULT_CACHE_MAX_ENTRIES, settings.RESULT_CACHE_MAX_PAYLOAD_BYTES)
+        return _shared
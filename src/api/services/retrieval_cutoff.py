@@ -0,0 +1,39 @@
+from typing import Callable, List, Optional
+
+from llama_index.core.schema import NodeWithScore
+
+from core import settings
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token: só para limitar o tamanho do prompt, sem tokenizer
+    return max(1, len(text) // 4)
+
+
+def cut(candidates: List[NodeWithScore], prompt_text: Optional[Callable[[NodeWithScore], str]] = None) -> List[NodeWithScore]:
+    """
+    Adaptive top-k over candidates ranked by similarity (RETRIEVAL_MAX_K of them). Keeps the
+    leading candidates while they score at least RETRIEVAL_SCORE_THRESHOLD and within
+    RETRIEVAL_RELATIVE_GAP of the best score (0 disables either cutoff), and while the text
+    each one puts in the prompt (`prompt_text`, the node content by default) fits in
+    RETRIEVAL_TOKEN_BUDGET. The first RETRIEVAL_MIN_K are always kept; candidates without a
+    score are only cut by the budget.
+    """
+    prompt_text = prompt_text or (lambda candidate: candidate.node.get_content())
+    ranked = sorted(candidates, key=lambda candidate: candidate.score or 0.0, reverse=True)[:settings.RETRIEVAL_MAX_K]
+    best = ranked[0].score if ranked and ranked[0].score is not None else None
+    kept: List[NodeWithScore] = []
+    tokens = 0
+    for candidate in ranked:
+        tokens += estimate_tokens(prompt_text(candidate))
+        if len(kept) >= settings.RETRIEVAL_MIN_K:
+            if tokens > settings.RETRIEVAL_TOKEN_BUDGET:
+                break
+            # Sem score (ex.: store sem similaridade) só o orçamento de tokens corta
+            if candidate.score is not None and best is not None:
+                if settings.RETRIEVAL_SCORE_THRESHOLD and candidate.score < settings.RETRIEVAL_SCORE_THRESHOLD:
+                    break
+                if settings.RETRIEVAL_RELATIVE_GAP and candidate.score < best - abs(best) * settings.RETRIEVAL_RELATIVE_GAP:
+                    break
+        kept.append(candidate)
+    return kept
@@ -0,0 +1,108 @@
+from typing import Dict, List, Optional
+
+from django.forms.models import model_to_dict
+from django.utils import timezone
+
+from api import schemas
+from api.models import Database, Table
+from api.services import catalog
+from api.services.rag_service import (
+    LLMFactory,
+    OpenAISQLGenerator,
+    SchemaSummaryPromptStrategy,
+    SQLSchemaRetriever,
+    SQLTableRetriever,
+    forget_target_database,
+    forget_workflows,
+    target_database,
+)
+
+
+def retriever_for(db_obj: Database, password: Optional[str] = None):
+    """Retriever that re-indexes the tables of `db_obj` (complete mode needs the plain password)."""
+    sql_generator = OpenAISQLGenerator(
+        llm=LLMFactory.create_llm("gpt-4o"),
+        prompt_strategy=SchemaSummaryPromptStrategy("postgresql"),
+        database_id=db_obj.id,
+    )
+    if db_obj.type == "complete":
+        database_dict = model_to_dict(db_obj)
+        database_dict["password"] = password
+        return SQLTableRetriever(
+            cnt_str=schemas.DatabaseConnection(**database_dict),
+            sql_generator=sql_generator,
+            tables=[table.name for table in db_obj.table_set.all()],
+            have_obj_index=db_obj.have_obj_index,
+            database_id=db_obj.id,
+        )
+    return SQLSchemaRetriever(db_obj.name, sql_generator, db_obj.id)
+
+
+def live_catalog(db_obj: Database, retriever: SQLTableRetriever) -> Dict[str, schemas.CatalogTable]:
+    """Current catalog of the registered tables of a complete database."""
+    names = [table.name for table in db_obj.table_set.all()]
+    if not names:
+        return {}
+    tables = catalog.introspect(retriever.sql_database.engine, include=names)
+    return {name: tables[name] for name in names if name in tables}
+
+
+def compare(tables: List[Table], catalog_tables: Dict[str, schemas.CatalogTable]) -> Dict[str, List[str]]:
+    """
+    Splits registered tables into changed, unchanged, unknown (registered before
+    signatures existed) and missing (no longer in the catalog).
+    """
+    report = {"changed": [], "unchanged": [], "unknown": [], "missing": []}
+    for table in tables:
+        live = catalog_tables.get(table.name)
+        if live is None:
+            report["missing"].append(table.name)
+        elif table.signature is None:
+            report["unknown"].append(table.name)
+        elif table.signature != catalog.signature(live):
+            report["changed"].append(table.name)
+        else:
+            report["unchanged"].append(table.name)
+    return report
+
+
+def refresh(
+    db_obj: Database,
+    retriever,
+    catalog_tables: Dict[str, schemas.CatalogTable],
+    reindex_unknown: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, List[str]]:
+    """
+    Re-summarizes and re-embeds only the tables whose schema changed, then records their new
+    signatures. Unknown tables just get a baseline signature unless `reindex_unknown`.
+    Missing tables are reported and left indexed. A table's old nodes are deleted (by id)
+    only after its new ones are inserted, so if re-indexing fails halfway the remaining
+    tables keep their previous nodes and old signatures, and the next run picks them up.
+    """
+    tables = list(db_obj.table_set.all())
+    report = compare(tables, catalog_tables)
+    report["reindexed"] = []
+    if dry_run:
+        return report
+
+    stale = report["changed"] + (report["unknown"] if reindex_unknown else [])
+    if stale and isinstance(retriever, SQLTableRetriever):
+        # As tabelas refletidas em cache estão desatualizadas
+        forget_target_database(retriever.cnt_str)
+        retriever.sql_database = target_database(retriever.cnt_str)
+    if stale:
+        forget_workflows(db_obj.id)
+    old_nodes = retriever.node_ids(stale) if stale else {}
+    for names in retriever.add_table_schemas([catalog_tables[name] for name in stale]):
+        retriever.delete_nodes([node_id for name in names for node_id in old_nodes.get(name, [])])
+        report["reindexed"] += names
+
+    now = timezone.now()
+    for table in tables:
+        live = catalog_tables.get(table.name)
+        if live is not None and (table.name in report["reindexed"] or table.signature is None):
+            table.signature = catalog.signature(live)
+        table.signature_checked_at = now
+    Table.objects.bulk_update(tables, ["signature", "signature_checked_at"])
+    return report
@@ -0,0 +1,119 @@
+import logging
+from typing import List
+
+import sqlparse
+from sqlparse.sql import Function, Identifier, IdentifierList, Parenthesis
+from sqlparse.tokens import CTE, DDL, DML, Keyword
+
+logger = logging.getLogger(__name__)
+
+
+# Palavras-chave depois das quais vem um nome de tabela
+TABLE_KEYWORDS = ("FROM", "INTO", "UPDATE", "TABLE", "USING")
+
+
+def referenced_tables(sql: str) -> List[str]:
+    """
+    Tables a statement reads or writes, in order of appearance and without CTE names.
+    Unquoted names are lowercased (as Postgres folds them); tables of the public schema
+    are returned bare, others as "schema.table", like the catalog keys.
+    """
+    found, ctes = _references(sql)
+    return [name for name in found if name not in ctes]
+
+
+def is_single_select(sql: str) -> bool:
+    """
+    Whether `sql` is exactly one read-only SELECT (WITH included). Statements that write
+    anywhere, such as a data-modifying CTE or SELECT ... INTO, are not.
+    """
+    try:
+        statements = [s for s in sqlparse.parse(sql) if s.token_first(skip_cm=True) is not None]
+    except Exception:
+        logger.exception("Could not parse SQL: %s", sql)
+        return False
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        return False
+    for token in statements[0].flatten():
+        if token.ttype in DDL or (token.ttype in DML and token.normalized != "SELECT"):
+            return False
+        if token.ttype in Keyword and token.normalized == "INTO":
+            return False
+    return True
+
+
+def cte_names(sql: str) -> List[str]:
+    """Names the statement defines with WITH."""
+    return sorted(_references(sql)[1])
+
+
+def _references(sql: str):
+    found: List[str] = []
+    ctes: set = set()
+    try:
+        for statement in sqlparse.parse(sql):
+            _walk(statement.tokens, found, ctes)
+    except Exception:
+        logger.exception("Could not parse SQL: %s", sql)
+        return [], set()
+    return found, ctes
+
+
+def _walk(tokens, found: List[str], ctes: set) -> None:
+    expect = None
+    for token in tokens:
+        if token.is_whitespace or token.ttype in sqlparse.tokens.Comment:
+            continue
+        if token.ttype in CTE:
+            expect = "cte"
+            continue
+        if token.ttype in Keyword or token.ttype in DML:
+            normalized = token.normalized
+            if normalized in TABLE_KEYWORDS or normalized.endswith("JOIN"):
+                expect = "table"
+            elif expect == "cte" and normalized in ("RECURSIVE", "AS"):
+                continue
+            elif token.ttype not in DML:
+                expect = None
+            continue
+
+        if expect is not None and isinstance(token, (Identifier, IdentifierList)):
+            identifiers = token.get_identifiers() if isinstance(token, IdentifierList) else [token]
+            for identifier in identifiers:
+                if not isinstance(identifier, Identifier):
+                    continue
+                subquery = next((t for t in identifier.tokens if isinstance(t, Parenthesis)), None)
+                if expect == "cte":
+                    ctes.add(_fold(identifier.get_name(), identifier))
+                elif subquery is None:
+                    _add(identifier, found)
+                if subquery is not None:
+                    _walk(subquery.tokens, found, ctes)
+            expect = None
+            continue
+
+        if expect == "table" and isinstance(token, Function):
+            # INSERT INTO tabela (colunas) é lido como chamada de função
+            _add(token, found)
+        elif isinstance(token, Function) and not any(t.ttype in DML for t in token.flatten()):
+            # FROM dentro de EXTRACT(... FROM coluna) ou SUBSTRING não é tabela
+            pass
+        elif token.is_group:
+            _walk(token.tokens, found, ctes)
+        expect = None
+
+
+def _fold(name: str, identifier: Identifier) -> str:
+    return name if f'"{name}"' in identifier.value else name.lower()
+
+
+def _add(identifier: Identifier, found: List[str]) -> None:
+    name = identifier.get_real_name()
+    if not name:
+        return
+    name = _fold(name, identifier)
+    schema = identifier.get_parent_name()
+    if schema and _fold(schema, identifier) != "public":
+        name = f"{_fold(schema, identifier)}.{name}"
+    if name not in found:
+        found.append(name)
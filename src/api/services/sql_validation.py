@@ -0,0 +1,114 @@
+import logging
+from typing import Dict, List, Optional, Set
+
+import sqlparse
+from sqlparse.sql import Identifier, Parenthesis
+from sqlparse.tokens import DML, Keyword, Name, Punctuation, String
+
+from api.services import sql_tables
+
+logger = logging.getLogger(__name__)
+
+
+def catalog_columns(sql_database, registered_tables: List[str]) -> Dict[str, Optional[Set[str]]]:
+    """
+    {table: column names} from the metadata SQLDatabase reflected once for the cached target
+    database, so validating needs no round trip. Registered tables that were not reflected
+    (other schemas) map to None: they exist, but their columns are not checked.
+    """
+    columns: Dict[str, Optional[Set[str]]] = {
+        key: {column.name for column in table.columns}
+        for key, table in sql_database.metadata_obj.tables.items()
+    }
+    for name in registered_tables:
+        columns.setdefault(name, None)
+    return columns
+
+
+def validate(sql: str, columns: Dict[str, Optional[Set[str]]]) -> List[str]:
+    """
+    Errors (Postgres-like messages) for tables and columns of `sql` missing from `columns`.
+    Conservative: names it cannot resolve (subquery/CTE columns, output aliases) are not
+    reported, so an empty list does not guarantee the query runs.
+    """
+    try:
+        statements = [statement for statement in sqlparse.parse(sql) if statement.value.strip()]
+        tables = sql_tables.referenced_tables(sql)
+        ctes = set(sql_tables.cte_names(sql))
+    except Exception:
+        logger.exception("Could not validate SQL, treating it as valid: %s", sql)
+        return []
+
+    errors = [f'relation "{table}" does not exist' for table in tables if table not in columns]
+    aliases: Dict[str, Optional[str]] = {cte: None for cte in ctes}
+    defined: Set[str] = set()
+    for statement in statements:
+        _collect_aliases(statement.tokens, tables, aliases, defined)
+
+    known = [columns.get(table) for table in tables if table in columns]
+    # Com subquery/CTE ou tabela sem colunas conhecidas, nomes sem qualificador podem vir de lá
+    check_unqualified = all(cols is not None for cols in known) and not any(
+        source is None for source in aliases.values()
+    )
+    visible = set().union(*[cols for cols in known if cols is not None])
+    reserved = defined | set(aliases) | {part for table in tables for part in table.split(".")}
+
+    for statement in statements:
+        tokens = [t for t in statement.flatten() if not t.is_whitespace and t.ttype not in sqlparse.tokens.Comment]
+        for position, token in enumerate(tokens):
+            if token.ttype is not Name and token.ttype not in String.Symbol:
+                continue
+            before = tokens[position - 1] if position > 0 else None
+            after = tokens[position + 1] if position + 1 < len(tokens) else None
+            if after is not None and after.ttype is Punctuation and after.value in (".", "("):
+                continue
+            if before is not None and before.ttype is Punctuation and before.value == "::":
+                continue
+            name = _fold(token.value)
+
+            if before is not None and before.ttype is Punctuation and before.value == "." and position >= 2:
+                qualifier = _fold(tokens[position - 2].value)
+                if position >= 4 and tokens[position - 3].value == ".":
+                    qualifier = f"{_fold(tokens[position - 4].value)}.{qualifier}"
+                table = aliases.get(qualifier, qualifier if qualifier in tables else None)
+                table_columns = columns.get(table) if table else None
+                if table_columns is not None and name not in table_columns:
+                    errors.append(f'column {qualifier}.{name} does not exist')
+                continue
+
+            if before is not None and before.ttype in Keyword and before.normalized == "AS":
+                continue
+            if check_unqualified and name not in reserved and name not in visible:
+                errors.append(f'column "{name}" does not exist')
+    return list(dict.fromkeys(errors))
+
+
+def _fold(name: str) -> str:
+    # Sem aspas o Postgres usa minúsculas; com aspas, o nome exato
+    return name[1:-1] if name.startswith('"') and name.endswith('"') else name.lower()
+
+
+def _is_subquery(parenthesis: Parenthesis) -> bool:
+    return any(t.ttype in DML and t.normalized == "SELECT" for t in parenthesis.flatten())
+
+
+def _collect_aliases(tokens, tables: List[str], aliases: Dict[str, Optional[str]], defined: Set[str]) -> None:
+    """Table aliases (alias -> table, None for subqueries) and output column aliases."""
+    for token in tokens:
+        if isinstance(token, Identifier):
+            alias = token.get_alias()
+            if alias:
+                alias = _fold(alias)
+                real = token.get_real_name()
+                parent = token.get_parent_name()
+                table = None
+                if real:
+                    table = _fold(real) if not parent or _fold(parent) == "public" else f"{_fold(parent)}.{_fold(real)}"
+                if any(isinstance(t, Parenthesis) and _is_subquery(t) for t in token.tokens):
+                    aliases[alias] = None
+                elif table in tables:
+                    aliases[alias] = table
+                else:
+                    defined.add(alias)
+        if token.is_group:
+            _collect_aliases(token.tokens, tables, aliases, defined)
@@ -0,0 +1,394 @@
+import logging
+import threading
+from typing import List, Optional
+
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
+from llama_index.vector_stores.postgres import PGVectorStore
+from sqlalchemy import URL, create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from core import settings
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("hnsw", "ivfflat", "none")
+
+# O PGVectorStore consulta com cosine_distance, então o índice precisa da mesma classe de operadores
+DISTANCE_OPS = "vector_cosine_ops"
+
+# Todos os nós ficam numa tabela só; o id do api.Database separa os tenants
+TENANT_KEY = "database_id"
+# Nós de coluna (tabelas largas) levam NODE_TYPE_KEY = COLUMN_NODE; os nós de tabela não têm a chave
+NODE_TYPE_KEY = "node_type"
+COLUMN_NODE = "column"
+EMBED_DIM = 1536
+
+
+def index_type() -> str:
+    if settings.VECTOR_INDEX_TYPE not in INDEX_TYPES:
+        raise ValueError(f"Unknown VECTOR_INDEX_TYPE: {settings.VECTOR_INDEX_TYPE}")
+    return settings.VECTOR_INDEX_TYPE
+
+
+def vector_table_name(table_name: str) -> str:
+    """Physical table created by PGVectorStore for a given `table_name`."""
+    return f"data_{table_name.lower()}"
+
+
+def index_name(table: str) -> str:
+    """Same name PGVectorStore uses for its HNSW index, so both paths manage the same index."""
+    return f"{table}_embedding_idx"
+
+
+def hnsw_kwargs() -> Optional[dict]:
+    """`hnsw_kwargs` for PGVectorStore.from_params (a new dict every call: the store pops from it)."""
+    if index_type() != "hnsw":
+        return None
+    return {
+        "hnsw_m": settings.VECTOR_INDEX_HNSW_M,
+        "hnsw_ef_construction": settings.VECTOR_INDEX_HNSW_EF_CONSTRUCTION,
+        "hnsw_ef_search": settings.VECTOR_INDEX_HNSW_EF_SEARCH,
+        "hnsw_dist_method": DISTANCE_OPS,
+    }
+
+
+def query_kwargs() -> dict:
+    """
+    Query-time `vector_store_kwargs` (hnsw.ef_search / ivfflat.probes) for as_retriever. Without
+    iterative scans (pgvector < 0.8) the tenant filter runs after the ANN scan, so the scan is
+    widened: VECTOR_INDEX_FALLBACK_EF_SEARCH for HNSW, every list (an exact scan) for IVFFlat.
+    """
+    kind = index_type()
+    widen = settings.VECTOR_INDEX_ITERATIVE_SCAN and _iterative_scan_supported is False
+    if kind == "hnsw":
+        ef_search = settings.VECTOR_INDEX_HNSW_EF_SEARCH
+        return {"hnsw_ef_search": max(ef_search, settings.VECTOR_INDEX_FALLBACK_EF_SEARCH) if widen else ef_search}
+    if kind == "ivfflat":
+        return {"ivfflat_probes": settings.VECTOR_INDEX_IVFFLAT_LISTS if widen else settings.VECTOR_INDEX_IVFFLAT_PROBES}
+    return {}
+
+
+def index_options(kind: str) -> dict:
+    if kind == "hnsw":
+        return {"m": settings.VECTOR_INDEX_HNSW_M, "ef_construction": settings.VECTOR_INDEX_HNSW_EF_CONSTRUCTION}
+    if kind == "ivfflat":
+        return {"lists": settings.VECTOR_INDEX_IVFFLAT_LISTS}
+    return {}
+
+
+def store_table() -> str:
+    """Physical name of the consolidated vector table."""
+    return vector_table_name(settings.VECTOR_TABLE_NAME)
+
+
+def tenant_filters(database_id: int, **metadata) -> MetadataFilters:
+    """
+    Filters restricting a query/delete to the nodes of one registered database.
+    A list value matches any of its items.
+    """
+    filters = [MetadataFilter(key=TENANT_KEY, value=int(database_id))]
+    for key, value in metadata.items():
+        # O PGVectorStore interpola valores de texto direto no SQL
+        if isinstance(value, (list, tuple)):
+            filters.append(MetadataFilter(
+                key=key, value=[str(v).replace("'", "''") for v in value], operator=FilterOperator.IN
+            ))
+        else:
+            filters.append(MetadataFilter(key=key, value=str(value).replace("'", "''")))
+    return MetadataFilters(filters=filters)
+
+
+def table_filters(database_id: int, **metadata) -> MetadataFilters:
+    """tenant_filters without the column nodes of wide tables (nodes with a NODE_TYPE_KEY)."""
+    filters = tenant_filters(database_id, **metadata)
+    filters.filters.append(MetadataFilter(key=NODE_TYPE_KEY, value=None, operator=FilterOperator.IS_EMPTY))
+    return filters
+
+
+def _url(drivername: str):
+    return URL.create(
+        drivername,
+        username=settings.env("DB_USER"),
+        password=settings.env("DB_PASSWORD"),
+        host=settings.env("DB_HOST"),
+        port=int(settings.env("DB_PORT")),
+        database=settings.env("DB_NAME"),
+    )
+
+
+def _iterative_scan() -> Optional[tuple]:
+    kind = index_type()
+    if kind == "none" or not settings.VECTOR_INDEX_ITERATIVE_SCAN:
+        return None
+    return f"{kind}.iterative_scan", settings.VECTOR_INDEX_ITERATIVE_SCAN
+
+
+def pgvector_version(engine) -> Optional[tuple]:
+    """Installed version of the vector extension, e.g. (0, 8, 0); None when it is not installed."""
+    with engine.connect() as conn:
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    if version is None:
+        return None
+    return tuple(int(part) for part in version.split(".") if part.isdigit())
+
+
+def _supports_iterative_scan() -> bool:
+    # Conexão avulsa: com a versão antiga, o GUC desconhecido em "options" derrubaria a conexão
+    probe = create_engine(_url("postgresql+psycopg2"), poolclass=NullPool)
+    try:
+        version = pgvector_version(probe)
+    finally:
+        probe.dispose()
+    # Sem a extensão ainda (banco novo), o PGVectorStore instala a versão da imagem
+    return version is None or version >= (0, 8)
+
+
+_engines = {}
+# None até o primeiro store_engines(); False quando o pgvector instalado é < 0.8
+_iterative_scan_supported: Optional[bool] = None
+_prepared_tables = set()
+_engines_lock = threading.Lock()
+
+
+def store_engines():
+    """
+    (engine, async_engine) shared by every PGVectorStore of the process, so requests reuse
+    pooled connections. With a tenant filter the ANN index may stop before finding k rows
+    of that tenant; iterative scans (pgvector >= 0.8) keep scanning until it does. Older
+    versions get wider scans instead (see query_kwargs).
+    """
+    global _iterative_scan_supported
+    with _engines_lock:
+        if not _engines:
+            sync_args, async_args = {}, {}
+            scan = _iterative_scan()
+            if scan:
+                _iterative_scan_supported = _supports_iterative_scan()
+                if not _iterative_scan_supported:
+                    logger.warning(
+                        "pgvector < 0.8 has no %s; widening filtered ANN scans instead", scan[0]
+                    )
+                    scan = None
+            if scan:
+                sync_args = {"options": f"-c {scan[0]}={scan[1]}"}
+                async_args = {"server_settings": {scan[0]: scan[1]}}
+            _engines["sync"] = create_engine(_url("postgresql+psycopg2"), pool_pre_ping=True, connect_args=sync_args)
+            _engines["async"] = create_async_engine(_url("postgresql+asyncpg"), connect_args=async_args)
+        # A tabela particionada precisa existir antes do PGVectorStore criar a sua versão simples
+        if settings.VECTOR_TABLE_PARTITIONS and store_table() not in _prepared_tables:
+            create_partitioned_table(_engines["sync"], store_table(), settings.VECTOR_TABLE_PARTITIONS)
+            _prepared_tables.add(store_table())
+        return _engines["sync"], _engines["async"]
+
+
+def store() -> PGVectorStore:
+    """PGVectorStore over the consolidated table, indexed by tenant."""
+    engine, async_engine = store_engines()
+    return PGVectorStore(
+        connection_string=engine.url.render_as_string(hide_password=False),
+        async_connection_string=async_engine.url.render_as_string(hide_password=False),
+        table_name=settings.VECTOR_TABLE_NAME,
+        schema_name="public",
+        embed_dim=EMBED_DIM,
+        use_jsonb=True,
+        hnsw_kwargs=hnsw_kwargs(),
+        # "float" porque o filtro numérico do PGVectorStore é (metadata_->>'key')::float
+        indexed_metadata_keys={(TENANT_KEY, "float")},
+        engine=engine,
+        async_engine=async_engine,
+    )
+
+
+def partitioned_table_sql(table: str, partitions: int) -> List[str]:
+    """
+    DDL of the consolidated table HASH-partitioned by tenant. Same columns and indexes
+    PGVectorStore creates, minus the primary key (it would have to include the partition key).
+    """
+    tenant = f"((metadata_->>'{TENANT_KEY}')::float)"
+    statements = [
+        f'CREATE TABLE IF NOT EXISTS "{table}" (id BIGSERIAL NOT NULL, text VARCHAR NOT NULL, '
+        f"metadata_ JSONB, node_id VARCHAR, embedding VECTOR({EMBED_DIM})) PARTITION BY HASH ({tenant})",
+    ]
+    statements += [
+        f'CREATE TABLE IF NOT EXISTS "{table}_p{i}" PARTITION OF "{table}" '
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+        for i in range(partitions)
+    ]
+    statements += [
+        f'CREATE INDEX IF NOT EXISTS "{table}_idx_{TENANT_KEY}_float" ON "{table}" ({tenant})',
+        f'CREATE INDEX IF NOT EXISTS "{table}_idx_1" ON "{table}" ((metadata_->>\'ref_doc_id\'))',
+    ]
+    return statements
+
+
+def create_partitioned_table(engine, table: str, partitions: int) -> bool:
+    """Creates the partitioned table if there is no table with that name yet."""
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass(:table)"), {"table": f'public."{table}"'}).scalar():
+            return False
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        for statement in partitioned_table_sql(table, partitions):
+            conn.execute(text(statement))
+    return True
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return bool(conn.execute(text(
+        "SELECT c.relkind = 'p' FROM pg_class c WHERE c.oid = to_regclass(:table)"
+    ), {"table": f'public."{table}"'}).scalar())
+
+
+def _partitions(conn, table: str) -> List[str]:
+    return [row[0] for row in conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    ), {"table": f'public."{table}"'})]
+
+
+def create_index_sql(table: str, kind: str, name: Optional[str] = None, concurrently: bool = True,
+                     only: bool = False) -> str:
+    options = ", ".join(f"{key} = {value}" for key, value in index_options(kind).items())
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS \"{name or index_name(table)}\" "
+        f"ON {'ONLY ' if only else ''}\"{table}\" USING {kind} (embedding {DISTANCE_OPS}) WITH ({options})"
+    )
+
+
+def list_vector_tables(engine) -> List[str]:
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text(
+            "SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition "
+            "AND c.relname LIKE 'data\\_%' "
+            "AND EXISTS (SELECT 1 FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attname = 'embedding') "
+            "ORDER BY c.relname"
+        ))]
+
+
+def inspect_indexes(engine, tables: Optional[List[str]] = None) -> List[dict]:
+    """Size, estimated rows and ANN index (method, options, size, validity) of each vector table."""
+    rows = []
+    with engine.connect() as conn:
+        for table in tables or list_vector_tables(engine):
+            info = conn.execute(text(
+                "SELECT c.reltuples::bigint, pg_total_relation_size(c.oid), i.relname, am.amname, "
+                "i.reloptions, pg_relation_size(i.oid), x.indisvalid "
+                "FROM pg_class c "
+                "LEFT JOIN pg_index x ON x.indrelid = c.oid AND EXISTS ("
+                "  SELECT 1 FROM pg_class ic JOIN pg_am iam ON iam.oid = ic.relam "
+                "  WHERE ic.oid = x.indexrelid AND iam.amname IN ('hnsw', 'ivfflat')) "
+                "LEFT JOIN pg_class i ON i.oid = x.indexrelid "
+                "LEFT JOIN pg_am am ON am.oid = i.relam "
+                "WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace"
+            ), {"table": table}).all()
+            for estimated_rows, table_bytes, name, method, options, index_bytes, valid in info:
+                rows.append({
+                    "table": table,
+                    "rows": max(estimated_rows, 0),
+                    "table_bytes": table_bytes,
+                    "index": name,
+                    "method": method,
+                    "options": options or [],
+                    "index_bytes": index_bytes,
+                    "valid": valid,
+                })
+    return rows
+
+
+def _autocommit(engine, maintenance_work_mem: Optional[str] = None):
+    # CREATE/REINDEX/DROP INDEX CONCURRENTLY não podem rodar dentro de uma transação
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    if maintenance_work_mem:
+        conn.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"), {"value": maintenance_work_mem})
+    return conn
+
+
+def _current_index(conn, table: str) -> Optional[dict]:
+    row = conn.execute(text(
+        "SELECT i.relname, am.amname, i.reloptions, x.indisvalid FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_am am ON am.oid = i.relam "
+        "WHERE x.indrelid = CAST(:table AS regclass) AND am.amname IN ('hnsw', 'ivfflat')"
+    ), {"table": f'"{table}"'}).first()
+    if row is None:
+        return None
+    return {"name": row[0], "method": row[1], "options": set(row[2] or []), "valid": row[3]}
+
+
+def _matches_config(index: dict, kind: str) -> bool:
+    expected = {f"{key}={value}" for key, value in index_options(kind).items()}
+    return index["method"] == kind and index["options"] == expected and index["valid"]
+
+
+def _create_index(conn, table: str, kind: str, name: Optional[str] = None) -> None:
+    if not is_partitioned(conn, table):
+        conn.execute(text(create_index_sql(table, kind, name=name)))
+        return
+    # Índice em tabela particionada não aceita CONCURRENTLY: cria o pai vazio (ON ONLY),
+    # constrói cada partição online e anexa
+    parent = name or index_name(table)
+    conn.execute(text(create_index_sql(table, kind, name=parent, concurrently=False, only=True)))
+    for partition in _partitions(conn, table):
+        conn.execute(text(create_index_sql(partition, kind)))
+        conn.execute(text(f'ALTER INDEX "{parent}" ATTACH PARTITION "{index_name(partition)}"'))
+
+
+def _drop_index(conn, table: str, name: str) -> None:
+    concurrently = "" if is_partitioned(conn, table) else "CONCURRENTLY "
+    conn.execute(text(f'DROP INDEX {concurrently}IF EXISTS "{name}"'))
+
+
+def build_index(engine, table: str, maintenance_work_mem: Optional[str] = None) -> str:
+    """Creates the configured ANN index online, if the table has none yet."""
+    kind = index_type()
+    if kind == "none":
+        return "skipped (VECTOR_INDEX_TYPE=none)"
+    with _autocommit(engine, maintenance_work_mem) as conn:
+        current = _current_index(conn, table)
+        if current is not None:
+            return f"exists ({current['name']})"
+        _create_index(conn, table, kind)
+    return "built"
+
+
+def rebuild_index(engine, table: str, maintenance_work_mem: Optional[str] = None) -> str:
+    """
+    Rebuilds the ANN index without blocking writes. An index that already matches the
+    configuration is REINDEXed; otherwise a new one is built next to it and swapped in.
+    Partitioned tables cannot swap indexes online, so a changed configuration drops the
+    old index first and retrieval falls back to sequential scans until the build ends.
+    """
+    kind = index_type()
+    with _autocommit(engine, maintenance_work_mem) as conn:
+        current = _current_index(conn, table)
+        if kind == "none":
+            if current is not None:
+                _drop_index(conn, table, current["name"])
+                return "dropped"
+            return "skipped (VECTOR_INDEX_TYPE=none)"
+        if current is None:
+            _create_index(conn, table, kind)
+            return "built"
+        if _matches_config(current, kind):
+            conn.execute(text(f'REINDEX INDEX CONCURRENTLY "{current["name"]}"'))
+            return "reindexed"
+        if is_partitioned(conn, table):
+            _drop_index(conn, table, current["name"])
+            _create_index(conn, table, kind)
+            return f"replaced ({current['method']} -> {kind})"
+        new_name = f"{index_name(table)}_new"
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{new_name}"'))
+        conn.execute(text(create_index_sql(table, kind, name=new_name)))
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{current["name"]}"'))
+        conn.execute(text(f'ALTER INDEX "{new_name}" RENAME TO "{index_name(table)}"'))
+    return f"replaced ({current['method']} -> {kind})"
+
+
+def drop_index(engine, table: str) -> str:
+    with _autocommit(engine) as conn:
+        current = _current_index(conn, table)
+        if current is None:
+            return "absent"
+        _drop_index(conn, table, current["name"])
+    return "dropped"
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from .models import Database
 
 
@@ -14,3 +14,1088 @@ class DatabaseModelTest(TestCase):
 
         # Verificar se foi salvo corretamente
         self.assertTrue(db.check_password("pass"))
+
+
+class BenchmarkingTest(SimpleTestCase):
+    def test_percentiles(self):
+        from api.services.benchmarking import percentile, summarize_latencies
+
+        values = [float(v) for v in range(1, 101)]
+        self.assertAlmostEqual(percentile(values, 50), 50.5)
+        self.assertAlmostEqual(percentile(values, 99), 99.01)
+        summary = summarize_latencies(values)
+        self.assertEqual(summary["count"], 100)
+        self.assertEqual(summary["max"], 100.0)
+        self.assertEqual(summarize_latencies([])["p95"], 0.0)
+
+    def test_stub_llm_is_deterministic_and_schema_valid(self):
+        from api import schemas
+        from api.services.llm_stub import StubOpenAI
+
+        client = StubOpenAI()
+        messages = [{"role": "user", "content": "Table 'orders' has columns: id (INTEGER)"}]
+        first = client.chat.completions.create(model="m", messages=messages, function_call={"name": "text_to_sql"})
+        second = client.chat.completions.create(model="m", messages=messages, function_call={"name": "text_to_sql"})
+        arguments = first.choices[0].message.function_call.arguments
+        self.assertEqual(arguments, second.choices[0].message.function_call.arguments)
+        result = schemas.TextToSQLEvent.model_validate_json(arguments)
+        self.assertEqual(result.sql_query, 'SELECT * FROM "orders" LIMIT 10')
+
+    def test_stub_fault_injection(self):
+        from openai import InternalServerError
+        from api.services.llm_stub import FaultInjector, StubOpenAI
+
+        client = StubOpenAI(faults=FaultInjector(error_rate=1.0))
+        with self.assertRaises(InternalServerError):
+            client.embeddings.create(input=["orders"])
+
+    def test_synthetic_catalog_matches_schema_json_shape(self):
+        from api.services.benchmarking import generate_synthetic_catalog
+        from api.services.rag_service import generate_postgres_schemas
+
+        rows, questions = generate_synthetic_catalog(50, columns_per_table=6, seed=1)
+        self.assertEqual(len(questions), 50)
+        self.assertEqual(len(rows), 50 * 6)
+        tables = generate_postgres_schemas(rows)
+        self.assertEqual({t["table_name"] for t in tables}, set(questions))
+        self.assertEqual(generate_synthetic_catalog(50, 6, seed=1), (rows, questions))
+
+
+class VectorIndexTest(SimpleTestCase):
+    def test_index_settings(self):
+        from unittest import mock
+        from api.services import vector_index
+        from core import settings
+
+        with mock.patch.object(settings, "VECTOR_INDEX_TYPE", "ivfflat"):
+            self.assertIsNone(vector_index.hnsw_kwargs())
+            self.assertEqual(vector_index.query_kwargs(), {"ivfflat_probes": settings.VECTOR_INDEX_IVFFLAT_PROBES})
+            self.assertIn("CONCURRENTLY", vector_index.create_index_sql("data_sales", "ivfflat"))
+        with mock.patch.object(settings, "VECTOR_INDEX_TYPE", "hnsw"):
+            kwargs = vector_index.hnsw_kwargs()
+            kwargs.pop("hnsw_m")
+            self.assertIn("hnsw_m", vector_index.hnsw_kwargs())
+        with mock.patch.object(settings, "VECTOR_INDEX_TYPE", "flat"):
+            with self.assertRaises(ValueError):
+                vector_index.query_kwargs()
+
+    def test_old_pgvector_widens_scans_instead_of_iterative_scan(self):
+        from unittest import mock
+        from api.services import vector_index
+        from core import settings
+
+        with mock.patch.multiple(vector_index, _engines={}, _prepared_tables=set(), _iterative_scan_supported=None), \
+                mock.patch.object(settings, "VECTOR_INDEX_TYPE", "hnsw"), \
+                mock.patch.object(settings, "VECTOR_TABLE_PARTITIONS", 0), \
+                mock.patch.object(vector_index, "_url", return_value="postgresql+psycopg2://u@h/db"), \
+                mock.patch.object(vector_index, "pgvector_version", return_value=(0, 5, 1)), \
+                mock.patch.object(vector_index, "create_engine") as create_engine, \
+                mock.patch.object(vector_index, "create_async_engine") as create_async_engine:
+            vector_index.store_engines()
+            self.assertEqual(create_engine.call_args.kwargs["connect_args"], {})
+            self.assertEqual(create_async_engine.call_args.kwargs["connect_args"], {})
+            self.assertEqual(vector_index.query_kwargs(), {"hnsw_ef_search": settings.VECTOR_INDEX_FALLBACK_EF_SEARCH})
+
+            vector_index._engines.clear()
+            vector_index.pgvector_version.return_value = (0, 8, 0)
+            vector_index.store_engines()
+            self.assertIn("hnsw.iterative_scan", create_engine.call_args.kwargs["connect_args"]["options"])
+            self.assertEqual(vector_index.query_kwargs(), {"hnsw_ef_search": settings.VECTOR_INDEX_HNSW_EF_SEARCH})
+
+    def test_tenant_filters_and_partitioned_table(self):
+        from api.services import vector_index
+
+        filters = vector_index.tenant_filters(7, table_name="o'rders").filters
+        self.assertEqual((filters[0].key, filters[0].value), ("database_id", 7))
+        self.assertEqual(filters[1].value, "o''rders")
+        statements = vector_index.partitioned_table_sql("data_schema_nodes", 4)
+        self.assertIn("PARTITION BY HASH (((metadata_->>'database_id')::float))", statements[0])
+        self.assertEqual(sum("PARTITION OF" in s for s in statements), 4)
+
+
+class CatalogTest(SimpleTestCase):
+    def test_table_info_matches_sql_database_format(self):
+        from api import schemas
+        from api.services import catalog
+
+        table = schemas.CatalogTable(
+            schema_name="public",
+            table_name="orders",
+            columns=[schemas.CatalogColumn(name="id", type="integer"),
+                     schemas.CatalogColumn(name="customer_id", type="integer", comment="buyer")],
+            foreign_keys=[schemas.CatalogForeignKey(columns=["customer_id"], referred_schema="public",
+                                                    referred_table="customers", referred_columns=["id"])],
+        )
+        self.assertEqual(
+            catalog.table_info(table),
+            "Table 'orders' has columns: id (integer), customer_id (integer): 'buyer',  "
+            "and foreign keys: ['customer_id'] -> customers.['id'].",
+        )
+        self.assertEqual(catalog.qualified_name("sales", "orders"), "sales.orders")
+
+
+class SchemaDriftTest(TestCase):
+    def test_only_changed_tables_are_reindexed(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from api.models import Table
+        from api.services import catalog, schema_drift
+
+        rows = [
+            {"schema_name": "public", "table_name": "orders", "column_name": "id", "column_type": "integer"},
+            {"schema_name": "public", "table_name": "customers", "column_name": "id", "column_type": "integer"},
+        ]
+        live = catalog.from_schema_rows(rows)
+        db = Database.objects.create(user=User.objects.create(username="drift"), name="shop", type="minimal")
+        Table.objects.create(database=db, name="orders", signature=catalog.signature(live["orders"]))
+        Table.objects.create(database=db, name="customers", signature=catalog.signature(live["customers"]))
+        Table.objects.create(database=db, name="legacy")
+
+        rows.append({"schema_name": "public", "table_name": "orders", "column_name": "total", "column_type": "numeric"})
+        rows.append({"schema_name": "public", "table_name": "legacy", "column_name": "id", "column_type": "integer"})
+        live = catalog.from_schema_rows(rows)
+        retriever = mock.Mock()
+        retriever.node_ids.return_value = {"orders": ["old-orders"]}
+        retriever.add_table_schemas.side_effect = lambda tables: iter([[t.table_name for t in tables]])
+
+        report = schema_drift.refresh(db, retriever, live)
+        self.assertEqual(report["changed"], ["orders"])
+        self.assertEqual(report["unknown"], ["legacy"])
+        self.assertEqual(report["reindexed"], ["orders"])
+        # Os nós antigos saem por id, depois que o lote novo foi inserido
+        self.assertEqual(
+            [name for name, *_ in retriever.method_calls if name in ("add_table_schemas", "delete_nodes")],
+            ["add_table_schemas", "delete_nodes"],
+        )
+        retriever.delete_nodes.assert_called_once_with(["old-orders"])
+        retriever.delete_table_schema.assert_not_called()
+        self.assertEqual(Table.objects.get(name="orders").signature, catalog.signature(live["orders"]))
+        self.assertIsNotNone(Table.objects.get(name="legacy").signature)
+        self.assertEqual(schema_drift.refresh(db, retriever, live)["changed"], [])
+
+        # Uma falha no meio mantém os nós antigos das tabelas que não foram reinseridas
+        rows.append({"schema_name": "public", "table_name": "customers", "column_name": "name", "column_type": "text"})
+        rows.append({"schema_name": "public", "table_name": "orders", "column_name": "note", "column_type": "text"})
+        live = catalog.from_schema_rows(rows)
+        retriever.reset_mock()
+        retriever.node_ids.return_value = {"orders": ["old-orders"], "customers": ["old-customers"]}
+
+        def fails_after_first_batch(tables):
+            yield [tables[0].table_name]
+            raise RuntimeError("summary failed")
+
+        retriever.add_table_schemas.side_effect = fails_after_first_batch
+        with self.assertRaises(RuntimeError):
+            schema_drift.refresh(db, retriever, live)
+        retriever.delete_nodes.assert_called_once()
+        self.assertEqual(len(retriever.delete_nodes.call_args.args[0]), 1)
+
+    def test_same_table_name_in_two_schemas_stays_separate(self):
+        from unittest import mock
+        from llama_index.core.schema import TextNode
+        from api.models import Table
+        from api.services import catalog, rag_service, schema_drift
+
+        rows = [
+            {"schema_name": "public", "table_name": "customers", "column_name": "id", "column_type": "integer"},
+            {"schema_name": "sales", "table_name": "customers", "column_name": "lead_id", "column_type": "integer"},
+        ]
+        tables = catalog.from_schema_rows(rows)
+        self.assertEqual(sorted(tables), ["customers", "sales.customers"])
+        self.assertEqual([c.name for c in tables["customers"].columns], ["id"])
+        self.assertEqual(tables["sales.customers"].schema_name, "sales")
+        self.assertNotEqual(catalog.signature(tables["customers"]), catalog.signature(tables["sales.customers"]))
+        registered = [
+            Table(name="customers", signature=catalog.signature(tables["customers"])),
+            Table(name="sales.customers", signature=catalog.signature(tables["sales.customers"])),
+        ]
+        self.assertEqual(schema_drift.compare(registered, tables)["unchanged"], ["customers", "sales.customers"])
+
+        # Remover public.customers não apaga os nós de sales.customers
+        retriever = rag_service.SQLSchemaRetriever.__new__(rag_service.SQLSchemaRetriever)
+        retriever.database_id = 7
+        nodes = [
+            TextNode(id_="public-node", text="", metadata={"table_name": "customers", "schema_name": "public"}),
+            TextNode(id_="sales-node", text="", metadata={"table_name": "customers", "schema_name": "sales"}),
+        ]
+        retriever.pgvector_store = mock.Mock()
+        retriever.pgvector_store.get_nodes.return_value = nodes
+        self.assertEqual(retriever.node_ids(["sales.customers"]), {"sales.customers": ["sales-node"]})
+        retriever.delete_table_schema("customers")
+        retriever.pgvector_store.delete_nodes.assert_called_once_with(node_ids=["public-node"])
+
+
+class ResultCacheTest(SimpleTestCase):
+    def test_normalized_lru_with_ttl_and_payload_cap(self):
+        from unittest import mock
+        from api.services.result_cache import ResultCache, is_cacheable, normalize_sql
+
+        cache = ResultCache(max_entries=2, max_payload_bytes=100)
+        self.assertTrue(cache.set(1, "select id from orders;", ["row"], ttl=60, payload_bytes=10))
+        self.assertEqual(cache.get(1, "SELECT  id\nFROM orders -- monthly"), ["row"])
+        self.assertIsNone(cache.get(2, "select id from orders"))
+        self.assertFalse(cache.set(1, "select 1", ["big"], ttl=60, payload_bytes=101))
+
+        cache.set(1, "select 2", [2], ttl=60, payload_bytes=1)
+        cache.get(1, "select id from orders")
+        cache.set(1, "select 3", [3], ttl=60, payload_bytes=1)
+        self.assertIsNone(cache.get(1, "select 2"))
+        self.assertEqual(cache.get(1, "select id from orders"), ["row"])
+
+        with mock.patch("api.services.result_cache.time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(cache.get(1, "select 3"))
+        self.assertFalse(is_cacheable("DELETE FROM orders"))
+        self.assertFalse(is_cacheable("SELECT 1; DROP TABLE orders"))
+        self.assertTrue(is_cacheable("WITH t AS (SELECT 1) SELECT * FROM t"))
+        self.assertFalse(is_cacheable("WITH x AS (DELETE FROM orders RETURNING *) SELECT * FROM x"))
+        self.assertFalse(is_cacheable("SELECT * INTO backup FROM orders"))
+        # Literais e identificadores entre aspas não são normalizados
+        cache.set(1, "select * from orders where note = 'a  b'", ["spaced"], ttl=60, payload_bytes=1)
+        self.assertIsNone(cache.get(1, "select * from orders where note = 'a b'"))
+        self.assertEqual(cache.get(1, "SELECT * FROM orders WHERE note = 'a  b'"), ["spaced"])
+        self.assertNotEqual(normalize_sql('select "Id" from t'), normalize_sql('select "ID" from t'))
+
+
+class QueryGuardTest(SimpleTestCase):
+    def test_over_budget_plans_are_limited_or_rejected(self):
+        from unittest import mock
+        from core import settings
+        from api.services import query_guard
+
+        def plan_for(statement):
+            limited = "LIMIT" in str(statement)
+            plan = {"Total Cost": 50.0 if limited else 5e7, "Plan Rows": 1000 if limited else 2e7}
+            return mock.Mock(scalar=mock.Mock(return_value=[{"Plan": plan}]))
+
+        engine = mock.MagicMock()
+        conn = engine.connect.return_value.__enter__.return_value
+        conn.execute.side_effect = plan_for
+
+        with mock.patch.object(settings, "SQL_GUARD_MODE", "limit"):
+            decision = query_guard.check(engine, "SELECT * FROM a, b;")
+        self.assertFalse(decision.rejected)
+        self.assertEqual(decision.sql_query, "SELECT * FROM (SELECT * FROM a, b) AS guarded LIMIT 1000")
+        self.assertIn("estimated cost", decision.reason)
+        self.assertEqual(str(conn.execute.call_args_list[0].args[0]), "SET TRANSACTION READ ONLY")
+        self.assertTrue(str(conn.execute.call_args_list[1].args[0]).startswith("EXPLAIN (FORMAT JSON) SELECT"))
+        conn.begin.return_value.rollback.assert_called()
+
+        with mock.patch.object(settings, "SQL_GUARD_MODE", "reject"):
+            decision = query_guard.check(engine, "SELECT * FROM a, b")
+        self.assertTrue(decision.rejected)
+        self.assertEqual(decision.sql_query, "SELECT * FROM a, b")
+
+        conn.execute.reset_mock()
+        for sql in ("SELECT 1; DROP TABLE a", "WITH x AS (DELETE FROM a RETURNING *) SELECT * FROM x", "UPDATE a SET b = 1"):
+            with mock.patch.object(settings, "SQL_GUARD_MODE", "reject"):
+                self.assertTrue(query_guard.check(engine, sql).rejected)
+        conn.execute.assert_not_called()
+
+
+class SQLRunQueryTest(SimpleTestCase):
+    def test_read_only_with_timeout_from_deadline_and_cancel(self):
+        import time
+        from unittest import mock
+        from api.services.rag_service import QueryCancelled, QueryRejected, SQLRunQuery
+
+        sql_database = mock.MagicMock()
+        conn = sql_database.engine.connect.return_value.__enter__.return_value
+        result = mock.Mock(keys=mock.Mock(return_value=["id"]), fetchmany=mock.Mock(return_value=[(1,), (2,)]))
+        conn.execute.side_effect = lambda statement, *args: (
+            mock.Mock(scalar=mock.Mock(return_value=4242)) if "pg_backend_pid" in str(statement) else result
+        )
+
+        run_query = SQLRunQuery(sql_database, database_id=None)
+        run_query.deadline = time.monotonic() + 10
+        nodes = SQLRunQuery.as_nodes(run_query.execute("SELECT id FROM orders"))
+        self.assertEqual([node.metadata for node in nodes], [{"id": 1}, {"id": 2}])
+
+        statements = [str(c.args[0]) for c in conn.execute.call_args_list]
+        self.assertEqual(statements[0], "SET TRANSACTION READ ONLY")
+        timeout_ms = int(statements[1].rsplit("=", 1)[1])
+        self.assertTrue(9000 < timeout_ms <= 10000)
+        conn.rollback.assert_called_once()
+
+        run_query._backends.add(4242)
+        run_query.cancel()
+        self.assertEqual(conn.execute.call_args.args[1], {"pid": 4242})
+
+        run_query.deadline = time.monotonic() - 1
+        with self.assertRaises(QueryCancelled):
+            run_query.execute("SELECT id FROM orders")
+
+        conn.execute.reset_mock()
+        run_query.deadline = time.monotonic() + 10
+        for sql in ("SELECT id FROM orders; DELETE FROM orders", "DELETE FROM orders"):
+            with self.assertRaises(QueryRejected):
+                run_query.execute(sql)
+        conn.execute.assert_not_called()
+
+    def test_target_engine_sessions_are_read_only(self):
+        from unittest import mock
+        from api import schemas
+        from api.services import rag_service
+
+        connection = schemas.DatabaseConnection(
+            host="db", port=5432, username="u", password="p", name="read_only_test"
+        )
+        with mock.patch.object(rag_service, "create_engine") as create_engine, \
+                mock.patch.object(rag_service, "SQLDatabase"):
+            rag_service.target_database(connection)
+            rag_service.forget_target_database(connection)
+        self.assertEqual(
+            create_engine.call_args.kwargs["connect_args"], {"options": "-c default_transaction_read_only=on"}
+        )
+
+
+class DataOnlyTest(TestCase):
+    def test_rows_are_typed_truncated_and_synthesized_lazily(self):
+        import datetime
+        import decimal
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+        from core import settings
+        from api.models import QuestionAnswer
+        from api.services.rag_service import SQLRunQuery
+
+        sql_database = mock.MagicMock()
+        conn = sql_database.engine.connect.return_value.__enter__.return_value
+        rows = [(1, decimal.Decimal("2.50"), datetime.date(2024, 1, 31)), (2, None, None), (3, None, None)]
+        result = mock.Mock(keys=mock.Mock(return_value=["id", "total", "day"]))
+        result.fetchmany.side_effect = lambda size: rows[:size]
+        conn.execute.return_value = result
+
+        with mock.patch.object(settings, "SQL_RESULT_MAX_ROWS", 2):
+            query_rows = SQLRunQuery(sql_database).execute("SELECT id, total, day FROM orders")
+        self.assertEqual(query_rows.columns, ["id", "total", "day"])
+        self.assertEqual(query_rows.rows, [[1, 2.5, "2024-01-31"], [2, None, None]])
+        self.assertTrue(query_rows.truncated)
+
+        user = User.objects.create_user("owner")
+        db = Database.objects.create(name="shop", type="minimal", user=user)
+        question = QuestionAnswer.objects.create(
+            database=db, question="orders?", query="SELECT id FROM orders", prompt_type="text_to_sql",
+            result=query_rows.model_dump(),
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch("api.services.rag_service.synthesize_answer", return_value="Two orders.") as synthesize:
+            response = client.post(f"/api/databases/{db.id}/question/{question.id}/synthesis")
+            client.post(f"/api/databases/{db.id}/question/{question.id}/synthesis")
+        self.assertEqual(response.data["answer"], "Two orders.")
+        synthesize.assert_called_once()
+        self.assertEqual(synthesize.call_args.args[2].rows, query_rows.rows)
+
+
+class SQLTablesTest(SimpleTestCase):
+    def test_referenced_tables_drive_lookup_with_vector_fallback(self):
+        from unittest import mock
+        from api.services.rag_service import retrieve_schemas
+        from api.services.sql_tables import referenced_tables
+
+        sql = (
+            "WITH recent AS (SELECT * FROM Orders WHERE day > now()) "
+            "SELECT * FROM recent r JOIN public.customers c ON c.id = r.customer_id "
+            "LEFT JOIN sales.\"Items\" i USING (id) WHERE c.id IN (SELECT id FROM vip)"
+        )
+        self.assertEqual(referenced_tables(sql), ["orders", "customers", "sales.Items", "vip"])
+        # Falha do parser vira lista vazia, mas fica no log
+        with mock.patch("api.services.sql_tables.sqlparse.parse", side_effect=ValueError("bad")), \
+                self.assertLogs("api.services.sql_tables", "ERROR"):
+            self.assertEqual(referenced_tables(sql), [])
+
+        retriever = mock.Mock()
+        retriever.lookup.return_value = ["orders schema"]
+        self.assertEqual(retrieve_schemas(retriever, "fix_sql", sql), ["orders schema"])
+        retriever.retrieve.assert_not_called()
+
+        retriever.lookup.return_value = []
+        retrieve_schemas(retriever, "explain_sql", "explain this please")
+        retrieve_schemas(retriever, "text_to_sql", "how many orders?")
+        self.assertEqual(retriever.retrieve.call_count, 2)
+        self.assertEqual(retriever.lookup.call_count, 2)
+
+
+class PromptLayoutTest(SimpleTestCase):
+    def test_stable_prefix_single_render_and_cached_tokens(self):
+        from unittest import mock
+        from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
+        from api.services import llm_metrics
+        from api.services.llm_stub import StubOpenAI
+        from api.services.rag_service import FixSQLQueryPromptStrategy, OpenAISQLGenerator
+
+        strategy = FixSQLQueryPromptStrategy("postgresql")
+        first = strategy.create_prompt({"context": "Table 'orders' has columns: id (INTEGER)", "query": "SELEC id FROM orders"})
+        second = strategy.create_prompt({"context": "Table 'orders' has columns: id (INTEGER)", "query": "SELECT * FORM orders"})
+        prefix = first[:first.index("Query:")]
+        self.assertTrue(second.startswith(prefix))
+        self.assertLess(prefix.index("Database: postgresql"), prefix.index("Schema Information"))
+
+        llm = StubOpenAI()
+        create = llm.chat.completions.create
+        def with_cache(**kwargs):
+            response = create(**kwargs)
+            response.usage = CompletionUsage(prompt_tokens=100, completion_tokens=5, total_tokens=105,
+                                             prompt_tokens_details=PromptTokensDetails(cached_tokens=64))
+            return response
+
+        usage = llm_metrics.LLMUsage()
+        with mock.patch.object(llm.chat.completions, "create", side_effect=with_cache), \
+                mock.patch.object(llm_metrics, "shared_usage", return_value=usage), \
+                mock.patch.object(strategy, "create_prompt", wraps=strategy.create_prompt) as create_prompt:
+            OpenAISQLGenerator(llm, strategy).generate({"context": "Table 'orders' has columns: id", "query": "x"})
+        create_prompt.assert_called_once()
+        totals = usage.summary()["fix_sql/gpt-4-turbo-2024-04-09"]
+        self.assertEqual((totals["calls"], totals["cached_tokens"]), (1, 64))
+        self.assertAlmostEqual(totals["cache_hit_ratio"], 0.64)
+
+
+class CredentialLeaseTest(TestCase):
+    def test_lease_skips_password_check_and_is_revocable(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+        from api.services import credential_lease
+
+        user = User.objects.create_user("owner")
+        db = Database.objects.create(name="shop", type="complete", user=user, username="u", host="h", port=5432)
+        db.set_password("secret")
+        db.save()
+        client = APIClient()
+        client.force_authenticate(user)
+
+        store = credential_lease.LeaseStore(max_entries=10)
+        with mock.patch.object(credential_lease, "shared_leases", return_value=store):
+            self.assertEqual(client.post(f"/api/databases/{db.id}/lease", {"db_password": "nope"}).status_code, 403)
+            token = client.post(f"/api/databases/{db.id}/lease", {"db_password": "secret"}).data["db_lease"]
+
+            with mock.patch.object(Database, "check_password") as check_password, \
+                    mock.patch("api.views.schema_drift.retriever_for") as retriever_for, \
+                    mock.patch("api.views.schema_drift.live_catalog", return_value={}):
+                response = client.post(f"/api/databases/{db.id}/tables/drift", {"db_lease": token, "dry_run": True}, format="json")
+            self.assertEqual(response.status_code, 200)
+            check_password.assert_not_called()
+            self.assertEqual(retriever_for.call_args.args[1], "secret")
+
+            self.assertIsNone(store.resolve(token, db.id + 1, user.id))
+            self.assertEqual(client.delete(f"/api/databases/{db.id}/lease", {"db_lease": token}).status_code, 204)
+            response = client.post(f"/api/databases/{db.id}/tables/drift", {"db_lease": token})
+            self.assertEqual(response.status_code, 401)
+
+
+class PaginationTest(TestCase):
+    def test_list_endpoints_use_keyset_pages_with_fixed_query_counts(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+        from api.models import QuestionAnswer, Table
+
+        users = [User.objects.create_user(f"user{i}") for i in range(3)]
+        db = Database.objects.create(name="shop", type="minimal", user=users[0])
+        for user in users[1:]:
+            Database.objects.create(name="other", type="minimal", user=user)
+        Table.objects.bulk_create([Table(database=db, name=f"t{i}") for i in range(7)])
+        QuestionAnswer.objects.bulk_create(
+            [QuestionAnswer(database=db, question=f"q{i}", prompt_type="text_to_sql") for i in range(7)]
+        )
+        client = APIClient()
+        client.force_authenticate(users[0])
+
+        with self.assertNumQueries(1):
+            first = client.get(f"/api/databases/{db.id}/question", {"page_size": 3}).data
+        with self.assertNumQueries(1):
+            second = client.get(first["next"]).data
+        self.assertEqual([q["question"] for q in first["results"] + second["results"]], [f"q{i}" for i in range(6)])
+
+        with self.assertNumQueries(2):
+            tables = client.get(f"/api/databases/{db.id}/tables/", {"page_size": 5}).data
+        self.assertEqual(len(tables["results"]), 5)
+        self.assertIsNotNone(tables["next"])
+
+        with self.assertNumQueries(2):
+            listed = client.get("/api/users/", {"page_size": 3}).data
+        self.assertEqual([u["databases"] for u in listed["results"]], [[d.id] for d in Database.objects.order_by("user_id")])
+
+
+class StartupImportTest(SimpleTestCase):
+    def test_entrypoints_stay_within_import_budget_without_rag_stack(self):
+        from core import settings
+        from api.services import import_budget
+
+        for entrypoint in ("core.wsgi", "core.asgi"):
+            rows = import_budget.measure(entrypoint)
+            self.assertIn("api.views", [row["module"] for row in rows])
+            self.assertEqual(import_budget.rag_stack_imports(rows), [], entrypoint)
+            self.assertLess(import_budget.total_ms(rows), settings.STARTUP_IMPORT_BUDGET_MS, entrypoint)
+
+
+class PrewarmTest(TestCase):
+    def test_phases_are_timed_and_failures_skipped(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from api.models import QuestionAnswer
+        from api.services import prewarm
+
+        user = User.objects.create_user("owner")
+        idle = Database.objects.create(name="idle", type="minimal", user=user)
+        busy = Database.objects.create(name="busy", type="minimal", user=user)
+        QuestionAnswer.objects.create(database=idle, question="q", prompt_type="text_to_sql")
+        QuestionAnswer.objects.create(database=busy, question="q", prompt_type="text_to_sql")
+
+        def broken(context):
+            raise RuntimeError("pgvector down")
+
+        lines = []
+        phases = (
+            ("active_databases", prewarm._active_databases),
+            ("vector_store", broken),
+            ("retrievers", lambda context: ",".join(db.name for db in context["databases"])),
+        )
+        notify = mock.Mock()
+        with mock.patch.object(prewarm, "PHASES", phases):
+            timings = prewarm.run(log=lines.append, notify=notify)
+
+        self.assertEqual(list(timings), ["active_databases", "vector_store", "retrievers"])
+        self.assertEqual(notify.call_count, 3)
+        self.assertIn("failed: RuntimeError('pgvector down')", lines[1])
+        self.assertTrue(lines[2].endswith("(busy,idle)"))
+        self.assertTrue(lines[-1].startswith("prewarm total: "))
+
+    def test_warms_the_shared_workflows_requests_use(self):
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from llama_index.core.schema import TextNode
+        from api.models import QuestionAnswer
+        from api.services import prewarm, rag_service, vector_index
+        from core import settings
+
+        user = User.objects.create_user("owner")
+        db_obj = Database.objects.create(name="shop", type="minimal", user=user)
+        for prompt_type in ("text_to_sql", "explain_sql", "text_to_sql"):
+            QuestionAnswer.objects.create(database=db_obj, question="q", prompt_type=prompt_type)
+
+        sync_engine = mock.MagicMock()
+        store = mock.Mock()
+        store.get_nodes.return_value = [
+            TextNode(text="orders", metadata={"table_name": "orders", "references": ["customers"]}),
+            TextNode(text="customers", metadata={"table_name": "customers", "references": []}),
+        ]
+        lines = []
+        with mock.patch.multiple(vector_index, store_engines=mock.Mock(return_value=(sync_engine, mock.Mock())),
+                                 store=mock.Mock(return_value=store)), \
+                mock.patch.object(settings, "LLM_BACKEND", "stub"):
+            prewarm.run(log=lines.append)
+            warmed = rag_service.simple_workflow("shop", "text_to_sql", db_obj.id)
+        self.addCleanup(rag_service.forget_workflows, db_obj.id)
+
+        self.assertFalse([line for line in lines if "failed" in line], lines)
+        sync_engine.connect.return_value.__enter__.return_value.execute.assert_called_once()
+        self.assertIn(f"{db_obj.id}:explain_sql,text_to_sql", lines[4])
+        # A requisição recebe a instância aquecida, com o grafo de joins já carregado
+        self.assertIsNotNone(warmed.schema_retriever._join_graph)
+        self.assertEqual(warmed.schema_retriever.join_graph().edges, {
+            ("public", "orders"): {("public", "customers")}, ("public", "customers"): {("public", "orders")},
+        })
+        self.assertEqual(store.get_nodes.call_count, 2)
+
+
+class SharedWorkflowTest(SimpleTestCase):
+    def test_cached_workflow_serves_concurrent_runs(self):
+        import asyncio
+        from unittest import mock
+        from llama_index.core.objects import SQLTableSchema
+        from sqlalchemy import Column, Integer, MetaData, Table
+        from api import schemas
+        from api.services import rag_service
+        from api.services.llm_stub import StubOpenAI
+
+        retriever = mock.Mock(database_id=7, tables=["orders"])
+        retriever.retrieve.return_value = [SQLTableSchema(table_name="orders", context_str="Orders.")]
+        sql_database = mock.Mock(metadata_obj=MetaData())
+        Table("orders", sql_database.metadata_obj, Column("id", Integer))
+        sql_database.get_single_table_info.return_value = "Table 'orders' has columns: id (INTEGER)"
+        generator = rag_service.OpenAISQLGenerator(StubOpenAI())
+        build = mock.Mock(side_effect=lambda: rag_service.TextToSQLWorkflow(retriever, generator, sql_database, "text_to_sql"))
+
+        workflow = rag_service.cached_workflow((7, "text_to_sql"), ("orders",), build)
+        self.assertIs(rag_service.cached_workflow((7, "text_to_sql"), ("orders",), build), workflow)
+        build.assert_called_once()
+
+        def run_query(rows):
+            sql_run_query = mock.Mock()
+            sql_run_query.check.side_effect = lambda sql: schemas.QueryGuardDecision(sql_query=sql)
+            sql_run_query.run.return_value = schemas.QueryRows(columns=["id"], rows=rows)
+            return sql_run_query
+
+        first, second = run_query([[1]]), run_query([[2], [3]])
+
+        async def both():
+            return await asyncio.gather(
+                workflow.run(query="How many orders?", sql_run_query=first, data_only=True),
+                workflow.run(query="List the orders", sql_run_query=second),
+            )
+
+        data, synthesized = asyncio.run(both())
+        self.assertEqual(data.data.rows, [[1]])
+        self.assertTrue(synthesized.natural_language_response)
+        first.run.assert_called_once()
+        second.run.assert_called_once()
+        self.assertIsNone(generator.prompt_strategy)
+
+        self.assertIsNot(rag_service.cached_workflow((7, "text_to_sql"), ("orders", "customers"), build), workflow)
+        rag_service.forget_workflows(7)
+        self.assertEqual(build.call_count, 2)
+
+
+class ModelRoutingTest(SimpleTestCase):
+    def test_routes_overrides_and_fallback(self):
+        import httpx
+        from unittest import mock
+        from openai import InternalServerError
+        from core import settings
+        from api.services import llm_metrics, model_routing
+        from api.services.llm_metrics import LLMUsage
+        from api.services.llm_stub import StubOpenAI
+        from api.services.rag_service import ExplainSQLQueryPromptStrategy, OpenAISQLGenerator
+
+        routes = '{"explain_sql": ["gpt-4o", "gpt-4-turbo"], "schema_summary": "gpt-4o-mini"}'
+        overrides = '{"7": {"explain_sql": "gpt-4o-mini"}}'
+        with mock.patch.object(settings, "LLM_MODEL_ROUTES", routes), \
+                mock.patch.object(settings, "LLM_MODEL_OVERRIDES", overrides):
+            self.assertEqual(model_routing.models_for("explain_sql"), ["gpt-4o", "gpt-4-turbo"])
+            self.assertEqual(model_routing.models_for("explain_sql", 7), ["gpt-4o-mini"])
+            self.assertEqual(model_routing.models_for("schema_summary", 7), ["gpt-4o-mini"])
+            self.assertEqual(model_routing.models_for("text_to_sql", 7), model_routing.DEFAULT_ROUTES["text_to_sql"])
+            with self.assertRaises(ValueError):
+                model_routing.models_for("translate")
+
+            llm = StubOpenAI()
+            create = llm.chat.completions.create
+            def flaky(**kwargs):
+                if kwargs["model"] == "gpt-4o":
+                    request = httpx.Request("POST", "http://llm.local/v1/chat/completions")
+                    raise InternalServerError("down", response=httpx.Response(500, request=request), body=None)
+                return create(**kwargs)
+
+            usage = LLMUsage()
+            with mock.patch.object(llm.chat.completions, "create", side_effect=flaky) as calls, \
+                    mock.patch.object(llm_metrics, "shared_usage", return_value=usage), \
+                    self.assertLogs("api.services.model_routing", "WARNING") as logs:
+                OpenAISQLGenerator(llm, ExplainSQLQueryPromptStrategy("postgresql")).generate(
+                    {"context": "Table 'orders' has columns: id", "query": "SELECT id FROM orders"}
+                )
+        self.assertEqual([c.kwargs["model"] for c in calls.call_args_list], ["gpt-4o", "gpt-4-turbo"])
+        self.assertEqual(usage.summary()["explain_sql/gpt-4o"]["fallbacks"], 1)
+        self.assertIn("falling back to gpt-4-turbo", logs.output[0])
+
+
+class LLMHedgingTest(SimpleTestCase):
+    def test_slow_call_is_hedged_within_budget(self):
+        import time
+        from unittest import mock
+        from core import settings
+        from api.services import llm_hedging
+
+        tracker = llm_hedging.LatencyTracker(window=50)
+        for _ in range(10):
+            tracker.record("explain_sql", "gpt-4o", 0.01)
+        # Atraso de cada chamada, na ordem em que começam
+        delays = [0, 0.5, 0, 0.5]
+
+        def request():
+            delay = delays.pop(0)
+            time.sleep(delay)
+            return "slow" if delay else "fast"
+
+        with mock.patch.object(settings, "LLM_HEDGE_ENABLED", True), \
+                mock.patch.object(settings, "LLM_HEDGE_MIN_SAMPLES", 10), \
+                mock.patch.object(settings, "LLM_HEDGE_MAX_FRACTION", 0.5), \
+                mock.patch.object(llm_hedging, "shared_tracker", return_value=tracker):
+            self.assertEqual(llm_hedging.call("explain_sql", "gpt-4o", request), "fast")
+            started = time.monotonic()
+            self.assertEqual(llm_hedging.call("explain_sql", "gpt-4o", request), "fast")
+            self.assertLess(time.monotonic() - started, 0.4)
+            # Outro hedge passaria de 50% das chamadas
+            self.assertEqual(llm_hedging.call("explain_sql", "gpt-4o", request), "slow")
+        self.assertEqual(
+            tracker.summary()["explain_sql/gpt-4o"],
+            {"calls": 3, "hedges": 1, "hedges_won": 1, "over_budget": 1},
+        )
+
+
+class SQLValidationTest(SimpleTestCase):
+    def test_unknown_identifiers_are_repaired_before_execution(self):
+        import asyncio
+        from unittest import mock
+        from llama_index.core.objects import SQLTableSchema
+        from sqlalchemy import Column, Integer, MetaData, Numeric, Table
+        from api import schemas
+        from api.services import rag_service, sql_validation
+
+        columns = {"orders": {"id", "customer_id", "total"}, "customers": {"id", "email"}, "sales.leads": None}
+        self.assertEqual(sql_validation.validate(
+            "SELECT c.email, count(*) n FROM orders o JOIN customers c ON c.id = o.customer_id GROUP BY 1 ORDER BY n",
+            columns,
+        ), [])
+        self.assertEqual(sql_validation.validate("SELECT c.mail, amount FROM customers c JOIN orders ON true", columns),
+                         ['column c.mail does not exist', 'column "amount" does not exist'])
+        self.assertEqual(sql_validation.validate("SELECT * FROM invoices", columns), ['relation "invoices" does not exist'])
+        with mock.patch("api.services.sql_validation.sqlparse.parse", side_effect=ValueError("bad")), \
+                self.assertLogs("api.services.sql_validation", "ERROR"):
+            self.assertEqual(sql_validation.validate("SELECT * FROM invoices", columns), [])
+        # Colunas de subqueries/CTEs e tabelas não refletidas não são verificadas
+        self.assertEqual(sql_validation.validate("WITH t AS (SELECT id AS x FROM orders) SELECT x, y FROM t", columns), [])
+        self.assertEqual(sql_validation.validate("SELECT anything FROM sales.leads", columns), [])
+
+        metadata = MetaData()
+        Table("orders", metadata, Column("id", Integer), Column("total", Numeric))
+        sql_database = mock.Mock(metadata_obj=metadata)
+        sql_database.get_single_table_info.return_value = "Table 'orders' has columns: id (INTEGER), total (NUMERIC)"
+        retriever = mock.Mock(database_id=7, tables=["orders"])
+        retriever.retrieve.return_value = [SQLTableSchema(table_name="orders")]
+        generator = mock.Mock()
+        generator.generate.side_effect = lambda kwargs, strategy, deadline=None: {
+            "text_to_sql": schemas.TextToSQLEvent(sql_query="SELECT sum(amount) FROM orders", natural_language_query="q"),
+            "repair_sql": schemas.FixSQLResult(fixed_sql_query="SELECT sum(total) FROM orders", fix_explanation=""),
+        }[strategy.function_name()]
+        sql_run_query = mock.Mock()
+        sql_run_query.check.side_effect = lambda sql: schemas.QueryGuardDecision(sql_query=sql)
+        sql_run_query.run.return_value = schemas.QueryRows(columns=["sum"], rows=[[10]])
+
+        workflow = rag_service.TextToSQLWorkflow(retriever, generator, sql_database, "text_to_sql")
+
+        async def run():
+            return await workflow.run(query="Total sold?", sql_run_query=sql_run_query, data_only=True)
+
+        result = asyncio.run(run())
+        self.assertEqual(result.sql_query, "SELECT sum(total) FROM orders")
+        sql_run_query.run.assert_called_once_with("SELECT sum(total) FROM orders")
+        repair_kwargs = generator.generate.call_args_list[1].args[0]
+        self.assertEqual(repair_kwargs["errors"], 'column "amount" does not exist')
+
+        # Sem reparo que resolva, a query não vai ao banco e os erros voltam no resultado
+        generator.generate.side_effect = lambda kwargs, strategy, deadline=None: {
+            "text_to_sql": schemas.TextToSQLEvent(sql_query="SELECT sum(amount) FROM orders", natural_language_query="q"),
+            "repair_sql": schemas.FixSQLResult(fixed_sql_query="SELECT sum(amount) FROM orders", fix_explanation=""),
+        }[strategy.function_name()]
+        sql_run_query.reset_mock()
+        with self.assertLogs("api.services.rag_service", "WARNING"):
+            result = asyncio.run(run())
+        self.assertFalse(result.executed)
+        self.assertEqual(result.guard_reason, 'invalid SQL: column "amount" does not exist')
+        sql_run_query.check.assert_not_called()
+        sql_run_query.run.assert_not_called()
+
+
+class WideTableTest(SimpleTestCase):
+    def test_wide_tables_get_column_nodes_and_pruned_context(self):
+        from unittest import mock
+        from llama_index.core.objects import SQLTableSchema
+        from sqlalchemy import Column, ForeignKey, Integer, MetaData, Table, Text
+        from core import settings
+        from api.services import catalog, rag_service, vector_index
+
+        metadata = MetaData()
+        Table("customers", metadata, Column("id", Integer, primary_key=True))
+        Table(
+            "events", metadata,
+            Column("id", Integer, primary_key=True),
+            Column("customer_id", Integer, ForeignKey("customers.id")),
+            *[Column(f"attr_{i}", Text, comment=f"Attribute {i}") for i in range(5)],
+        )
+        table = catalog.from_reflected(metadata.tables["events"])
+        self.assertEqual(table.primary_key, ["id"])
+        self.assertEqual(table.foreign_keys[0].referred_table, "customers")
+        self.assertEqual(
+            [column.name for column in catalog.pruned(table, ["attr_3"]).columns], ["id", "customer_id", "attr_3"]
+        )
+
+        retriever = rag_service.SQLTableRetriever.__new__(rag_service.SQLTableRetriever)
+        retriever.database_id = 7
+        retriever.relevant_columns = mock.Mock(return_value={"events": ["attr_3"]})
+        sql_database = mock.Mock(metadata_obj=metadata)
+        sql_database.get_single_table_info.return_value = "Table 'customers' has columns: id (INTEGER)"
+        workflow = rag_service.TextToSQLWorkflow(retriever, mock.Mock(), sql_database, "text_to_sql")
+        objs = [SQLTableSchema(table_name="events"), SQLTableSchema(table_name="customers")]
+
+        with mock.patch.object(settings, "COLUMN_NODES_MIN_COLUMNS", 0):
+            self.assertEqual(retriever._column_nodes("events", table.columns), [])
+            workflow._get_table_context_str(objs, "attr 3 per customer")
+            retriever.relevant_columns.assert_not_called()
+
+        with mock.patch.object(settings, "COLUMN_NODES_MIN_COLUMNS", 5):
+            nodes = retriever._column_nodes("events", table.columns)
+            self.assertEqual(len(nodes), 7)
+            self.assertEqual(nodes[2].metadata[vector_index.NODE_TYPE_KEY], vector_index.COLUMN_NODE)
+            self.assertIn("Attribute 0", nodes[2].get_content(metadata_mode="embed"))
+            self.assertEqual(retriever._column_nodes("customers", [table.columns[0]]), [])
+
+            context = workflow._get_table_context_str(objs, "attr 3 per customer")
+            retriever.relevant_columns.assert_called_once_with("attr 3 per customer", ["events"])
+            self.assertIn("attr_3", context)
+            self.assertIn("customer_id", context)
+            self.assertNotIn("attr_0", context)
+            self.assertIn("4 other columns omitted", context)
+            self.assertIn("Table 'customers' has columns", context)
+
+    def test_token_budget_counts_the_pruned_description(self):
+        from unittest import mock
+        from llama_index.core.schema import NodeWithScore, TextNode
+        from sqlalchemy import Column, Integer, MetaData, Table, Text
+        from core import settings
+        from api.services import rag_service
+
+        metadata = MetaData()
+        Table("customers", metadata, Column("id", Integer, primary_key=True))
+        Table("events", metadata, Column("id", Integer, primary_key=True), *[Column(f"attr_{i}", Text) for i in range(60)])
+        retriever = rag_service.SQLTableRetriever.__new__(rag_service.SQLTableRetriever)
+        retriever.database_id = 7
+        retriever.tables = ["customers", "events"]
+        retriever._join_graph = None
+        retriever.pgvector_store = mock.Mock()
+        retriever.relevant_columns = mock.Mock(return_value={"events": ["attr_3"]})
+        retriever.sql_database = mock.Mock(metadata_obj=metadata)
+        retriever.sql_database.get_single_table_info.side_effect = lambda name: f"Table '{name}' has columns: id (INTEGER)"
+        # O nó guarda o schema inteiro (~400 tokens); podado, events cabe no orçamento
+        full_schema = "Schema of table events: " + ", ".join(f"attr_{i} (TEXT)" for i in range(60)) * 4
+        candidates = [
+            NodeWithScore(node=TextNode(text="Schema of table customers", metadata={"table_name": "customers"}), score=0.9),
+            NodeWithScore(node=TextNode(text=full_schema, metadata={"table_name": "events"}), score=0.88),
+        ]
+        self.assertGreater(len(full_schema) // 4, 200)
+        workflow = rag_service.TextToSQLWorkflow(retriever, mock.Mock(), retriever.sql_database, "text_to_sql")
+        with mock.patch.multiple(settings, COLUMN_NODES_MIN_COLUMNS=20, RETRIEVAL_MIN_K=1, RETRIEVAL_TOKEN_BUDGET=100), \
+                mock.patch("api.services.rag_service.VectorStoreIndex") as index:
+            index.from_vector_store.return_value.as_retriever.return_value.retrieve.return_value = candidates
+            found = retriever.retrieve("attr 3 per customer")
+            context = workflow._get_table_context_str(found, "attr 3 per customer")
+
+        self.assertEqual([obj.table_name for obj in found], ["customers", "events"])
+        # A descrição contada é a mesma que vai ao prompt, sem podar de novo
+        retriever.relevant_columns.assert_called_once_with("attr 3 per customer", ["events"])
+        self.assertIn("attr_3", context)
+        self.assertIn("59 other columns omitted", context)
+
+
+class JoinGraphTest(SimpleTestCase):
+    def test_bridge_tables_are_added_within_budget(self):
+        from unittest import mock
+        from llama_index.core.objects import SQLTableSchema
+        from llama_index.core.schema import NodeWithScore, TextNode
+        from sqlalchemy import Column, ForeignKey, Integer, MetaData, Table
+        from core import settings
+        from api.services import catalog, rag_service
+        from api.services.join_graph import JoinGraph
+
+        rows = [
+            {"schema_name": "public", "table_name": "customers", "column_name": "id", "column_type": "integer", "primary_key": True},
+            {"schema_name": "public", "table_name": "orders", "column_name": "id", "column_type": "integer", "primary_key": True},
+            {"schema_name": "public", "table_name": "orders", "column_name": "customer_id", "column_type": "integer",
+             "references": "customers.id"},
+            {"schema_name": "public", "table_name": "order_items", "column_name": "order_id", "column_type": "integer",
+             "references": "public.orders.id"},
+            {"schema_name": "public", "table_name": "order_items", "column_name": "product_id", "column_type": "integer",
+             "references": "products.id"},
+            {"schema_name": "public", "table_name": "products", "column_name": "id", "column_type": "integer", "primary_key": True},
+        ]
+        formatted = {value["table_name"]: value for value in rag_service.generate_postgres_schemas(rows)}
+        self.assertIn('"customer_id" integer REFERENCES "public"."customers" ("id")', formatted["orders"]["schema"])
+        self.assertEqual(formatted["order_items"]["references"], ["orders", "products"])
+        tables = catalog.from_schema_rows(rows)
+        self.assertEqual(tables["customers"].primary_key, ["id"])
+        self.assertEqual(catalog.from_schema_rows(catalog.schema_rows(tables["order_items"])), {"order_items": tables["order_items"]})
+        with self.assertRaises(ValueError):
+            catalog.parse_reference("orders")
+
+        key = lambda name: ("public", name)
+        graph = JoinGraph.from_references({
+            key(name): [catalog.split_name(referred) for referred in value["references"]] for name, value in formatted.items()
+        })
+        self.assertEqual(graph.shortest_path(key("customers"), key("products"), 3),
+                         [key("customers"), key("orders"), key("order_items"), key("products")])
+        self.assertIsNone(graph.shortest_path(key("customers"), key("products"), 2))
+        self.assertEqual(graph.bridges([key("customers"), key("products")], 6, 3), [key("orders"), key("order_items")])
+        self.assertEqual(graph.bridges([key("customers"), key("products")], 3, 3), [])
+        self.assertEqual(graph.bridges([key("customers"), key("order_items")], 3, 3), [key("orders")])
+        self.assertEqual(JoinGraph.from_tables(tables.values(), [key("customers"), key("orders")]).edges, {
+            key("customers"): {key("orders")}, key("orders"): {key("customers")},
+        })
+
+        metadata = MetaData()
+        Table("customers", metadata, Column("id", Integer, primary_key=True))
+        Table("orders", metadata, Column("id", Integer, primary_key=True), Column("customer_id", Integer, ForeignKey("customers.id")))
+        Table("order_items", metadata, Column("order_id", Integer, ForeignKey("orders.id")))
+        retriever = rag_service.SQLTableRetriever.__new__(rag_service.SQLTableRetriever)
+        retriever.sql_database = mock.Mock(metadata_obj=metadata)
+        retriever.sql_database.get_single_table_info.side_effect = lambda name: f"Table '{name}' has columns: id"
+        retriever.tables = ["customers", "orders", "order_items"]
+        retriever.database_id = 7
+        retriever._join_graph = None
+        retriever.pgvector_store = mock.Mock()
+        retriever.lookup = mock.Mock(side_effect=lambda names: [SQLTableSchema(table_name=name) for name in names])
+        candidates = [
+            NodeWithScore(node=TextNode(text="Schema of table order_items", metadata={"table_name": "order_items"}), score=0.9),
+            NodeWithScore(node=TextNode(text="Schema of table customers", metadata={"table_name": "customers"}), score=0.85),
+        ]
+        with mock.patch.object(settings, "JOIN_PATH_MAX_TABLES", 3), mock.patch.object(settings, "JOIN_PATH_MAX_HOPS", 3), \
+                mock.patch("api.services.rag_service.VectorStoreIndex") as index:
+            index.from_vector_store.return_value.as_retriever.return_value.retrieve.return_value = candidates
+            found = retriever.retrieve("revenue per customer")
+        self.assertEqual([obj.table_name for obj in found], ["order_items", "customers", "orders"])
+        retriever.lookup.assert_called_once_with(["orders"])
+
+    def test_tables_outside_public_are_joined_by_schema(self):
+        from unittest import mock
+        from llama_index.core.schema import NodeWithScore, TextNode
+        from core import settings
+        from api.services import rag_service
+
+        # sales.orders aponta para sales.customers, não para public.customers
+        rows = [
+            {"schema_name": "sales", "table_name": "customers", "column_name": "id", "column_type": "integer"},
+            {"schema_name": "sales", "table_name": "orders", "column_name": "customer_id", "column_type": "integer",
+             "references": "sales.customers.id"},
+            {"schema_name": "sales", "table_name": "order_items", "column_name": "order_id", "column_type": "integer",
+             "references": "sales.orders.id"},
+            {"schema_name": "public", "table_name": "customers", "column_name": "id", "column_type": "integer"},
+        ]
+        retriever = rag_service.SQLSchemaRetriever.__new__(rag_service.SQLSchemaRetriever)
+        retriever.database_id = 7
+        retriever._join_graph = None
+        nodes = [
+            retriever._to_node(value["table_name"], value["schema"], "summary", value["references"], value["schema_name"])
+            for value in rag_service.generate_postgres_schemas(rows)
+        ]
+        self.assertEqual(nodes[1].metadata["references"], ["sales.customers"])
+        retriever.pgvector_store = mock.Mock()
+        retriever.pgvector_store.get_nodes.side_effect = lambda filters: nodes
+        retriever.load_existing_index = mock.Mock()
+        retriever.load_existing_index.return_value.as_retriever.return_value.retrieve.return_value = [
+            NodeWithScore(node=nodes[2], score=0.9), NodeWithScore(node=nodes[0], score=0.88),
+        ]
+        with mock.patch.object(settings, "JOIN_PATH_MAX_TABLES", 6), mock.patch.object(settings, "JOIN_PATH_MAX_HOPS", 3):
+            found = retriever.retrieve("items per customer")
+
+        self.assertEqual(retriever.join_graph().edges[("sales", "orders")], {("sales", "customers"), ("sales", "order_items")})
+        self.assertNotIn(("public", "customers"), retriever.join_graph().edges)
+        self.assertEqual([retriever.node_key(node) for node in found],
+                         [("sales", "order_items"), ("sales", "customers"), ("sales", "orders")])
+        self.assertEqual([retriever.node_key(node) for node in retriever.lookup(["customers"])], [("public", "customers")])
+
+
+class AdaptiveTopKTest(SimpleTestCase):
+    def test_cutoff_by_score_gap_and_token_budget(self):
+        from unittest import mock
+        from llama_index.core.schema import NodeWithScore, TextNode
+        from core import settings
+        from api.services import retrieval_cutoff
+
+        def ranked(*scores, size=40):
+            return [
+                NodeWithScore(node=TextNode(text=f"table_{i} " + "x" * size), score=score)
+                for i, score in enumerate(scores)
+            ]
+
+        def kept(candidates, **overrides):
+            values = {"RETRIEVAL_MIN_K": 1, "RETRIEVAL_MAX_K": 5, "RETRIEVAL_SCORE_THRESHOLD": 0.0,
+                      "RETRIEVAL_RELATIVE_GAP": 0.15, "RETRIEVAL_TOKEN_BUDGET": 3000, **overrides}
+            with mock.patch.multiple(settings, **values):
+                return [candidate.node.text.split()[0] for candidate in retrieval_cutoff.cut(candidates)]
+
+        # Uma tabela muito à frente das outras: só ela vai para o prompt
+        self.assertEqual(kept(ranked(0.82, 0.55, 0.52)), ["table_0"])
+        # Várias próximas do melhor score ficam, até o max k
+        self.assertEqual(kept(ranked(0.8, 0.78, 0.75, 0.74, 0.73, 0.72, 0.3)), [f"table_{i}" for i in range(5)])
+        self.assertEqual(kept(ranked(0.8, 0.78, 0.2), RETRIEVAL_RELATIVE_GAP=0.0, RETRIEVAL_SCORE_THRESHOLD=0.5),
+                         ["table_0", "table_1"])
+        self.assertEqual(kept(ranked(0.3, 0.29), RETRIEVAL_SCORE_THRESHOLD=0.5, RETRIEVAL_MIN_K=1), ["table_0"])
+        self.assertEqual(kept(ranked(0.82, 0.55, 0.52), RETRIEVAL_MIN_K=2), ["table_0", "table_1"])
+        # Orçamento de tokens: ~52 tokens por schema
+        self.assertEqual(kept(ranked(0.8, 0.8, 0.8, size=200), RETRIEVAL_TOKEN_BUDGET=110), ["table_0", "table_1"])
+        self.assertEqual(kept(ranked(None, None, None), RETRIEVAL_TOKEN_BUDGET=25), ["table_0", "table_1"])
+        self.assertEqual(kept([]), [])
+
+
+class DeadlineTest(SimpleTestCase):
+    def test_steps_share_the_request_deadline_and_return_partial_results(self):
+        import asyncio
+        import time
+        from unittest import mock
+        from llama_index.core.objects import SQLTableSchema
+        from sqlalchemy import Column, Integer, MetaData, Table
+        from core import settings
+        from api import schemas
+        from api.services import deadlines, rag_service
+        from api.services.llm_stub import StubOpenAI
+
+        with mock.patch.object(settings, "REQUEST_DEADLINE_MAX", 60):
+            self.assertEqual(deadlines.for_request("90").seconds, 60)
+            self.assertEqual(deadlines.for_request(None).seconds, settings.REQUEST_DEADLINE_DEFAULT)
+        for invalid in ("soon", 0, -5):
+            with self.assertRaises(ValueError):
+                deadlines.for_request(invalid)
+        with self.assertRaises(deadlines.DeadlineExceeded):
+            deadlines.run_within(deadlines.Deadline(1), 0.05, lambda: time.sleep(0.5))
+
+        retriever = mock.Mock(database_id=7, tables=["orders"])
+        retriever.retrieve.return_value = [SQLTableSchema(table_name="orders")]
+        sql_database = mock.Mock(metadata_obj=MetaData())
+        Table("orders", sql_database.metadata_obj, Column("id", Integer))
+        sql_database.get_single_table_info.return_value = "Table 'orders' has columns: id (INTEGER)"
+        generator = rag_service.OpenAISQLGenerator(StubOpenAI())
+        workflow = rag_service.TextToSQLWorkflow(retriever, generator, sql_database, "text_to_sql")
+        sql_run_query = mock.Mock(deadline=None)
+        sql_run_query.check.side_effect = lambda sql: schemas.QueryGuardDecision(sql_query=sql)
+        sql_run_query.run.return_value = schemas.QueryRows(columns=["id"], rows=[[1]])
+
+        def run(deadline):
+            async def go():
+                return await rag_service.run_until_deadline(
+                    workflow.run(query="How many orders?", sql_run_query=sql_run_query, deadline=deadline), deadline
+                )
+            return asyncio.run(go())
+
+        # Pouco tempo para a síntese: volta o SQL com as linhas, marcado como parcial
+        deadline = deadlines.Deadline(30)
+        with mock.patch.object(settings, "REQUEST_DEADLINE_MIN_LLM_CALL", 60):
+            result = run(deadline)
+        self.assertTrue(result.timed_out)
+        self.assertTrue(result.sql_query)
+        self.assertEqual(result.data.rows, [[1]])
+        self.assertEqual(result.natural_language_response, "")
+        self.assertEqual(sql_run_query.deadline, deadline.expires_at)
+
+        # A recuperação lenta não consome o prazo todo: a resposta sai sem SQL, dentro do prazo
+        retriever.retrieve.side_effect = lambda query: time.sleep(1) or [SQLTableSchema(table_name="orders")]
+        started = time.monotonic()
+        with mock.patch.object(settings, "REQUEST_DEADLINE_RETRIEVAL_SHARE", 0.1):
+            result = run(deadlines.Deadline(2))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.executed)
+        self.assertIn("retrieving the tables", result.natural_language_response)
+
+        # O EXPLAIN também fica dentro do prazo: a query não roda
+        retriever.retrieve.side_effect = None
+        sql_run_query.check.side_effect = lambda sql: time.sleep(1) or schemas.QueryGuardDecision(sql_query=sql)
+        sql_run_query.run.reset_mock()
+        started = time.monotonic()
+        with mock.patch.object(settings, "REQUEST_DEADLINE_GUARD_SHARE", 0.1):
+            result = run(deadlines.Deadline(2))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.executed)
+        self.assertTrue(result.guard_reason.startswith("cost check timed out"))
+        sql_run_query.run.assert_not_called()
+
+        # O cliente OpenAI não repete chamadas por conta própria: o prazo é de cada chamada
+        with mock.patch.object(settings, "LLM_BACKEND", "openai"), \
+                mock.patch.object(rag_service, "OpenAI") as openai, \
+                mock.patch.object(rag_service.LLMFactory, "_openai_client", None):
+            rag_service.LLMFactory.create_llm("gpt-4o")
+        openai.assert_called_once_with(max_retries=0)
+
+        expired = deadlines.Deadline(0.01)
+        time.sleep(0.02)
+        with self.assertRaises(deadlines.DeadlineExceeded):
+            generator.generate({"context": "", "query": "q"}, workflow.prompt_strategy, deadline=expired)
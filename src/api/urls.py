@@ -9,10 +9,14 @@ urlpatterns = [
 
     path('databases/',  views.DatabaseList.as_view() ),
     path('databases/<int:pk>', views.DatabaseDetail.as_view()),
+    path('databases/<int:database>/lease', views.DatabaseLease.as_view()),
     
     path('databases/<int:database>/tables/',  views.TableList.as_view() ),
+    path('databases/<int:database>/tables/bulk',  views.TableBulkRegister.as_view() ),
+    path('databases/<int:database>/tables/drift',  views.TableSchemaDrift.as_view() ),
     path('databases/<int:database>/tables/<int:pk>/',  views.TableDetail.as_view() ),
     path('databases/<int:database>/question',  views.QuestionAnswerList.as_view() ),
+    path('databases/<int:database>/question/<int:pk>/synthesis',  views.QuestionAnswerSynthesis.as_view() ),
 ]
 
 
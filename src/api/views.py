@@ -5,25 +5,61 @@ from rest_framework.response import Response
 from rest_framework import status
 from api.models import Database, Table, QuestionAnswer
 from api.serializer import DatabaseSerializer, TableSerializer, QuestionAnswerSerializer, UserSerializer
-from api import schemas
-from api.services.rag_service import *
+from api.services import credential_lease, deadlines, result_cache
+from core import settings
 from django.forms.models import model_to_dict
 import asyncio
 from django.contrib.auth.models import User
 from rest_framework import generics
 from rest_framework import permissions
 from api.permissions import IsOwner, IsOwnerTable
+from api.pagination import IdCursorPagination
+from django.utils.functional import SimpleLazyObject
+from importlib import import_module
 
 
+def lazy_import(name):
+    """Module imported on first attribute access (keeps llama_index/OpenAI/SQLAlchemy out of URL-conf load)."""
+    return SimpleLazyObject(lambda: import_module(name))
+
+
+# Pilha RAG importada só na primeira requisição que a usa
+schemas = lazy_import("api.schemas")
+rag_service = lazy_import("api.services.rag_service")
+catalog = lazy_import("api.services.catalog")
+schema_drift = lazy_import("api.services.schema_drift")
+vector_index = lazy_import("api.services.vector_index")
+
+
+
+
+def verified_password(request, db_obj):
+    """
+    Plain password of a complete database, taken from a credential lease ("db_lease") or from
+    "db_password" checked against its hash. Returns (password, None) or (None, error Response).
+    """
+    data = request.data
+    if data.get("db_lease"):
+        password = credential_lease.shared_leases().resolve(data["db_lease"], db_obj.id, request.user.id)
+        if password is None:
+            return None, Response({"ERROR": "Invalid or expired db_lease."}, status=status.HTTP_401_UNAUTHORIZED)
+        return password, None
+    if "db_password" not in data:
+        return None, Response({"ERROR": "db_password not provided."}, status=status.HTTP_400_BAD_REQUEST)
+    password = data["db_password"]
+    if not db_obj.check_password(password):
+        return None, Response({"ERROR": "Invalid db_password."}, status=status.HTTP_403_FORBIDDEN)
+    return password, None
 
 
 class UserList(generics.ListAPIView):
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related("databases").order_by("id")
     serializer_class = UserSerializer
+    pagination_class = IdCursorPagination
 
 
 class UserDetail(generics.RetrieveAPIView):
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related("databases")
     serializer_class = UserSerializer
 
 
@@ -79,13 +115,55 @@ class DatabaseDetail(APIView):
         serializer = DatabaseSerializer(database, data=request.data)
         if serializer.is_valid():
             serializer.save()
+            # A senha pode ter mudado: os leases emitidos deixam de valer
+            credential_lease.shared_leases().revoke_database(database.id)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     def delete(self, request, pk, format=None):
         database = self.get_object(pk)
+        # Remove os nós desse database da tabela vetorial consolidada
+        vector_index.store().delete_nodes(filters=vector_index.tenant_filters(database.id))
+        result_cache.shared_cache().invalidate(database.id)
+        credential_lease.shared_leases().revoke_database(database.id)
         database.delete()
-        # Deletar base de dados vetorial e as tables
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DatabaseLease(APIView):
+    """
+    Exchanges db_password, checked once, for a short-lived db_lease that later requests
+    send instead of the password, skipping the Argon2 check on every request.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, database, format=None):
+        try:
+            db_obj = Database.objects.get(id=database, user=request.user)
+        except Database.DoesNotExist:
+            return Response({"ERROR": "Database not found."}, status=status.HTTP_404_NOT_FOUND)
+        if db_obj.type != "complete":
+            return Response({"ERROR": "Leases are only needed for complete databases."}, status=status.HTTP_400_BAD_REQUEST)
+        if "db_password" not in request.data:
+            return Response({"ERROR": "db_password not provided."}, status=status.HTTP_400_BAD_REQUEST)
+        if not db_obj.check_password(request.data["db_password"]):
+            return Response({"ERROR": "Invalid db_password."}, status=status.HTTP_403_FORBIDDEN)
+
+        token = credential_lease.shared_leases().issue(
+            db_obj.id, request.user.id, request.data["db_password"], settings.CREDENTIAL_LEASE_TTL
+        )
+        return Response({"db_lease": token, "expires_in": settings.CREDENTIAL_LEASE_TTL}, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, database, format=None):
+        # Sem db_lease no corpo, revoga todos os leases do database
+        try:
+            db_obj = Database.objects.get(id=database, user=request.user)
+        except Database.DoesNotExist:
+            return Response({"ERROR": "Database not found."}, status=status.HTTP_404_NOT_FOUND)
+        if request.data.get("db_lease"):
+            credential_lease.shared_leases().revoke(request.data["db_lease"])
+        else:
+            credential_lease.shared_leases().revoke_database(db_obj.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -103,10 +181,9 @@ class TableList(APIView):
         data = request.data
         
         if db_obj.type == "complete":
-            try:
-                db_password = data["db_password"]
-            except KeyError:
-                return Response({"ERROR": "db_password not provided."}, status=status.HTTP_400_BAD_REQUEST)
+            db_password, error = verified_password(request, db_obj)
+            if error:
+                return error
             
             table_name = data.get("name")
             if db_obj.table_set.filter(name=table_name).exists():
@@ -118,25 +195,31 @@ class TableList(APIView):
             table_serializer = TableSerializer(data=data)
             
             if table_serializer.is_valid():
-                if db_obj.check_password(db_password):
+                if db_password is not None:
                     database_dict["password"] = db_password
                     connection_string = schemas.DatabaseConnection(**database_dict)
                     tables = [table.name for table in db_obj.table_set.all()]
-                    llm = LLMFactory.create_llm("gpt-4o")
-                    sql_generator = OpenAISQLGenerator(
+                    llm = rag_service.LLMFactory.create_llm("gpt-4o")
+                    sql_generator = rag_service.OpenAISQLGenerator(
                         llm=llm,
-                        prompt_strategy=SchemaSummaryPromptStrategy("postgresql")
+                        prompt_strategy=rag_service.SchemaSummaryPromptStrategy("postgresql"),
+                        database_id=db_obj.id,
                     )
-                    retriever = SQLTableRetriever(
+                    retriever = rag_service.SQLTableRetriever(
                         cnt_str=connection_string,
                         sql_generator=sql_generator,
                         tables=tables,
-                        have_obj_index=db_obj.have_obj_index
+                        have_obj_index=db_obj.have_obj_index,
+                        database_id=db_obj.id,
                     )
                     # Adiciona o schema da nova tabela ao índice do PGVector
                     retriever.add_table_schema(table_serializer.validated_data["name"])
                     
-                    table_serializer.save()
+                    # Assinatura do schema indexado, para a detecção de drift
+                    live = catalog.introspect(
+                        retriever.sql_database.engine, include=[table_serializer.validated_data["name"]]
+                    ).get(table_serializer.validated_data["name"])
+                    table_serializer.save(signature=catalog.signature(live) if live else None)
                     
                     # Se ainda não tiver o índice salvo, atualiza o flag
                     if not db_obj.have_obj_index:
@@ -153,32 +236,43 @@ class TableList(APIView):
             except KeyError:
                 return Response({"ERROR": "schemas not provided."}, status=status.HTTP_400_BAD_REQUEST)
             
-            only_schemas_formatted = generate_postgres_schemas(only_schemas)
+            try:
+                only_schemas_formatted = rag_service.generate_postgres_schemas(only_schemas)
+                signatures = {name: catalog.signature(table) for name, table in catalog.from_schema_rows(only_schemas).items()}
+            except ValueError as e:
+                return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             
             results = []
-            llm = LLMFactory.create_llm("gpt-4o")
-            sql_generator = OpenAISQLGenerator(
+            llm = rag_service.LLMFactory.create_llm("gpt-4o")
+            sql_generator = rag_service.OpenAISQLGenerator(
                 llm=llm,
-                prompt_strategy=SchemaSummaryPromptStrategy("postgresql")
+                prompt_strategy=rag_service.SchemaSummaryPromptStrategy("postgresql"),
+                database_id=db_obj.id,
             )
-            retriever_schema = SQLSchemaRetriever(database_dict["name"], sql_generator)
+            retriever_schema = rag_service.SQLSchemaRetriever(database_dict["name"], sql_generator, db_obj.id)
             
             for value in only_schemas_formatted:
+                # Nome no formato catalog.qualified_name, como as chaves das assinaturas
+                name = catalog.qualified_name(value['schema_name'], value['table_name'])
                 table_data = {
                     "database": database_dict["id"],
-                    "name": value['table_name']
+                    "name": name
                 }
                 table_serializer = TableSerializer(data=table_data)
                 
                 if table_serializer.is_valid():
                     # Salva o registro e adiciona o schema ao PGVector
-                    retriever_schema.add_table_schema(value['table_name'], value['schema'])
-                    table_serializer.save()
+                    retriever_schema.add_table_schema(
+                        value['table_name'], value['schema'], value['references'], value['schema_name']
+                    )
+                    table_serializer.save(signature=signatures.get(name))
                     results.append(table_serializer.data)
                 else:
                     # Caso ocorra erro de validação, adiciona os erros ao resultado
                     results.append({"errors": table_serializer.errors})
             
+            # O grafo de joins do workflow em cache foi montado com as tabelas antigas
+            rag_service.forget_workflows(db_obj.id)
             return Response(results, status=status.HTTP_201_CREATED)
         
         return Response({"ERROR": "Invalid database type."}, status=status.HTTP_400_BAD_REQUEST)
@@ -198,10 +292,115 @@ class TableList(APIView):
             databases = Database.objects.none()  # Retorna um queryset vazio se não estiver autenticado
 
         tables = Table.objects.filter(database=database)
-        serializer = TableSerializer(tables, many=True)
-        return Response(serializer.data)
+        paginator = IdCursorPagination()
+        page = paginator.paginate_queryset(tables, request, view=self)
+        serializer = TableSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
         # Buscar o id do db atual e listar todas as tabelas desse id    
 
+class TableBulkRegister(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, database, format=None):
+        """
+        Registra de uma vez todas as tabelas (ou as filtradas por nome/padrão LIKE em "tables"
+        e "exclude") do schema public de um database complete, lendo o catálogo uma única vez.
+        """
+        try:
+            db_obj = Database.objects.get(id=database, user=request.user)
+        except Database.DoesNotExist:
+            return Response({"ERROR": "Database not found."}, status=status.HTTP_404_NOT_FOUND)
+        if db_obj.type != "complete":
+            return Response({"ERROR": "Bulk registration requires a complete database."}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = request.data
+        db_password, error = verified_password(request, db_obj)
+        if error:
+            return error
+
+        database_dict = model_to_dict(db_obj)
+        database_dict["password"] = db_password
+        connection_string = schemas.DatabaseConnection(**database_dict)
+        registered = set(db_obj.table_set.values_list("name", flat=True))
+        llm = rag_service.LLMFactory.create_llm("gpt-4o")
+        sql_generator = rag_service.OpenAISQLGenerator(
+            llm=llm,
+            prompt_strategy=rag_service.SchemaSummaryPromptStrategy("postgresql"),
+            database_id=db_obj.id,
+        )
+        retriever = rag_service.SQLTableRetriever(
+            cnt_str=connection_string,
+            sql_generator=sql_generator,
+            tables=sorted(registered),
+            have_obj_index=db_obj.have_obj_index,
+            database_id=db_obj.id,
+        )
+
+        catalog_tables = catalog.introspect(
+            retriever.sql_database.engine,
+            include=data.get("tables"),
+            exclude=data.get("exclude"),
+        )
+        pending = [table for name, table in catalog_tables.items() if name not in registered]
+
+        # Cada lote já indexado no PGVector vira registros Table na mesma hora
+        created = []
+        for names in retriever.add_table_schemas(pending):
+            created += Table.objects.bulk_create([
+                Table(database=db_obj, name=name, signature=catalog.signature(catalog_tables[name])) for name in names
+            ])
+
+        if created and not db_obj.have_obj_index:
+            db_obj.have_obj_index = True
+            db_obj.save()
+
+        return Response({
+            "registered": TableSerializer(created, many=True).data,
+            "skipped": sorted(registered & set(catalog_tables)),
+        }, status=status.HTTP_201_CREATED)
+
+
+class TableSchemaDrift(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, database, format=None):
+        """
+        Compara o schema das tabelas registradas com o atual (catálogo do database complete,
+        ou o JSON "schemas" reenviado no minimal) e reindexa só as que mudaram.
+        """
+        try:
+            db_obj = Database.objects.get(id=database, user=request.user)
+        except Database.DoesNotExist:
+            return Response({"ERROR": "Database not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        data = request.data
+        if db_obj.type == "complete":
+            db_password, error = verified_password(request, db_obj)
+            if error:
+                return error
+            retriever = schema_drift.retriever_for(db_obj, db_password)
+            catalog_tables = schema_drift.live_catalog(db_obj, retriever)
+        elif db_obj.type == "minimal":
+            try:
+                catalog_tables = catalog.from_schema_rows(data["schemas"])
+            except KeyError:
+                return Response({"ERROR": "schemas not provided."}, status=status.HTTP_400_BAD_REQUEST)
+            except ValueError as e:
+                return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            retriever = schema_drift.retriever_for(db_obj)
+        else:
+            return Response({"ERROR": "Invalid database type."}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = schema_drift.refresh(
+            db_obj,
+            retriever,
+            catalog_tables,
+            reindex_unknown=bool(data.get("reindex_unknown", False)),
+            dry_run=bool(data.get("dry_run", False)),
+        )
+        return Response(report)
+
+
 class TableDetail(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerTable]
     
@@ -210,7 +409,7 @@ class TableDetail(APIView):
         Recupera a tabela garantindo que ela pertença ao database especificado e checa as permissões.
         """
         try:
-            table = Table.objects.get(pk=pk, database__id=database)
+            table = Table.objects.select_related("database").get(pk=pk, database__id=database)
             # Verifica as permissões para o objeto recuperado
             self.check_object_permissions(self.request, table)
             return table
@@ -250,10 +449,11 @@ class TableDetail(APIView):
         
         # Recupera a tabela com a verificação de permissão
         table = self.get_object(database, pk)
-        llm=LLMFactory.create_llm("gpt-4o")
-        sql_generator = OpenAISQLGenerator(
+        llm=rag_service.LLMFactory.create_llm("gpt-4o")
+        sql_generator = rag_service.OpenAISQLGenerator(
             llm=llm,
-            prompt_strategy=SchemaSummaryPromptStrategy("postgresql")
+            prompt_strategy=rag_service.SchemaSummaryPromptStrategy("postgresql"),
+            database_id=db_obj.id,
         )
         # Para manipular o schema, preparamos a conexão ou instanciamos o retriever conforme o tipo
         if db_obj.type == "complete":
@@ -261,17 +461,19 @@ class TableDetail(APIView):
             database_dict = model_to_dict(db_obj)
             connection_string = schemas.DatabaseConnection(**database_dict)
             tables = [table_obj.name for table_obj in db_obj.table_set.all()]
-            retriever = SQLTableRetriever(
+            retriever = rag_service.SQLTableRetriever(
                 cnt_str=connection_string, 
                 sql_generator=sql_generator, 
                 tables=tables, 
-                have_obj_index=db_obj.have_obj_index
+                have_obj_index=db_obj.have_obj_index,
+                database_id=db_obj.id,
             )                                
             retriever.delete_table_schema(table.name)
         elif db_obj.type == "minimal":
             # Para o modo minimal, utiliza o SQLSchemaRetriever
-            retriever = SQLSchemaRetriever(db_obj.name, sql_generator)
+            retriever = rag_service.SQLSchemaRetriever(db_obj.name, sql_generator, db_obj.id)
             retriever.delete_table_schema(table.name)
+            rag_service.forget_workflows(db_obj.id)
         else:
             return Response({"ERROR": "Invalid database type."}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -291,43 +493,63 @@ class QuestionAnswerList(APIView):
         except:
             return Response({"ERROR":"Database not found"}, status=status.HTTP_404_NOT_FOUND)    
         data = request.data 
+        # Prazo da requisição (segundos, opcional), contado desde já
+        try:
+            deadline = deadlines.for_request(data.pop("deadline", None))
+        except ValueError as e:
+            return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
  
         if db_obj.type == "complete":
-            try: 
-                print("question answer try db_password")
-                db_password = data["db_password"]    
-            except:
-                return Response({"ERROR": "db_password password not provided"}, status=status.HTTP_400_BAD_REQUEST)     
+            print("question answer try db_password")
+            db_password, error = verified_password(request, db_obj)
+            if error:
+                return error
     
             data["database"] = db_obj.id
-            data.pop("db_password", None)
+            # Só SQL e linhas, sem a síntese da resposta (text_to_sql)
+            data_only = str(data.pop("data_only", False)).lower() in ("true", "1")
             serializer = QuestionAnswerSerializer(data=data)
             print("--------- view question linha 0")                
             if serializer.is_valid():            
                 print("--------- view question linha 1")                
-                if db_obj.check_password(db_password):
+                if db_password is not None:
                     database_dict["password"] = db_password
                     connection_string = schemas.DatabaseConnection(**database_dict)    
                     tables = [table.name for table in db_obj.table_set.all()]
 
                     print("--------- view question linha 2")                
                     
-                    response = asyncio.run(starts_workflow(
+                    response = asyncio.run(rag_service.starts_workflow(
                         cnt_str=connection_string, 
                         tables=tables, 
                         user_question=data["question"],
                         have_obj_index=db_obj.have_obj_index,
-                        prompt_type=data["prompt_type"]
+                        prompt_type=data["prompt_type"],
+                        database_id=db_obj.id,
+                        result_cache_ttl=db_obj.result_cache_ttl,
+                        data_only=data_only and data["prompt_type"] == "text_to_sql",
+                        deadline=deadline,
                     ))
                     print("VIEW response", response)
                     print("--------- view question linha 3")
                     if data["prompt_type"] == "text_to_sql":
                         serializer.validated_data["answer"] = response.natural_language_response
                         serializer.validated_data["query"] = response.sql_query
+                        # Resultado parcial (sem síntese) também fica salvo para o /synthesis
+                        if isinstance(response, schemas.WorkflowResult) and response.data is not None and (
+                            data_only or response.timed_out
+                        ):
+                            serializer.validated_data["result"] = response.data.model_dump()
                     else:
                         serializer.validated_data["answer"] = response.natural_language_response
                         serializer.validated_data["query"] = response.sql_query
                     serializer.save()
+                    if isinstance(response, schemas.WorkflowResult) and (response.guard_reason or response.timed_out):
+                        return Response(
+                            {**serializer.data, "executed": response.executed, "guard_reason": response.guard_reason,
+                             "timed_out": response.timed_out},
+                            status=status.HTTP_201_CREATED,
+                        )
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)    
         if db_obj.type == "minimal":
@@ -338,16 +560,20 @@ class QuestionAnswerList(APIView):
             if serializer.is_valid():            
                 print("--------- view question linha 1")                
                 
-                response = asyncio.run(starts_simple_workflow(     
+                response = asyncio.run(rag_service.starts_simple_workflow(     
                     user_question=data["question"],
                     db_name=db_obj.name,
-                    prompt_type=data["prompt_type"]
+                    prompt_type=data["prompt_type"],
+                    database_id=db_obj.id,
+                    deadline=deadline,
                 ))
                 # print("VIEW response", response)
                 print("--------- view question linha 3")
                 serializer.validated_data["answer"] = response.natural_language_response
                 serializer.validated_data["query"] = response.sql_query
                 serializer.save()
+                if isinstance(response, schemas.WorkflowResult) and response.timed_out:
+                    return Response({**serializer.data, "timed_out": True}, status=status.HTTP_201_CREATED)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)    
 
@@ -355,10 +581,33 @@ class QuestionAnswerList(APIView):
     def get(self, request, database, format=None):
         # Buscar o id do db atual e listar todas as tabelas desse id
         questions = QuestionAnswer.objects.filter(database=database)
-        serializer = QuestionAnswerSerializer(questions, many=True)
-        return Response(serializer.data)
+        paginator = IdCursorPagination()
+        page = paginator.paginate_queryset(questions, request, view=self)
+        serializer = QuestionAnswerSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
 
 
+        
+
 
+class QuestionAnswerSynthesis(APIView):
+    """Synthesizes, on demand, the answer of a question asked in data-only mode."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, database, pk, format=None):
+        try:
+            question = QuestionAnswer.objects.get(pk=pk, database=database, database__user=request.user)
+        except QuestionAnswer.DoesNotExist:
+            return Response({"ERROR": "Question not found"}, status=status.HTTP_404_NOT_FOUND)
+        if question.result is None:
+            return Response({"ERROR": "Question has no stored result to synthesize"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not question.answer:
+            question.answer = rag_service.synthesize_answer(
+                question.question, question.query, schemas.QueryRows(**question.result), database
+            )
+            question.save(update_fields=["answer"])
+        return Response(QuestionAnswerSerializer(question).data)
 
-        
\ No newline at end of file
@@ -156,3 +156,137 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 #############################################################
 #############################################################
+
+# LLM backend: 'openai' (default) or 'stub', a deterministic local stand-in
+# for load tests, CI and offline capacity planning (api/services/llm_stub.py)
+LLM_BACKEND = config('LLM_BACKEND', default='openai')
+LLM_STUB_LATENCY_MS = config('LLM_STUB_LATENCY_MS', default=0, cast=float)
+LLM_STUB_LATENCY_JITTER_MS = config('LLM_STUB_LATENCY_JITTER_MS', default=0, cast=float)
+LLM_STUB_ERROR_RATE = config('LLM_STUB_ERROR_RATE', default=0, cast=float)
+LLM_STUB_SEED = config('LLM_STUB_SEED', default=0, cast=int)
+
+# ANN index of the pgvector tables: 'hnsw', 'ivfflat' or 'none' (sequential scan).
+# HNSW is created with the vector table; IVFFlat needs data to train its lists and is
+# built by `python manage.py vector_indexes build` (CONCURRENTLY) once the table is loaded.
+VECTOR_INDEX_TYPE = config('VECTOR_INDEX_TYPE', default='hnsw')
+VECTOR_INDEX_HNSW_M = config('VECTOR_INDEX_HNSW_M', default=16, cast=int)
+VECTOR_INDEX_HNSW_EF_CONSTRUCTION = config('VECTOR_INDEX_HNSW_EF_CONSTRUCTION', default=64, cast=int)
+VECTOR_INDEX_HNSW_EF_SEARCH = config('VECTOR_INDEX_HNSW_EF_SEARCH', default=40, cast=int)
+VECTOR_INDEX_IVFFLAT_LISTS = config('VECTOR_INDEX_IVFFLAT_LISTS', default=100, cast=int)
+VECTOR_INDEX_IVFFLAT_PROBES = config('VECTOR_INDEX_IVFFLAT_PROBES', default=10, cast=int)
+
+# Consolidated vector table (data_<VECTOR_TABLE_NAME>) holding the schema nodes of every
+# registered database, keyed by Database.id. VECTOR_TABLE_PARTITIONS > 0 creates it HASH
+# partitioned by tenant. Existing per-database tables: `python manage.py migrate_vector_tables`.
+VECTOR_TABLE_NAME = config('VECTOR_TABLE_NAME', default='schema_nodes')
+VECTOR_TABLE_PARTITIONS = config('VECTOR_TABLE_PARTITIONS', default=0, cast=int)
+# Keeps filtered ANN scans going until k rows of the tenant are found (pgvector >= 0.8); '' disables.
+# On older pgvector it is skipped and HNSW searches use VECTOR_INDEX_FALLBACK_EF_SEARCH instead
+# (IVFFlat probes every list)
+VECTOR_INDEX_ITERATIVE_SCAN = config('VECTOR_INDEX_ITERATIVE_SCAN', default='relaxed_order')
+VECTOR_INDEX_FALLBACK_EF_SEARCH = config('VECTOR_INDEX_FALLBACK_EF_SEARCH', default=400, cast=int)
+
+# Bulk registration of complete-mode databases (POST databases/<id>/tables/bulk):
+# concurrent LLM summaries and nodes embedded/inserted per batch
+CATALOG_SUMMARY_CONCURRENCY = config('CATALOG_SUMMARY_CONCURRENCY', default=8, cast=int)
+CATALOG_INSERT_BATCH = config('CATALOG_INSERT_BATCH', default=64, cast=int)
+
+# Cache of executed SQL results, per process, keyed by (database, normalized SQL).
+# Database.result_cache_ttl overrides the TTL per database (0 disables it there).
+RESULT_CACHE_TTL = config('RESULT_CACHE_TTL', default=300, cast=int)
+RESULT_CACHE_MAX_ENTRIES = config('RESULT_CACHE_MAX_ENTRIES', default=1024, cast=int)
+RESULT_CACHE_MAX_PAYLOAD_BYTES = config('RESULT_CACHE_MAX_PAYLOAD_BYTES', default=1048576, cast=int)
+
+# EXPLAIN (without ANALYZE) of the generated SQL before it runs. Plans over the estimated
+# cost or rows are rejected ('reject'), or wrapped in LIMIT SQL_GUARD_LIMIT_ROWS and planned
+# again ('limit'); 'off' disables the guard
+SQL_GUARD_MODE = config('SQL_GUARD_MODE', default='limit')
+SQL_GUARD_MAX_COST = config('SQL_GUARD_MAX_COST', default=1000000, cast=float)
+SQL_GUARD_MAX_ROWS = config('SQL_GUARD_MAX_ROWS', default=100000, cast=int)
+SQL_GUARD_LIMIT_ROWS = config('SQL_GUARD_LIMIT_ROWS', default=1000, cast=int)
+
+# Generated queries run in read-only transactions; statement_timeout is the time left in the
+# workflow, capped by SQL_STATEMENT_TIMEOUT (seconds)
+SQL_STATEMENT_TIMEOUT = config('SQL_STATEMENT_TIMEOUT', default=30, cast=float)
+# Rows kept from a generated query (returned in data-only mode and given to response synthesis)
+SQL_RESULT_MAX_ROWS = config('SQL_RESULT_MAX_ROWS', default=1000, cast=int)
+
+# Credential leases (POST databases/<id>/lease): db_password is checked once and exchanged for
+# a token kept only in this process's memory, valid for CREDENTIAL_LEASE_TTL seconds
+CREDENTIAL_LEASE_TTL = config('CREDENTIAL_LEASE_TTL', default=900, cast=int)
+CREDENTIAL_LEASE_MAX_ENTRIES = config('CREDENTIAL_LEASE_MAX_ENTRIES', default=10000, cast=int)
+
+# Keyset (cursor) pagination of the list endpoints; clients may ask ?page_size= up to the max
+API_PAGE_SIZE = config('API_PAGE_SIZE', default=50, cast=int)
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=500, cast=int)
+
+# Import time budget of a fresh worker (core.wsgi/core.asgi plus the URL conf), checked by the
+# test suite; `python manage.py import_report` lists the heaviest imports
+STARTUP_IMPORT_BUDGET_MS = config('STARTUP_IMPORT_BUDGET_MS', default=1500, cast=int)
+
+# Worker prewarm (gunicorn post_fork in gunicorn-cfg.py, or `python manage.py prewarm`):
+# RAG stack, LLM client, pgvector pool and the retrievers of the most recently asked databases.
+# Complete databases need their plain password in PREWARM_CREDENTIALS ({"<id>": "<password>"})
+PREWARM_ENABLED = config('PREWARM_ENABLED', default=True, cast=bool)
+PREWARM_DATABASES = config('PREWARM_DATABASES', default=5, cast=int)
+PREWARM_CREDENTIALS = config('PREWARM_CREDENTIALS', default='')
+# Complete databases whose pool and reflected tables are kept per process
+TARGET_DATABASE_CACHE_SIZE = config('TARGET_DATABASE_CACHE_SIZE', default=32, cast=int)
+# Workflows kept per (database, prompt_type) and shared by concurrent requests
+WORKFLOW_CACHE_SIZE = config('WORKFLOW_CACHE_SIZE', default=128, cast=int)
+
+# LLM model per task (text_to_sql, synthesize_response, optimize_sql, explain_sql, fix_sql,
+# schema_summary), as JSON: {"explain_sql": "gpt-4o-mini", "text_to_sql": ["gpt-4o", "gpt-4-turbo"]}.
+# A list gives fallbacks tried on API errors. LLM_MODEL_OVERRIDES: {"<database id>": {task: model}}
+LLM_MODEL_ROUTES = config('LLM_MODEL_ROUTES', default='')
+LLM_MODEL_OVERRIDES = config('LLM_MODEL_OVERRIDES', default='')
+
+# Hedged LLM calls: a call still running after the LLM_HEDGE_PERCENTILE of the recent latencies
+# of its (task, model) gets a duplicate; the first valid response wins. Hedges never exceed
+# LLM_HEDGE_MAX_FRACTION of the calls, and start after LLM_HEDGE_MIN_SAMPLES latencies
+LLM_HEDGE_ENABLED = config('LLM_HEDGE_ENABLED', default=False, cast=bool)
+LLM_HEDGE_PERCENTILE = config('LLM_HEDGE_PERCENTILE', default=95, cast=float)
+LLM_HEDGE_MAX_FRACTION = config('LLM_HEDGE_MAX_FRACTION', default=0.05, cast=float)
+LLM_HEDGE_MIN_SAMPLES = config('LLM_HEDGE_MIN_SAMPLES', default=20, cast=int)
+LLM_HEDGE_WINDOW = config('LLM_HEDGE_WINDOW', default=200, cast=int)
+LLM_HEDGE_MAX_WORKERS = config('LLM_HEDGE_MAX_WORKERS', default=32, cast=int)
+
+# Generated SQL is checked against the reflected catalog before it runs; tables or columns
+# that do not exist go back to the LLM at most SQL_REPAIR_MAX_ATTEMPTS times (0 only logs them)
+SQL_REPAIR_MAX_ATTEMPTS = config('SQL_REPAIR_MAX_ATTEMPTS', default=1, cast=int)
+
+# Wide tables: tables with at least COLUMN_NODES_MIN_COLUMNS columns (e.g. 100; 0 disables) also get
+# one vector node per column, and prompts describe them with the COLUMN_RETRIEVAL_TOP_K columns
+# closest to the question plus their primary/foreign keys
+COLUMN_NODES_MIN_COLUMNS = config('COLUMN_NODES_MIN_COLUMNS', default=0, cast=int)
+COLUMN_RETRIEVAL_TOP_K = config('COLUMN_RETRIEVAL_TOP_K', default=25, cast=int)
+
+# Join paths: after vector retrieval, the tables missing on the shortest foreign-key paths (up to
+# JOIN_PATH_MAX_HOPS joins) between the retrieved ones are added while the prompt keeps at most
+# JOIN_PATH_MAX_TABLES tables
+JOIN_PATH_MAX_TABLES = config('JOIN_PATH_MAX_TABLES', default=6, cast=int)
+JOIN_PATH_MAX_HOPS = config('JOIN_PATH_MAX_HOPS', default=3, cast=int)
+
+# Adaptive top-k: retrievers fetch RETRIEVAL_MAX_K candidates and keep those scoring at least
+# RETRIEVAL_SCORE_THRESHOLD and within RETRIEVAL_RELATIVE_GAP (fraction) of the best score (0
+# disables either), never fewer than RETRIEVAL_MIN_K and while their schemas fit in
+# RETRIEVAL_TOKEN_BUDGET (estimated) tokens
+RETRIEVAL_MIN_K = config('RETRIEVAL_MIN_K', default=1, cast=int)
+RETRIEVAL_MAX_K = config('RETRIEVAL_MAX_K', default=5, cast=int)
+RETRIEVAL_SCORE_THRESHOLD = config('RETRIEVAL_SCORE_THRESHOLD', default=0.0, cast=float)
+RETRIEVAL_RELATIVE_GAP = config('RETRIEVAL_RELATIVE_GAP', default=0.15, cast=float)
+RETRIEVAL_TOKEN_BUDGET = config('RETRIEVAL_TOKEN_BUDGET', default=3000, cast=int)
+
+# Request deadline: every question has a time budget (seconds; the client may send its own
+# "deadline", capped by REQUEST_DEADLINE_MAX). Retrieval may use REQUEST_DEADLINE_RETRIEVAL_SHARE
+# of what is left and the EXPLAIN cost guard REQUEST_DEADLINE_GUARD_SHARE, LLM calls (made
+# without client retries) and the generated query get the rest, and optional LLM calls
+# (repair, synthesis) are skipped with less than REQUEST_DEADLINE_MIN_LLM_CALL left, returning
+# the partial result. A run still going REQUEST_DEADLINE_GRACE after its deadline is abandoned
+REQUEST_DEADLINE_DEFAULT = config('REQUEST_DEADLINE_DEFAULT', default=30, cast=float)
+REQUEST_DEADLINE_MAX = config('REQUEST_DEADLINE_MAX', default=120, cast=float)
+REQUEST_DEADLINE_RETRIEVAL_SHARE = config('REQUEST_DEADLINE_RETRIEVAL_SHARE', default=0.3, cast=float)
+REQUEST_DEADLINE_GUARD_SHARE = config('REQUEST_DEADLINE_GUARD_SHARE', default=0.2, cast=float)
+REQUEST_DEADLINE_MIN_LLM_CALL = config('REQUEST_DEADLINE_MIN_LLM_CALL', default=2.0, cast=float)
+REQUEST_DEADLINE_GRACE = config('REQUEST_DEADLINE_GRACE', default=5.0, cast=float)
+REQUEST_DEADLINE_MAX_WORKERS = config('REQUEST_DEADLINE_MAX_WORKERS', default=32, cast=int)
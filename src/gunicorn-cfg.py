@@ -9,3 +9,19 @@ accesslog = '-'
 loglevel = 'debug'
 capture_output = True
 enable_stdio_inheritance = True
+
+
+def post_fork(server, worker):
+    """Prewarms the worker (RAG stack, pools, retrievers) before it accepts requests."""
+    import os
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+
+    django.setup()
+    from core import settings
+
+    if settings.PREWARM_ENABLED:
+        from api.services import prewarm
+
+        prewarm.run(log=server.log.info, notify=worker.notify)